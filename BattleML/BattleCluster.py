@@ -2,50 +2,155 @@ from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import StandardScaler
-import umap
-import hdbscan
+import os
+import sys
+import joblib
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from BattleStore import load_wars, apply_schema, CLUSTER_MODEL
+from FeatureRegistry import CLUSTER_FEATURES
+from FastRender import FAST, batched_labels
+from Instrument import stage
 
-df = pd.read_csv('./BattleML/data/wars.csv')
+MODEL_PATH = CLUSTER_MODEL
 
-features = [
-    'log_att_str', 'log_def_str', 'log_att_cas', 'log_def_cas',
-    'log_total_troops', 'log_force_ratio', 'log_exchange_ratio',
-    'att_loss_pct', 'def_loss_pct', 'casualty_intensity',
-    'ach_diff', 'attacker_underdog',
-    'log_duration1', 'wofa', 'wofd',
-    'surpa', 'morala', 'momnta', 'techa', 'inita', 'mobila',
-]
+features = list(CLUSTER_FEATURES)
 
-X = df[features].astype(float)
-X = SimpleImputer(strategy='median').fit_transform(X)
-X = StandardScaler().fit_transform(X)
 
-pca = PCA(n_components=min(10, X.shape[1]), random_state=42).fit_transform(X)
-emb = umap.UMAP(n_neighbors=15, min_dist=0.1, random_state=42).fit_transform(pca)
-kmeans = KMeans(n_clusters=8, random_state=42).fit_predict(pca)
-hdb = hdbscan.HDBSCAN(min_cluster_size=5).fit_predict(pca)
+# ── Fit ──────────────────────────────────────────────────────────────────────
+def standardize(df):
+    X = df[features].astype(float)
+    imputer = SimpleImputer(strategy='median').fit(X)
+    scaler  = StandardScaler().fit(imputer.transform(X))
+    return scaler.transform(imputer.transform(X)), imputer, scaler
 
-df['umap_x'], df['umap_y'] = emb[:, 0], emb[:, 1]
-df['kmeans'], df['hdbscan'] = kmeans, hdb
 
-df.to_csv('./BattleML/data/battles_clustered.csv', index=False)
+def fit_pipeline(df):
+    # umap and hdbscan are imported here, not at module level, so importing
+    # standardize / project does not need them
+    import umap
+    import hdbscan
 
-plt.figure(figsize=(12, 6))
-sns.scatterplot(data=df, x='umap_x', y='umap_y', hue='kmeans', palette='tab10', s=60)
-for _, row in df.iterrows():
-    plt.annotate(row['name'], (row['umap_x'], row['umap_y']), fontsize=4, alpha=0.5)
-plt.savefig('./BattleML/data/battleclusters_umap.png', dpi=200)
-plt.close()
+    n = len(df)
+    with stage('standardize', rows=n):
+        Xs, imputer, scaler = standardize(df)
 
-print(df['kmeans'].value_counts().sort_index())
+    with stage('pca', rows=n):
+        pca     = PCA(n_components=min(10, Xs.shape[1]), random_state=42).fit(Xs)
+        Z       = pca.transform(Xs)
+    with stage('umap', rows=n):
+        reducer = umap.UMAP(n_neighbors=15, min_dist=0.1, random_state=42).fit(Z)
+    with stage('kmeans', rows=n):
+        km      = KMeans(n_clusters=8, random_state=42).fit(Z)
+    with stage('hdbscan', rows=n):
+        hdb     = hdbscan.HDBSCAN(min_cluster_size=5, prediction_data=True).fit(Z)
 
-for cluster in sorted(df['kmeans'].unique()):
-    print(f"\n{'='*50}")
-    print(f"CLUSTER {cluster} ({len(df[df['kmeans']==cluster])} battles)")
-    print(df[df['kmeans']==cluster][['name','war4']].head(8).to_string())
+    return {
+        'features': features,
+        'imputer':  imputer,
+        'scaler':   scaler,
+        'pca':      pca,
+        'umap':     reducer,
+        'kmeans':   km,
+        'hdbscan':  hdb,
+        # Training assignments, so known battles keep their exact labels
+        'train': pd.DataFrame({
+            'isqno':   df['isqno'].values,
+            'umap_x':  reducer.embedding_[:, 0],
+            'umap_y':  reducer.embedding_[:, 1],
+            'kmeans':  km.labels_,
+            'hdbscan': hdb.labels_,
+        }),
+    }
 
-print(df.groupby('kmeans')[['log_att_str', 'log_def_str', 'casualty_intensity', 
-                             'ach_diff', 'duration1']].median().round(3))
\ No newline at end of file
+
+def save_pipeline(model, path=MODEL_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(model, path)
+
+
+def load_pipeline(path=MODEL_PATH):
+    return joblib.load(path)
+
+
+# ── Out-of-sample assignment ─────────────────────────────────────────────────
+def project(model, rows):
+    X = rows[model['features']].astype(float)
+    return model['pca'].transform(model['scaler'].transform(model['imputer'].transform(X)))
+
+
+def assign(model, rows, embed=True):
+    """Cluster new battles through the saved pipeline without refitting."""
+    import hdbscan
+
+    Z = project(model, rows)
+    hdb_labels, hdb_strength = hdbscan.approximate_predict(model['hdbscan'], Z)
+    out = pd.DataFrame({
+        'isqno':            rows['isqno'].values,
+        'kmeans':           model['kmeans'].predict(Z),
+        'hdbscan':          hdb_labels,
+        'hdbscan_strength': hdb_strength,
+    })
+    if embed:
+        emb = model['umap'].transform(Z)
+        out['umap_x'], out['umap_y'] = emb[:, 0], emb[:, 1]
+    return out
+
+
+def cluster(df, model):
+    """Training battles keep their fitted labels; anything new is assigned."""
+    known = df['isqno'].isin(model['train']['isqno'])
+    out   = df.merge(model['train'], on='isqno', how='left')
+    if (~known).any():
+        new = assign(model, df[~known.values]).drop(columns='hdbscan_strength').set_index('isqno')
+        idx = out['isqno'].isin(new.index)
+        for col in ['umap_x', 'umap_y', 'kmeans', 'hdbscan']:
+            out.loc[idx, col] = new.loc[out.loc[idx, 'isqno'], col].values
+    return out, int((~known).sum())
+
+
+if __name__ == '__main__':
+    df = load_wars()
+
+    # Refit only when asked (or when nothing has been fitted yet): a refit can
+    # renumber the KMeans clusters behind BattlePaths.cluster_names.
+    if '--refit' in sys.argv or not os.path.exists(MODEL_PATH):
+        with stage('fit_pipeline', rows=len(df)):
+            model = fit_pipeline(df)
+            save_pipeline(model)
+        print(f"Fitted and saved: {MODEL_PATH}")
+    else:
+        with stage('load_pipeline'):
+            model = load_pipeline()
+
+    with stage('assign', rows=len(df)) as sp:
+        df, n_new = cluster(df, model)
+        sp.count(n_new)                        # assigned out of sample
+    print(f"Assigned {n_new} new battles with the saved pipeline")
+
+    df = apply_schema(df)
+    with stage('write battles_clustered.csv', rows=len(df)):
+        df.to_csv('./BattleML/data/battles_clustered.csv', index=False)
+
+    with stage('plot battleclusters_umap.png', rows=len(df)):
+        plt.figure(figsize=(12, 6))
+        sns.scatterplot(data=df, x='umap_x', y='umap_y', hue='kmeans', palette='tab10', s=60)
+        if FAST:
+            batched_labels(plt.gca(), df['umap_x'], df['umap_y'], df['name'], fontsize=4, offset=(0, 0))
+        else:
+            for _, row in df.iterrows():
+                plt.annotate(row['name'], (row['umap_x'], row['umap_y']), fontsize=4, alpha=0.5)
+        with stage('savefig'):
+            plt.savefig('./BattleML/data/battleclusters_umap.png', dpi=200)
+        plt.close()
+
+    print(df['kmeans'].value_counts().sort_index())
+
+    for cluster_id in sorted(df['kmeans'].unique()):
+        print(f"\n{'='*50}")
+        print(f"CLUSTER {cluster_id} ({len(df[df['kmeans']==cluster_id])} battles)")
+        print(df[df['kmeans']==cluster_id][['name','war4']].head(8).to_string())
+
+    print(df.groupby('kmeans')[['log_att_str', 'log_def_str', 'casualty_intensity',
+                                 'ach_diff', 'duration1']].median().round(3))
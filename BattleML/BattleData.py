@@ -1,31 +1,16 @@
 import pandas as pd
-import numpy as np
+from BattleStore import run_stages, apply_schema, memory_report
+from FeatureRegistry import evaluate, with_features, derived, spec
+from Instrument import stage
 
 Load_Path = './BattleML/CDB90/data'
 
-battles         = pd.read_csv(f"{Load_Path}/battles.csv")
-belligerents    = pd.read_csv(f"{Load_Path}/belligerents.csv")
-durations       = pd.read_csv(f"{Load_Path}/battle_durations.csv")
-front_widths    = pd.read_csv(f"{Load_Path}/front_widths.csv")
-terrain         = pd.read_csv(f"{Load_Path}/terrain.csv")
-weather         = pd.read_csv(f"{Load_Path}/weather.csv")
-battle_actors   = pd.read_csv(f"{Load_Path}/battle_actors.csv")
+# ── Stages ───────────────────────────────────────────────────────────────────
+# Each stage is cached in data/cache/stages, keyed on its code, params, the
+# CSVs it reads and its upstream stages (see BattleStore.run_stages).  Tweak
+# a feature in FeatureRegistry.py and only 'features' re-runs; the joins are
+# loaded.
 
-# ── Pivot belligerents into attacker / defender ──────────────────────────────
-att = belligerents[belligerents['attacker'] == 1].add_prefix('att_').rename(columns={'att_isqno': 'isqno'})
-dfd = belligerents[belligerents['attacker'] == 0].add_prefix('def_').rename(columns={'def_isqno': 'isqno'})
-
-# ── Flat join ────────────────────────────────────────────────────────────────
-df = (battles
-      .merge(att, on='isqno')
-      .merge(dfd, on='isqno')
-      .merge(durations[['isqno', 'duration1']], on='isqno', how='left')
-      .merge(front_widths.groupby('isqno')[['wofa', 'wofd']].first().reset_index(), on='isqno', how='left')
-      .merge(terrain.groupby('isqno').first().reset_index(), on='isqno', how='left')
-      .merge(weather.groupby('isqno').first().reset_index(), on='isqno', how='left')
-)
-
-# ── Select features ──────────────────────────────────────────────────────────
 feature_cols = [
     'isqno', 'name', 'war', 'war4',
     'att_str', 'def_str', 'att_cas', 'def_cas',
@@ -38,10 +23,6 @@ feature_cols = [
     'surpa', 'morala', 'momnta', 'techa', 'inita', 'mobila',
 ]
 
-df_feat = df[feature_cols].copy()
-df_feat[['att_tank', 'def_tank']] = df_feat[['att_tank', 'def_tank']].fillna(0)
-
-# ── Impute ───────────────────────────────────────────────────────────────────
 impute_cols = [
     'att_arty', 'def_arty', 'att_cav', 'def_cav',
     'inita', 'mobila', 'morala', 'techa', 'momnta',
@@ -50,37 +31,105 @@ impute_cols = [
     'duration1', 'wx1', 'att_pri1', 'def_pri1',
 ]
 
-for col in impute_cols:
-    if df_feat[col].dtype == object or pd.api.types.is_string_dtype(df_feat[col]):
-        df_feat[col] = df_feat[col].fillna(df_feat[col].mode()[0])
-    else:
-        df_feat[col] = df_feat[col].fillna(df_feat[col].median())
 
-print(f"Nulls remaining: {df_feat.isnull().sum().sum()}")
-print(f"Shape: {df_feat.shape}")
+# ── Pivot belligerents into attacker / defender ──────────────────────────────
+def pivot(belligerents=None):
+    if belligerents is None:
+        belligerents = pd.read_csv(f"{Load_Path}/belligerents.csv")
+    att = belligerents[belligerents['attacker'] == 1].add_prefix('att_').rename(columns={'att_isqno': 'isqno'})
+    dfd = belligerents[belligerents['attacker'] == 0].add_prefix('def_').rename(columns={'def_isqno': 'isqno'})
+    return att.merge(dfd, on='isqno')
+
+
+# ── Flat join ────────────────────────────────────────────────────────────────
+def join(sides, tables=None):
+    # tables: the five frames below already loaded (ChunkedBuild passes one partition)
+    tables = tables or {t: pd.read_csv(f"{Load_Path}/{t}.csv")
+                        for t in ['battles', 'battle_durations', 'front_widths', 'terrain', 'weather']}
+    battles      = tables['battles']
+    durations    = tables['battle_durations']
+    front_widths = tables['front_widths']
+    terrain      = tables['terrain']
+    weather      = tables['weather']
+    return (battles
+            .merge(sides, on='isqno')
+            .merge(durations[['isqno', 'duration1']], on='isqno', how='left')
+            .merge(front_widths.groupby('isqno')[['wofa', 'wofd']].first().reset_index(), on='isqno', how='left')
+            .merge(terrain.groupby('isqno').first().reset_index(), on='isqno', how='left')
+            .merge(weather.groupby('isqno').first().reset_index(), on='isqno', how='left')
+    )
+
+
+# ── Select features ──────────────────────────────────────────────────────────
+def select(df, cols):
+    df_feat = df[cols].copy()
+    df_feat[['att_tank', 'def_tank']] = df_feat[['att_tank', 'def_tank']].fillna(0)
+    return df_feat
+
+
+# ── Impute ───────────────────────────────────────────────────────────────────
+def is_text(s):
+    return s.dtype == object or pd.api.types.is_string_dtype(s)
+
+
+def impute(df_feat, cols, fills=None):
+    # fills: precomputed fill value per column (ChunkedBuild's sketches)
+    df_feat = df_feat.copy()
+    for col in cols:
+        if fills is not None:
+            df_feat[col] = df_feat[col].fillna(fills[col])
+        elif is_text(df_feat[col]):
+            df_feat[col] = df_feat[col].fillna(df_feat[col].mode()[0])
+        else:
+            df_feat[col] = df_feat[col].fillna(df_feat[col].median())
+    return df_feat
+
+
+# ── Engineer features (FeatureRegistry.py) ──────────────────────────────────
+def engineer(df_feat):
+    """Derived features only, unclipped (ChunkedBuild sketches their caps from these)."""
+    return with_features(df_feat, evaluate(df_feat, derived(), clip=False, log=False))
+
+
+def features(df_feat, caps=None):
+    """Every registered feature, clipped and log-transformed, in one pass.
+
+    caps: per-feature caps instead of this frame's 99th percentiles.
+    """
+    return with_features(df_feat, evaluate(df_feat, caps=caps))
+
+
+def _sources(*names):
+    return [f"{Load_Path}/{n}.csv" for n in names]
+
+STAGES = [
+    ('pivot',     pivot,     [],            _sources('belligerents'), None),
+    ('join',      join,      ['pivot'],     _sources('battles', 'battle_durations', 'front_widths',
+                                                     'terrain', 'weather'), None),
+    ('select',    select,    ['join'],      [], {'cols': feature_cols}),
+    ('impute',    impute,    ['select'],    [], {'cols': impute_cols}),
+    ('features',  features,  ['impute'],    [], None),
+]
 
-# ── Engineer features ────────────────────────────────────────────────────────
-df_feat['force_ratio']        = df_feat['att_str'] / df_feat['def_str']
-df_feat['att_loss_pct']       = df_feat['att_cas'] / df_feat['att_str']
-df_feat['def_loss_pct']       = df_feat['def_cas'] / df_feat['def_str']
-df_feat['exchange_ratio']     = df_feat['att_cas'] / df_feat['def_cas'].replace(0, np.nan)
-df_feat['total_troops']       = df_feat['att_str'] + df_feat['def_str']
-df_feat['casualty_intensity'] = (df_feat['att_cas'] + df_feat['def_cas']) / df_feat['total_troops']
-df_feat['attacker_underdog']  = (df_feat['force_ratio'] < 0.80).astype(int)
-df_feat['ach_diff']           = df_feat['att_ach'] - df_feat['def_ach']
+if __name__ == '__main__':
+    # 'features' is also keyed on the registry's contents
+    df_feat, report = run_stages(STAGES, extra_keys={'features': spec()})
 
-# ── Cap outliers at 99th percentile ─────────────────────────────────────────
-for col in ['exchange_ratio', 'att_loss_pct', 'def_loss_pct', 'casualty_intensity', 'force_ratio']:
-    df_feat[col] = df_feat[col].clip(upper=df_feat[col].quantile(0.99))
+    print(f"Nulls remaining: {df_feat[feature_cols].isnull().sum().sum()}")
+    print(f"Shape: {df_feat.shape}")
 
-# ── Log transform skewed columns ─────────────────────────────────────────────
-for col in ['att_str', 'def_str', 'att_cas', 'def_cas', 'total_troops', 'exchange_ratio', 'force_ratio', 'duration1']:
-    df_feat[f'log_{col}'] = np.log1p(df_feat[col])
+    print(df_feat[['force_ratio', 'att_loss_pct', 'def_loss_pct', 'exchange_ratio', 'casualty_intensity', 'ach_diff']].describe())
 
-print(df_feat[['force_ratio', 'att_loss_pct', 'def_loss_pct', 'exchange_ratio', 'casualty_intensity', 'ach_diff']].describe())
+    import os
+    os.makedirs('./BattleML/data', exist_ok=True)
 
-import os
-os.makedirs('./BattleML/data', exist_ok=True)
+    typed = apply_schema(df_feat)
+    memory_report('wars', df_feat, typed)
+    with stage('write wars.csv', rows=len(typed)):
+        typed.to_csv('./BattleML/data/wars.csv', index=False)
+    print("Saved: wars.csv")
 
-df_feat.to_csv('./BattleML/data/wars.csv', index=False)
-print("Saved: wars.csv")
\ No newline at end of file
+    # ── Stage cache report ───────────────────────────────────────────────────
+    print("\nStage       Key               Status")
+    for name, key, status in report:
+        print(f"{name:11s} {key}  {status}")
@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+# File locations shared by every script, kept free of heavy imports so the
+# battleml CLI can check them without loading pandas.  content_hash lives
+# here for the same reason: freshness checks of saved caches need only it,
+# and so do cluster_names, which every report and the CLI label clusters by.
+# BattleStore re-exports all of these.
+
+# Bump when the build logic in BattleStore changes so old snapshots are ignored
+SNAPSHOT_VERSION = 4
+
+CDB90_PATH = './BattleML/CDB90/data'
+DATA_PATH  = './BattleML/data'
+CACHE_PATH = './BattleML/data/cache'
+STAGE_PATH = f'{CACHE_PATH}/stages'
+
+BELLIGERENTS_CSV = f'{CDB90_PATH}/belligerents.csv'
+WARS_CSV         = f'{DATA_PATH}/wars.csv'
+CLUSTERED_CSV    = f'{DATA_PATH}/battles_clustered.csv'
+CLUSTER_MODEL    = f'{DATA_PATH}/models/cluster_pipeline.joblib'
+ALIAS_CSV        = f'{DATA_PATH}/commander_aliases.csv'
+
+MERGED_SOURCES = [BELLIGERENTS_CSV, ALIAS_CSV, CLUSTERED_CSV]      # bel_merged's inputs
+
+# Names of the saved KMeans clusters (BattleCluster keeps the fitted model so
+# the numbering behind them is stable)
+cluster_names = {
+    0: "Large-Scale Attritional",
+    1: "High-Intensity Defensive",
+    2: "Decisive Pursuit",
+    3: "Small-Scale Engagement",
+    4: "High-Intensity Offensive",
+    5: "Massive Set-Piece",
+    6: "Failed Assault",
+    7: "Operational-Scale Annihilation",
+}
+
+
+def content_hash(*paths):
+    h = hashlib.sha256(f'v{SNAPSHOT_VERSION}'.encode())
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()[:16]
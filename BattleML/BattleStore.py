@@ -0,0 +1,256 @@
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from BattlePaths import (CDB90_PATH, DATA_PATH, CACHE_PATH, STAGE_PATH, SNAPSHOT_VERSION, MERGED_SOURCES,
+                         BELLIGERENTS_CSV, WARS_CSV, CLUSTERED_CSV, CLUSTER_MODEL, ALIAS_CSV, content_hash,
+                         cluster_names)
+from Instrument import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:          # fall back to pickle snapshots
+    pa = None
+
+# Shared data layer.
+#
+# Builds belligerents (with co_clean), the commander table, battles_clustered,
+# bel_merged and bel_commands (bel_merged with one row per commander) once
+# and snapshots them to an uncompressed Arrow file in data/cache, named by a
+# content hash of the source CSVs.  Later runs memory-map the snapshot and
+# skip CSV parsing entirely; editing any input CSV changes the hash and
+# triggers a rebuild.
+
+MERGE_COLS = ['isqno', 'kmeans', 'casualty_intensity', 'force_ratio', 'attacker_underdog']
+
+SNAPSHOT_EXT = '.arrow' if pa is not None else '.pkl'
+
+# ── Dtype schema for wars.csv / battles_clustered.csv ────────────────────────
+# Low-cardinality codes become categoricals, bounded scores int8, flags bool.
+# Every other float column is stored as float32.  'name' is unique per
+# battle, so a categorical would not save anything and it stays a string.
+SCHEMA = {
+    **dict.fromkeys(['war', 'war4', 'terra1', 'wx1', 'att_pri1', 'def_pri1'], 'category'),
+    **dict.fromkeys(['att_ach', 'def_ach', 'ach_diff',
+                     'surpa', 'morala', 'momnta', 'techa', 'inita', 'mobila',
+                     'kmeans'], 'int8'),
+    'hdbscan':           'int16',
+    'isqno':             'int32',
+    'attacker_underdog': 'bool',
+}
+
+
+def apply_schema(df, schema=SCHEMA):
+    """Cast df to the declared schema; integer casts that would lose data fall back to float32."""
+    df = df.copy()
+    for col in df.columns:
+        target = schema.get(col)
+        if target is None:
+            if df[col].dtype == np.float64:
+                df[col] = df[col].astype(np.float32)
+            continue
+        if target.startswith('int') or target == 'bool':
+            vals = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            info = np.iinfo(target) if target != 'bool' else None
+            whole = np.isfinite(vals).all() and (vals == np.round(vals)).all()
+            if not whole or (info and (vals.min() < info.min or vals.max() > info.max)) \
+                    or (target == 'bool' and not np.isin(vals, (0, 1)).all()):
+                df[col] = df[col].astype(np.float32)
+                continue
+        df[col] = df[col].astype(target)
+    return df
+
+
+def memory_report(name, before, after):
+    b = before.memory_usage(deep=True).sum()
+    a = after.memory_usage(deep=True).sum()
+    print(f"{name:18s} {b / 1024:9.1f} KB -> {a / 1024:8.1f} KB  ({(a - b) / b:+.0%})")
+
+
+# ── Snapshot I/O ──────────────────────────────────────────────────────────────
+def _write(df, path):
+    tmp = path + '.tmp'
+    if pa is not None:
+        feather.write_feather(df, tmp, compression='uncompressed')
+    else:
+        with open(tmp, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    if pa is not None:
+        return feather.read_table(path, memory_map=True).to_pandas()
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# ── Array caches ──────────────────────────────────────────────────────────────
+# Numpy state derived from the data (AchIndex, Elo ratings, the scenario
+# model, ...) is saved as one .npz holding the key it was built under, and
+# only read back while that key still matches.
+
+def merged_key(*params):
+    """Content hash of bel_merged's sources, with any run settings appended."""
+    return '-'.join([content_hash(*MERGED_SOURCES), *map(str, params)])
+
+
+def save_npz(path, key, compressed=False, **arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    (np.savez_compressed if compressed else np.savez)(tmp, key=key, **arrays)
+    os.replace(tmp, path)
+
+
+def load_npz(path, key=None):
+    """{name: array} with 'key' as a str; None when missing or saved under a different key."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as z:
+        saved = str(z['key']) if 'key' in z.files else ''
+        if key is not None and saved != key:
+            return None
+        out = {k: z[k] for k in z.files if k != 'key'}
+    out['key'] = saved
+    return out
+
+
+def snapshot(name, sources, build):
+    """Return build(), cached under data/cache keyed on the sources' content."""
+    path = f'{CACHE_PATH}/{name}-{content_hash(*sources)}{SNAPSHOT_EXT}'
+    if os.path.exists(path):
+        with stage(f'load {name}', cache='hit') as sp:
+            df = _read(path)
+            sp.count(len(df))
+        return df
+
+    with stage(f'build {name}', cache='miss') as sp:
+        df = build()
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        for stale in glob.glob(f'{CACHE_PATH}/{name}-*{SNAPSHOT_EXT}'):
+            os.remove(stale)
+        _write(df, path)
+        sp.count(len(df))
+    return df
+
+
+# ── Stage cache ───────────────────────────────────────────────────────────────
+# A stage is (name, fn, deps, sources, params).  Its key hashes the stage's
+# own source code, its params, the content of the files it reads and the keys
+# of the stages it depends on, so editing one stage invalidates exactly that
+# stage and everything downstream of it.  Keys need no data, so a cached
+# stage never loads (or runs) the stages upstream of it.  extra_keys adds
+# state a stage reads that is neither code nor params (e.g. a registry's
+# contents) to that stage's key.
+
+def stage_keys(stages, extra_keys=None):
+    keys = {}
+    for name, fn, deps, sources, params in stages:
+        h = hashlib.sha256(f'v{SNAPSHOT_VERSION}:{name}'.encode())
+        h.update(inspect.getsource(fn).encode())
+        h.update(repr(sorted((params or {}).items())).encode())
+        if extra_keys and name in extra_keys:
+            h.update(repr(extra_keys[name]).encode())
+        if sources:
+            h.update(content_hash(*sources).encode())
+        for dep in deps:
+            h.update(keys[dep].encode())
+        keys[name] = h.hexdigest()[:16]
+    return keys
+
+
+def run_stages(stages, target=None, extra_keys=None):
+    """Run (or load) stages up to target; returns (frame, [(name, key, status)])."""
+    keys   = stage_keys(stages, extra_keys)
+    spec   = {st[0]: st for st in stages}
+    status = {name: 'skipped' for name in spec}
+    frames = {}
+
+    def get(name):
+        if name not in frames:
+            _, fn, deps, _, params = spec[name]
+            path = f'{STAGE_PATH}/{name}-{keys[name]}{SNAPSHOT_EXT}'
+            if os.path.exists(path):
+                with stage(name, cache='hit') as sp:
+                    frames[name], status[name] = _read(path), 'hit'
+                    sp.count(len(frames[name]))
+            else:
+                inputs = [get(d) for d in deps]
+                with stage(name, rows=len(inputs[0]) if inputs else None, cache='miss') as sp:
+                    frames[name], status[name] = fn(*inputs, **(params or {})), 'miss'
+                    os.makedirs(STAGE_PATH, exist_ok=True)
+                    for stale in glob.glob(f'{STAGE_PATH}/{name}-*{SNAPSHOT_EXT}'):
+                        os.remove(stale)
+                    _write(frames[name], path)
+                    sp.count(len(frames[name]))
+        return frames[name]
+
+    out = get(target or stages[-1][0])
+    return out, [(name, keys[name], status[name]) for name in spec]
+
+
+# ── Frames ────────────────────────────────────────────────────────────────────
+def _build_belligerents():
+    from Commanders import primary
+    bel = pd.read_csv(BELLIGERENTS_CSV)
+    bel['co_clean'] = primary(bel['co'])
+    return bel
+
+
+def load_belligerents():
+    return snapshot('belligerents', [BELLIGERENTS_CSV, ALIAS_CSV], _build_belligerents)
+
+
+def load_commands():
+    """One row per (belligerent, commander); joint commands split, see Commanders.py."""
+    def build():
+        from Commanders import commands
+        return commands(pd.read_csv(BELLIGERENTS_CSV))
+    return snapshot('commands', [BELLIGERENTS_CSV, ALIAS_CSV], build)
+
+
+def load_wars():
+    return snapshot('wars', [WARS_CSV], lambda: apply_schema(pd.read_csv(WARS_CSV)))
+
+
+def load_clustered():
+    return snapshot('battles_clustered', [CLUSTERED_CSV], lambda: apply_schema(pd.read_csv(CLUSTERED_CSV)))
+
+
+def load_bel_merged():
+    def build():
+        return load_belligerents().merge(load_clustered()[MERGE_COLS], on='isqno', how='left')
+    return snapshot('bel_merged', MERGED_SOURCES, build)
+
+
+def load_bel_commands():
+    """bel_merged with one row per commander, weighted by share; see Commanders.credited."""
+    def build():
+        from Commanders import credited
+        return credited(load_bel_merged(), load_commands())
+    return snapshot('bel_commands', MERGED_SOURCES, build)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    for name, load in [('belligerents', load_belligerents),
+                       ('wars', load_wars),
+                       ('battles_clustered', load_clustered),
+                       ('bel_merged', load_bel_merged),
+                       ('commands', load_commands),
+                       ('bel_commands', load_bel_commands)]:
+        t0 = time.perf_counter()
+        frame = load()
+        print(f"{name:18s} {str(frame.shape):12s} {(time.perf_counter() - t0) * 1000:7.1f} ms")
+
+    if '--memory' in sys.argv:
+        print("\nMemory (default dtypes -> schema)")
+        for name, path in [('wars', WARS_CSV), ('battles_clustered', CLUSTERED_CSV)]:
+            raw = pd.read_csv(path)
+            memory_report(name, raw, apply_schema(raw))
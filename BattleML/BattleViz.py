@@ -1,22 +1,10 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import seaborn as sns
-
-df = pd.read_csv('./BattleML/data/battles_clustered.csv')
-
-cluster_names = {
-    0: "The Grind",
-    1: "Defender's Fortress",
-    2: "Lightning Strike",
-    3: "Skirmish",
-    4: "Annihilation",
-    5: "Grand Carnage",
-    6: "Repulse",
-    7: "Industrial Slaughter",
-}
-df['cluster_label'] = df['kmeans'].map(cluster_names)
+from BattleStore import load_clustered, cluster_names
+from FastRender import FAST, batched_labels, render_all
+from Instrument import stage
 
 palette = {
     0: "#4878CF",
@@ -40,77 +28,101 @@ napoleonic_wars = [
     "Peninsular War of 1808-1814",
     "Hundred Days of 1814",
 ]
-df['is_napoleonic'] = df['war4'].isin(napoleonic_wars)
 
 # Graphs
 
-fig, ax = plt.subplots(figsize=(16, 11))
+def plot_umap_clusters(df, fast=FAST):
+    fig, ax = plt.subplots(figsize=(16, 11))
 
-for cluster_id, name in cluster_names.items():
-    mask = df['kmeans'] == cluster_id
-    ax.scatter(
-        df.loc[mask, 'umap_x'], df.loc[mask, 'umap_y'],
-        c=palette[cluster_id], label=f"{cluster_id}: {name}",
-        s=45, alpha=0.75, edgecolors='white', linewidths=0.3, zorder=2
-    )
+    for cluster_id, name in cluster_names.items():
+        mask = df['kmeans'] == cluster_id
+        ax.scatter(
+            df.loc[mask, 'umap_x'], df.loc[mask, 'umap_y'],
+            c=palette[cluster_id], label=f"{cluster_id}: {name}",
+            s=45, alpha=0.75, edgecolors='white', linewidths=0.3, zorder=2
+        )
 
-for _, row in df.iterrows():
-    ax.annotate(
-        row['name'],
-        (row['umap_x'], row['umap_y']),
-        fontsize=3.5, alpha=0.55, zorder=3,
-        xytext=(2, 2), textcoords='offset points'
-    )
+    ax.legend(loc='upper left', fontsize=8, framealpha=0.9,
+              title='Cluster', title_fontsize=9)
+    ax.set_title('Historical Battle Clusters (UMAP)', fontsize=15, fontweight='bold', pad=12)
+    ax.set_xlabel('UMAP Dimension 1', fontsize=10)
+    ax.set_ylabel('UMAP Dimension 2', fontsize=10)
+    ax.set_facecolor('#F7F7F7')
+    fig.tight_layout()
 
-ax.legend(loc='upper left', fontsize=8, framealpha=0.9,
-          title='Cluster', title_fontsize=9)
-ax.set_title('Historical Battle Clusters (UMAP)', fontsize=15, fontweight='bold', pad=12)
-ax.set_xlabel('UMAP Dimension 1', fontsize=10)
-ax.set_ylabel('UMAP Dimension 2', fontsize=10)
-ax.set_facecolor('#F7F7F7')
-fig.tight_layout()
-fig.savefig('./BattleML/data/viz_umap_clusters.png', dpi=200)
-plt.close()
-print("Saved: viz_umap_clusters.png")
+    if fast:
+        batched_labels(ax, df['umap_x'], df['umap_y'], df['name'],
+                       fontsize=3.5, alpha=0.55, offset=(2, 2), zorder=3)
+    else:
+        for _, row in df.iterrows():
+            ax.annotate(
+                row['name'],
+                (row['umap_x'], row['umap_y']),
+                fontsize=3.5, alpha=0.55, zorder=3,
+                xytext=(2, 2), textcoords='offset points'
+            )
 
-# Napoleonic Wars Highlight
+    fig.savefig('./BattleML/data/viz_umap_clusters.png', dpi=200)
+    plt.close()
+    print("Saved: viz_umap_clusters.png")
 
-fig, ax = plt.subplots(figsize=(16, 11))
+# Napoleonic Wars Highlight
 
-mask_bg = ~df['is_napoleonic']
-ax.scatter(
-    df.loc[mask_bg, 'umap_x'], df.loc[mask_bg, 'umap_y'],
-    c='#CCCCCC', s=30, alpha=0.35, edgecolors='none', zorder=1, label='Other battles'
-)
+def plot_umap_napoleonic(df, fast=FAST):
+    fig, ax = plt.subplots(figsize=(16, 11))
 
-mask_nap = df['is_napoleonic']
-for cluster_id, name in cluster_names.items():
-    mask = mask_nap & (df['kmeans'] == cluster_id)
-    if mask.sum() == 0:
-        continue
+    mask_bg = ~df['is_napoleonic']
     ax.scatter(
-        df.loc[mask, 'umap_x'], df.loc[mask, 'umap_y'],
-        c=palette[cluster_id], s=80, alpha=0.95,
-        edgecolors='black', linewidths=0.5, zorder=3,
-        label=f"{cluster_id}: {name}"
+        df.loc[mask_bg, 'umap_x'], df.loc[mask_bg, 'umap_y'],
+        c='#CCCCCC', s=30, alpha=0.35, edgecolors='none', zorder=1, label='Other battles'
     )
 
-for _, row in df[mask_nap].iterrows():
-    ax.annotate(
-        row['name'],
-        (row['umap_x'], row['umap_y']),
-        fontsize=5.5, alpha=0.9, fontweight='bold', zorder=4,
-        xytext=(3, 3), textcoords='offset points'
-    )
+    mask_nap = df['is_napoleonic']
+    for cluster_id, name in cluster_names.items():
+        mask = mask_nap & (df['kmeans'] == cluster_id)
+        if mask.sum() == 0:
+            continue
+        ax.scatter(
+            df.loc[mask, 'umap_x'], df.loc[mask, 'umap_y'],
+            c=palette[cluster_id], s=80, alpha=0.95,
+            edgecolors='black', linewidths=0.5, zorder=3,
+            label=f"{cluster_id}: {name}"
+        )
+
+    ax.legend(loc='upper left', fontsize=8, framealpha=0.9,
+              title='Cluster', title_fontsize=9)
+    ax.set_title('Napoleonic Battles Highlighted by Cluster (UMAP)',
+                 fontsize=15, fontweight='bold', pad=12)
+    ax.set_xlabel('UMAP Dimension 1', fontsize=10)
+    ax.set_ylabel('UMAP Dimension 2', fontsize=10)
+    ax.set_facecolor('#F7F7F7')
+    fig.tight_layout()
+
+    nap = df[mask_nap]
+    if fast:
+        batched_labels(ax, nap['umap_x'], nap['umap_y'], nap['name'],
+                       fontsize=5.5, alpha=0.9, fontweight='bold', offset=(3, 3), zorder=4)
+    else:
+        for _, row in nap.iterrows():
+            ax.annotate(
+                row['name'],
+                (row['umap_x'], row['umap_y']),
+                fontsize=5.5, alpha=0.9, fontweight='bold', zorder=4,
+                xytext=(3, 3), textcoords='offset points'
+            )
+
+    fig.savefig('./BattleML/data/viz_umap_napoleonic.png', dpi=200)
+    plt.close()
+    print("Saved: viz_umap_napoleonic.png")
+
+
+if __name__ == '__main__':
+    df = load_clustered()
+    with stage('label', rows=len(df)):
+        df['cluster_label'] = df['kmeans'].map(cluster_names)
+        df['is_napoleonic'] = df['war4'].isin(napoleonic_wars)
 
-ax.legend(loc='upper left', fontsize=8, framealpha=0.9,
-          title='Cluster', title_fontsize=9)
-ax.set_title('Napoleonic Battles Highlighted by Cluster (UMAP)',
-             fontsize=15, fontweight='bold', pad=12)
-ax.set_xlabel('UMAP Dimension 1', fontsize=10)
-ax.set_ylabel('UMAP Dimension 2', fontsize=10)
-ax.set_facecolor('#F7F7F7')
-fig.tight_layout()
-fig.savefig('./BattleML/data/viz_umap_napoleonic.png', dpi=200)
-plt.close()
-print("Saved: viz_umap_napoleonic.png")
+    render_all([
+        ('viz_umap_clusters.png',   plot_umap_clusters,   (df,)),
+        ('viz_umap_napoleonic.png', plot_umap_napoleonic, (df,)),
+    ])
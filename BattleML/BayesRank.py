@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from scipy import optimize, special
+from AchIndex import WIN_ACH
+from BattleStore import CACHE_PATH
+
+# Joint posterior ranking of commanders.
+#
+# Each commander's win rate has a Beta(alpha + wins, beta + losses) posterior
+# (the same model as NapoleonStatsv3.bayesian_wr), with the prior fitted to
+# every commander's record by empirical Bayes (fit_beta_prior).  Records come
+# from bel_commands, each row counting its share, so a joint command credits
+# every commander in it, the same counts AchIndex holds.  Draws are taken
+# for every commander at once, as a (draws x commanders) matrix, in chunks
+# sized to a memory budget.  Each chunk adds to running totals:
+#   - how often each commander is ranked first,
+#   - the sum of each commander's rank (for the expected rank),
+#   - for a chosen subset, how often row commander > column commander.
+# Chunks run on a thread pool with independent SeedSequence streams (numpy's
+# samplers release the GIL), so memory stays at workers x one chunk.  The
+# chunk split depends only on the problem size and MAX_BYTES, never on the
+# worker count, so a seed gives the same rankings on every machine.
+
+PRIOR_CACHE  = f'{CACHE_PATH}/beta_prior.json'
+PRIOR_BOUNDS = (1e-3, 1e3)
+
+N_DRAWS    = 100_000
+MAX_BYTES  = 256 * 2**20       # per-chunk working-set budget
+PAIRWISE_M = 50                # default pairwise subset: top-M by posterior mean
+
+
+def win_counts(bel_commands, min_battles=1, win_ach=WIN_ACH):
+    """(names, wins, battles) per commander, share-weighted, so counts may be fractional."""
+    rows = bel_commands[['commander', 'share', 'ach']].dropna()
+    g = (rows.assign(win=(rows['ach'] >= win_ach) * rows['share'])
+             .groupby('commander')[['win', 'share']]
+             .sum())
+    g = g[g['share'] >= min_battles]
+    return g.index.to_numpy(), g['win'].to_numpy(np.float64), g['share'].to_numpy(np.float64)
+
+
+# ── Empirical-Bayes prior ─────────────────────────────────────────────────────
+def _moments_guess(wins, n):
+    p = wins / n
+    m, v = p.mean(), p.var()
+    common = m * (1 - m) / v - 1 if v > 0 else 10.0
+    common = min(max(common, 0.5), 1e4)
+    return np.clip(m, 0.01, 0.99) * common, np.clip(1 - m, 0.01, 0.99) * common
+
+
+def fit_beta_prior(wins, n):
+    """
+    Beta prior maximizing the beta-binomial marginal likelihood of all records.
+
+    log L(a, b) = sum_i betaln(a + w_i, b + n_i - w_i) - betaln(a, b)  (+ const)
+    Optimized over (log a, log b) from a method-of-moments start, with the
+    analytic digamma gradient, so every evaluation is one vectorized pass.
+    """
+    wins = np.asarray(wins, dtype=np.float64)
+    n    = np.asarray(n, dtype=np.float64)
+    loss = n - wins
+    k    = len(n)
+
+    def nll(theta):
+        a, b = np.exp(theta)
+        ll = special.betaln(a + wins, b + loss).sum() - k * special.betaln(a, b)
+        dab = special.digamma(a + b + n)
+        ga = (special.digamma(a + wins) - dab).sum() - k * (special.digamma(a) - special.digamma(a + b))
+        gb = (special.digamma(b + loss) - dab).sum() - k * (special.digamma(b) - special.digamma(a + b))
+        return -ll, -np.array([ga * a, gb * b])
+
+    # With no between-commander spread the MLE runs off to infinite
+    # concentration (complete pooling); PRIOR_BOUNDS caps it.
+    a0, b0 = _moments_guess(wins, n)
+    res = optimize.minimize(nll, np.log([a0, b0]), jac=True, method='L-BFGS-B',
+                            bounds=[np.log(PRIOR_BOUNDS)] * 2)
+    a, b = np.exp(res.x)
+    return float(a), float(b)
+
+
+def fitted_prior(bel_commands, win_ach=WIN_ACH):
+    """fit_beta_prior over every commander's share-weighted record; see cached_prior."""
+    _, wins, n = win_counts(bel_commands, win_ach=win_ach)
+    return cached_prior(wins, n)
+
+
+def cached_prior(wins, n):
+    """
+    fit_beta_prior(wins, n), cached on a hash of the counts it is fitted to.
+
+    Pass the same share-weighted (wins, n) the posterior is applied to, e.g.
+    AchIndex.records.  Counts are rounded for the key so summation order
+    (pandas groupby vs the index tensor) does not split one prior into two.
+    """
+    counts = np.round(np.stack([wins, n]).astype(np.float64), 6)
+    key = hashlib.sha256(b'share-weighted' + counts.tobytes()).hexdigest()[:16]
+
+    cache = {}
+    if os.path.exists(PRIOR_CACHE):
+        with open(PRIOR_CACHE) as f:
+            cache = json.load(f)
+    if key not in cache:
+        cache[key] = fit_beta_prior(*counts)
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        with open(PRIOR_CACHE, 'w') as f:
+            json.dump(cache, f)
+    return tuple(cache[key])
+
+
+def _chunk_size(n, m, max_bytes):
+    # Per draw: float64 draws + float32 copy + argsort indices + the float64
+    # rank weights bincount reads, plus the float32 pairwise columns and
+    # the M x M comparison block
+    per_draw = n * (8 + 4 + 8 + 8) + m * 4 + m * m
+    return max(1, int(max_bytes // per_draw))
+
+
+def _score_chunk(a, b, d, pairwise, rng, max_bytes):
+    N, M = len(a), len(pairwise)
+    s = rng.beta(a, b, size=(d, N)).astype(np.float32)
+
+    first    = np.bincount(s.argmax(axis=1), minlength=N)
+    order    = np.argsort(-s, axis=1)                        # best first
+    rank_sum = np.bincount(order.ravel(), weights=np.tile(np.arange(N, dtype=np.float64), d),
+                           minlength=N)
+
+    greater = np.zeros((M, M), dtype=np.int64)
+    if M:
+        sub  = s[:, pairwise]
+        step = max(1, int(max_bytes // (M * M)))
+        for lo in range(0, d, step):
+            blk = sub[lo:lo + step]
+            greater += (blk[:, :, None] > blk[:, None, :]).sum(axis=0)
+    return first, rank_sum, greater
+
+
+def posterior_rankings(wins, n, alpha, beta, n_draws=N_DRAWS,
+                       pairwise=None, seed=42, max_bytes=MAX_BYTES, workers=None):
+    """
+    Returns (p_best, expected_rank, p_greater):
+      p_best[i]        P(commander i has the highest win rate)
+      expected_rank[i] E[rank of i], 1 = best
+      p_greater[a, b]  P(win rate of pairwise[a] > pairwise[b])
+    """
+    a = (alpha + wins).astype(np.float64)
+    b = (beta + n - wins).astype(np.float64)
+    N = len(a)
+    pairwise = np.arange(0) if pairwise is None else np.asarray(pairwise)
+    M = len(pairwise)
+
+    workers = workers or os.cpu_count()
+    chunk   = _chunk_size(N, M, max_bytes)
+    sizes   = [min(chunk, n_draws - lo) for lo in range(0, n_draws, chunk)]
+    rngs    = [np.random.default_rng(ss) for ss in np.random.SeedSequence(seed).spawn(len(sizes))]
+
+    first    = np.zeros(N, dtype=np.int64)
+    rank_sum = np.zeros(N, dtype=np.float64)
+    greater  = np.zeros((M, M), dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for f, r, g in pool.map(lambda job: _score_chunk(a, b, job[0], pairwise, job[1], max_bytes),
+                                zip(sizes, rngs)):
+            first    += f
+            rank_sum += r
+            greater  += g
+
+    return first / n_draws, rank_sum / n_draws + 1, greater / n_draws
+
+
+def ranking_table(names, wins, n, p_best, expected_rank, alpha, beta):
+    a, b = alpha + wins, beta + n - wins
+    return (pd.DataFrame({
+                'general':       names,
+                'n':             n,
+                'wins':          wins,
+                'bayes_wr':      a / (a + b),
+                'p_best':        p_best,
+                'expected_rank': expected_rank,
+            })
+            .sort_values('expected_rank')
+            .reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    import argparse
+    from BattleStore import load_bel_commands
+
+    parser = argparse.ArgumentParser(description='Joint posterior ranking of commanders')
+    parser.add_argument('--draws', type=int, default=N_DRAWS, help='posterior draws')
+    parser.add_argument('--min-battles', type=int, default=1, help='fewest battles to be ranked')
+    args = parser.parse_args()
+    n_draws, min_battles = args.draws, args.min_battles
+
+    bel_commands = load_bel_commands()
+    t0 = time.perf_counter()
+    alpha, beta = fitted_prior(bel_commands)
+    print(f"Empirical-Bayes prior: Beta({alpha:.3f}, {beta:.3f})  ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+    names, wins, n = win_counts(bel_commands, min_battles=min_battles)
+    post_mean = (alpha + wins) / (alpha + beta + n)
+    top = np.argsort(-post_mean)[:PAIRWISE_M]
+
+    t0 = time.perf_counter()
+    p_best, exp_rank, p_greater = posterior_rankings(wins, n, alpha, beta, n_draws=n_draws, pairwise=top)
+    print(f"{len(names)} commanders x {n_draws:,} draws: {time.perf_counter() - t0:.2f}s")
+
+    table = ranking_table(names, wins, n, p_best, exp_rank, alpha, beta)
+    table.to_csv('./BattleML/data/bayes_rankings.csv', index=False)
+    print("Saved: bayes_rankings.csv")
+    print(table.head(15).round(3).to_string(index=False))
+
+    pw = pd.DataFrame(p_greater, index=names[top], columns=names[top])
+    pw.to_csv('./BattleML/data/bayes_pairwise.csv')
+    print("Saved: bayes_pairwise.csv")
+
+    generals = [g for g in ['NAPOLEON I', 'WELLINGTON', 'FREDERICK II', 'LEE', 'GRANT'] if g in pw.index]
+    if generals:
+        print("\n── P(row > column) ──")
+        print(pw.loc[generals, generals].round(3).to_string())
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from BattleStore import DATA_PATH, MERGE_COLS
+
+# Benchmarks for the pipeline's hot paths on synthetic corpora (Synthetic.py).
+#
+# Each benchmark is timed `repeats` times with tracing off, then run once more
+# under tracemalloc for its peak Python/numpy allocation.  rss_mb is the
+# process high-water mark after the benchmark, so it only ever grows within a
+# run.  Expensive fits are skipped above their CAPS size.
+#
+#   python BattleML/Benchmarks.py --sizes 10000 100000
+#   python BattleML/Benchmarks.py --compare              # against baseline.json
+#   python BattleML/Benchmarks.py --save-baseline
+
+BENCH_PATH    = f'{DATA_PATH}/benchmarks'
+RESULTS_PATH  = f'{BENCH_PATH}/results.json'
+BASELINE_PATH = f'{BENCH_PATH}/baseline.json'
+
+REPEATS     = 3
+TOLERANCE   = 0.25        # flag >25% slower or >25% more memory than baseline
+MIN_SECONDS = 0.05        # ignore timing noise below this
+BENCH_PERMUTATIONS = 2_000   # one in-process PermutationTests job
+
+CAPS = {
+    'cluster_umap':    10_000,
+    'cluster_hdbscan': 100_000,
+    'permutation_tests': 100_000,
+}
+
+
+# ── Measurement ───────────────────────────────────────────────────────────────
+def measure(fn, repeats=REPEATS):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss / 2**20 if sys.platform == 'darwin' else rss / 2**10      # bytes on macOS, KiB on Linux
+    return {
+        'seconds_min':    min(times),
+        'seconds_median': statistics.median(times),
+        'repeats':        repeats,
+        'peak_mb':        peak / 2**20,
+        'rss_mb':         rss,
+    }
+
+
+# ── Fixtures ──────────────────────────────────────────────────────────────────
+def _prepare(n_battles, seed):
+    """Synthetic CSVs, the BattleData frames and bel_merged for one corpus size."""
+    import BattleData
+    from Synthetic import write_synthetic
+
+    path = write_synthetic(n_battles, seed)
+    BattleData.Load_Path = path
+
+    joined   = BattleData.join(BattleData.pivot())
+    selected = BattleData.select(joined, BattleData.feature_cols)
+    df = BattleData.features(BattleData.impute(selected, BattleData.impute_cols))
+
+    from Commanders import primary
+    bel = pd.read_csv(f'{path}/belligerents.csv')
+    bel['co_clean'] = primary(bel['co'])
+    return {'path': path, 'selected': selected, 'wars': df, 'bel': bel}
+
+
+def _benchmarks(fx):
+    """(name, fn) pairs; later entries use state the earlier ones leave in fx."""
+    import BattleData
+    from sklearn.decomposition import PCA
+    from sklearn.cluster import KMeans
+
+    def merge():
+        BattleData.join(BattleData.pivot())
+
+    def impute():
+        BattleData.impute(fx['selected'], BattleData.impute_cols)
+
+    def standardize():
+        from BattleCluster import standardize
+        fx['X'] = standardize(fx['wars'])[0]
+
+    def pca():
+        fx['Z'] = PCA(n_components=10, random_state=42).fit_transform(fx['X'])
+
+    def kmeans():
+        fx['kmeans'] = KMeans(n_clusters=8, random_state=42).fit_predict(fx['Z'])
+
+    def umap_fit():
+        import umap
+        umap.UMAP(n_neighbors=15, min_dist=0.1, random_state=42).fit(fx['Z'])
+
+    def hdbscan_fit():
+        import hdbscan
+        hdbscan.HDBSCAN(min_cluster_size=5).fit(fx['Z'])
+
+    def ach_index():
+        import AchIndex
+        fx['ach_index'] = AchIndex.build(_bel_commands(fx))
+
+    def monte_carlo():
+        import HeadtoHeadMC
+        HeadtoHeadMC.ach_index = fx['ach_index']
+        top = _bel_commands(fx).groupby('commander')['share'].sum().nlargest(2).index
+        HeadtoHeadMC.monte_carlo(top[0], top[1], adaptive=False, n_boot=0)
+
+    def bayesian_wr():
+        import NapoleonStatsv3
+        from BayesRank import win_counts
+        _, wins, n = win_counts(_bel_commands(fx))
+        NapoleonStatsv3.bayesian_wr(wins, n)
+
+    def napoleon_groupbys():
+        import NapoleonStats
+        NapoleonStats.underdog_table(fx['ach_index'])
+        NapoleonStats.cluster_winrates(fx['ach_index'])
+        NapoleonStats.ach_distribution(fx['ach_index'])
+
+    def elo_ratings():
+        import EloRatings
+        EloRatings.rate(fx['bel'])
+
+    def permutation_tests():
+        import PermutationTests
+        PermutationTests._init(PermutationTests.prepare(_bel_commands(fx)))
+        PermutationTests.run_batch(np.random.SeedSequence(42), BENCH_PERMUTATIONS)
+
+    return [
+        ('data_merge',        merge),
+        ('data_impute',       impute),
+        ('cluster_standardize', standardize),
+        ('cluster_pca',       pca),
+        ('cluster_kmeans',    kmeans),
+        ('cluster_umap',      umap_fit),
+        ('cluster_hdbscan',   hdbscan_fit),
+        ('ach_index',         ach_index),
+        ('monte_carlo',       monte_carlo),
+        ('bayesian_wr',       bayesian_wr),
+        ('napoleon_groupbys', napoleon_groupbys),
+        ('elo_ratings',       elo_ratings),
+        ('permutation_tests', permutation_tests),
+    ]
+
+
+def _bel_merged(fx):
+    # Same merge as BattleStore.load_bel_merged, with the benchmark's KMeans labels
+    if 'bel_merged' not in fx:
+        clustered = fx['wars'].assign(kmeans=fx['kmeans'])
+        fx['bel_merged'] = fx['bel'].merge(clustered[MERGE_COLS], on='isqno', how='left')
+    return fx['bel_merged']
+
+
+def _bel_commands(fx):
+    # BattleStore.load_bel_commands on the benchmark's bel_merged
+    if 'bel_commands' not in fx:
+        from Commanders import credited
+        fx['bel_commands'] = credited(_bel_merged(fx))
+    return fx['bel_commands']
+
+
+def _set_prior(fx):
+    # Fitted directly: BayesRank.fitted_prior would cache synthetic priors
+    import NapoleonStatsv3
+    from BayesRank import win_counts, fit_beta_prior
+    _, wins, n = win_counts(_bel_commands(fx))
+    NapoleonStatsv3.ALPHA_PRIOR, NapoleonStatsv3.BETA_PRIOR = fit_beta_prior(wins, n)
+
+
+def run(sizes, only=None, repeats=REPEATS, seed=42):
+    results = []
+    for n in sizes:
+        t0 = time.perf_counter()
+        fx = _prepare(n, seed)
+        print(f"\n── {n:,} battles  (prepared in {time.perf_counter() - t0:.1f}s) ──")
+        for name, fn in _benchmarks(fx):
+            if name == 'bayesian_wr':
+                _set_prior(fx)
+            needed = name in ('cluster_standardize', 'cluster_pca', 'cluster_kmeans', 'ach_index')
+            if only and name not in only and not needed:
+                continue
+            if n > CAPS.get(name, float('inf')):
+                print(f"  {name:22s} skipped (above {CAPS[name]:,})")
+                continue
+            r = {'bench': name, 'n_battles': n, **measure(fn, repeats)}
+            results.append(r)
+            print(f"  {name:22s} {r['seconds_median']:9.3f}s  peak {r['peak_mb']:8.1f} MB  rss {r['rss_mb']:8.0f} MB")
+    return results
+
+
+# ── Baseline comparison ───────────────────────────────────────────────────────
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Rows of (bench, n, metric, baseline, current, ratio) that regressed."""
+    base = {(r['bench'], r['n_battles']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get((r['bench'], r['n_battles']))
+        if b is None:
+            continue
+        for metric, floor in [('seconds_median', MIN_SECONDS), ('peak_mb', 1.0)]:
+            if b[metric] < floor and r[metric] < floor:
+                continue
+            ratio = r[metric] / max(b[metric], 1e-12)
+            if ratio > 1 + tolerance:
+                regressions.append((r['bench'], r['n_battles'], metric, b[metric], r[metric], ratio))
+    return regressions
+
+
+def _meta():
+    return {
+        'python':   platform.python_version(),
+        'numpy':    np.__version__,
+        'pandas':   pd.__version__,
+        'platform': platform.platform(),
+        'cpus':     os.cpu_count(),
+        'created':  time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save(results, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'meta': _meta(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    from Synthetic import SIZES
+
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--only', nargs='+', help='benchmark names to run')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--out', default=RESULTS_PATH)
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, help='baseline JSON to check against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.sizes, only=args.only, repeats=args.repeats)
+    save(results, args.out)
+    print(f"\nSaved: {args.out}")
+    if args.save_baseline:
+        save(results, BASELINE_PATH)
+        print(f"Saved: {BASELINE_PATH}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n── Regressions vs {args.compare} (>{args.tolerance:.0%}) ──")
+            for bench, n, metric, old, new, ratio in regressions:
+                print(f"  {bench:22s} {n:>9,}  {metric:15s} {old:10.3f} -> {new:10.3f}  ({ratio:.2f}x)")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.compare}")
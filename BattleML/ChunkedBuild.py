@@ -0,0 +1,213 @@
+import argparse
+import math
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import BattleData
+from BattleData import feature_cols, impute_cols, is_text
+from FeatureRegistry import CLIP_Q, clip_cols
+from BattleStore import CACHE_PATH, WARS_CSV, apply_schema
+from Instrument import stage
+from Sketches import QuantileSketch, ValueCounts
+
+# Out-of-core build of wars.csv, for source tables larger than memory.
+#
+# BattleData.py loads every table whole and takes medians, modes and 99th
+# percentiles over full columns.  This builds the same frame in passes over
+# disk, holding one partition at a time:
+#
+#   0. stream each table (CSV or Parquet) in chunks and split its rows into
+#      isqno-range partitions, so every join is local to one partition
+#   1. per partition: pivot, join, select; save; sketch the impute columns
+#   2. per partition: impute from the merged sketches, engineer; sketch the
+#      clip columns
+#   3. per partition: impute, evaluate the feature registry with the
+#      sketched 99th percentiles as caps; append to the output CSV
+#
+# Peak memory is one partition (about chunk_rows battles) plus the sketches.
+# Medians and percentiles are exact while a column has at most
+# Sketches.MAX_DISTINCT distinct values and within the KLL rank error past
+# that (see Sketches.py); modes are exact.  --verify runs the in-memory path
+# on the same input and reports the differences.
+#
+#   python BattleML/ChunkedBuild.py --root ./BattleML/data/cache/synthetic/n1000000_s42 --chunk-rows 100000
+
+TABLES     = ['belligerents', 'battles', 'battle_durations', 'front_widths', 'terrain', 'weather']
+CHUNK_ROWS = 100_000
+WORK_PATH  = f'{CACHE_PATH}/chunked'
+
+
+# ── Reading ───────────────────────────────────────────────────────────────────
+def source(root, table):
+    parquet = f'{root}/{table}.parquet'
+    return parquet if os.path.exists(parquet) else f'{root}/{table}.csv'
+
+
+def chunks(path, chunk_rows, columns=None):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, usecols=columns)
+
+
+# ── Pass 0: partition on isqno ────────────────────────────────────────────────
+def partition(root, work, chunk_rows):
+    """Split every table into isqno ranges of about chunk_rows battles; returns the layout."""
+    lo, hi, n = np.inf, -np.inf, 0
+    for c in chunks(source(root, 'battles'), chunk_rows, columns=['isqno']):
+        lo, hi, n = min(lo, c['isqno'].min()), max(hi, c['isqno'].max()), n + len(c)
+    n_parts = max(1, math.ceil(n / chunk_rows))
+    edges   = np.linspace(lo, hi + 1, n_parts + 1)
+
+    layout = {'n_parts': n_parts, 'columns': {}, 'text': {}}
+    for table in TABLES:
+        text = set()
+        for c in chunks(source(root, table), chunk_rows):
+            layout['columns'][table] = list(c.columns)
+            text |= {col for col in c.columns if is_text(c[col])}
+            part = np.searchsorted(edges, c['isqno'].to_numpy(), side='right') - 1
+            for p, rows in c.groupby(part):
+                path = f'{work}/{table}-{p:05d}.csv'
+                rows.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+        layout['text'][table] = text
+    return layout
+
+
+def read_partition(work, layout, p):
+    tables = {}
+    for table in TABLES:
+        path  = f'{work}/{table}-{p:05d}.csv'
+        dtype = {col: 'str' for col in layout['text'][table]}
+        if os.path.exists(path):
+            tables[table] = pd.read_csv(path, dtype=dtype)
+        else:                                           # no rows in this isqno range
+            tables[table] = pd.DataFrame({col: pd.Series(dtype=dtype.get(col, 'float64'))
+                                          for col in layout['columns'][table]}).astype({'isqno': 'int64'})
+    return tables
+
+
+# ── Passes 1-3 ────────────────────────────────────────────────────────────────
+def _selected_path(work, p):
+    return f'{work}/selected-{p:05d}.pkl'
+
+
+def _sketch(df, cols, sketches):
+    for col in cols:
+        s = ValueCounts() if is_text(df[col]) else QuantileSketch()
+        s.update(df[col].dropna())
+        if col in sketches:
+            sketches[col].merge(s)
+        else:
+            sketches[col] = s
+    return sketches
+
+
+def build(root=None, out=WARS_CSV, chunk_rows=CHUNK_ROWS, work=WORK_PATH):
+    """Build wars.csv from root out of core; returns (rows, fills, caps, sketches)."""
+    root = root or BattleData.Load_Path
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+
+    with stage('partition', chunk_rows=chunk_rows):
+        layout = partition(root, work, chunk_rows)
+    n_parts = layout['n_parts']
+
+    impute_sk = {}
+    with stage('select', rows=n_parts):
+        for p in range(n_parts):
+            tables = read_partition(work, layout, p)
+            df = BattleData.select(BattleData.join(BattleData.pivot(tables['belligerents']), tables), feature_cols)
+            df.to_pickle(_selected_path(work, p))
+            _sketch(df, impute_cols, impute_sk)
+    fills = {col: s.mode() if isinstance(s, ValueCounts) else s.median() for col, s in impute_sk.items()}
+
+    clip_sk = {}
+    with stage('engineer', rows=n_parts):
+        for p in range(n_parts):
+            df = BattleData.engineer(BattleData.impute(pd.read_pickle(_selected_path(work, p)), impute_cols, fills))
+            _sketch(df, clip_cols(), clip_sk)
+    caps = {col: s.quantile(CLIP_Q) for col, s in clip_sk.items()}
+
+    rows = 0
+    tmp  = f'{out}.partial'
+    with stage('write', rows=n_parts) as sp:
+        for p in range(n_parts):
+            df = BattleData.features(BattleData.impute(pd.read_pickle(_selected_path(work, p)), impute_cols, fills), caps)
+            apply_schema(df).to_csv(tmp, mode='w' if p == 0 else 'a', header=p == 0, index=False)
+            rows += len(df)
+        sp.count(rows)
+    os.replace(tmp, out)
+
+    shutil.rmtree(work, ignore_errors=True)
+    return rows, fills, caps, {**impute_sk, **clip_sk}
+
+
+# ── Checking against the in-memory path ───────────────────────────────────────
+def in_memory(root):
+    """The in-memory build, plus the frames its medians and percentiles come from."""
+    saved, BattleData.Load_Path = BattleData.Load_Path, root
+    try:
+        selected   = BattleData.select(BattleData.join(BattleData.pivot()), feature_cols)
+        engineered = BattleData.engineer(BattleData.impute(selected, impute_cols))
+        out        = BattleData.features(BattleData.impute(selected, impute_cols))
+    finally:
+        BattleData.Load_Path = saved
+    return apply_schema(out), selected, engineered
+
+
+def verify(out, fills, caps, sketches, root):
+    """Print how the chunked output and statistics differ from the in-memory ones."""
+    want, selected, engineered = in_memory(root)
+    got = pd.read_csv(out)
+
+    print(f"\n{'statistic':28s} {'in-memory':>14} {'chunked':>14} {'rank err':>9}  sketch")
+    for stats, frame, q in [(fills, selected, 0.5), (caps, engineered, CLIP_Q)]:
+        for col, value in stats.items():
+            vals = frame[col].dropna()
+            if isinstance(sketches[col], ValueCounts):
+                print(f"{'mode ' + col:28s} {str(vals.mode()[0]):>14} {str(value):>14} {'':>9}  exact")
+                continue
+            label = f"{'median' if q == 0.5 else f'p{q * 100:g}'} {col}"
+            below, upto = (vals < value).mean(), (vals <= value).mean()
+            err   = max(below - q, q - upto, 0)             # 0 when value's ties span q
+            print(f"{label:28s} {vals.quantile(q):14.6g} {value:14.6g} {err:9.4f}  "
+                  f"{'exact' if sketches[col].exact else 'KLL'}")
+
+    print(f"\nRows: in-memory {len(want):,}, chunked {len(got):,}")
+    same_order = len(want) == len(got) and (want['isqno'].to_numpy() == got['isqno'].to_numpy()).all()
+    print(f"isqno order identical: {same_order}")
+    worst = []
+    for col in want.columns:
+        a, b = want[col], got[col]
+        if is_text(a) or isinstance(a.dtype, pd.CategoricalDtype):
+            mism = int((a.astype(str).to_numpy() != b.astype(str).to_numpy()).sum()) if same_order else -1
+            worst.append((col, mism, np.nan))
+        else:
+            d = np.abs(a.to_numpy(float) - b.to_numpy(float)) if same_order else np.array([np.inf])
+            worst.append((col, int((d > 1e-6 * (1 + np.abs(a.to_numpy(float)))).sum()), np.nanmax(d)))
+    diffs = [w for w in worst if w[1]]
+    print(f"Columns that differ: {len(diffs)} of {len(worst)}")
+    for col, n, d in diffs:
+        print(f"  {col:22s} {n:>8,} rows  max abs diff {d:.4g}")
+    return not diffs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Out-of-core build of wars.csv')
+    parser.add_argument('--root', default=BattleData.Load_Path, help='directory with the CDB90 tables (.csv or .parquet)')
+    parser.add_argument('--out', default=WARS_CSV)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--verify', action='store_true', help='compare with the in-memory build (needs the memory)')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    rows, fills, caps, sketches = build(args.root, args.out, args.chunk_rows)
+    n_kll = sum(not s.exact for s in sketches.values() if isinstance(s, QuantileSketch))
+    print(f"Saved: {args.out}  ({rows:,} battles in {time.perf_counter() - t0:.1f}s; "
+          f"{n_kll} of {len(sketches)} column summaries used KLL)")
+    if args.verify:
+        verify(args.out, fills, caps, sketches, args.root)
@@ -0,0 +1,171 @@
+import itertools
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Hyperparameter sweep for BattleCluster.py.
+#
+# The standardized feature matrix is built once and handed to every worker
+# through the pool initializer.  KMeans (PCA components x k) and HDBSCAN
+# (PCA components x min_cluster_size) are independent of each other, so each
+# gets its own jobs; both are scored with silhouette and Davies-Bouldin, and
+# KMeans also with seed-to-seed adjusted-Rand stability.  UMAP only draws the
+# 2-D picture, so its configurations (n_neighbors x min_dist) are scored
+# by trustworthiness instead of multiplying the clustering grid.
+
+SWEEP_PATH = './BattleML/data/cluster_sweep.csv'
+UMAP_PATH  = './BattleML/data/umap_sweep.csv'
+
+KMEANS_GRID = {
+    'n_components': [5, 8, 10, 12],
+    'n_clusters':   [5, 6, 7, 8, 9, 10, 12],
+}
+HDBSCAN_GRID = {
+    'n_components':     [5, 8, 10, 12],
+    'min_cluster_size': [3, 5, 10, 15],
+}
+UMAP_GRID = {
+    'n_components': [10],
+    'n_neighbors':  [5, 15, 30, 50],
+    'min_dist':     [0.0, 0.1, 0.3, 0.5],
+}
+N_SEEDS = 5
+
+_X = None
+
+
+def _init(X):
+    global _X
+    _X = X
+
+
+def _pca(n_components):
+    from sklearn.decomposition import PCA
+    return PCA(n_components=min(n_components, _X.shape[1]), random_state=42).fit_transform(_X)
+
+
+def score_kmeans(n_components, n_clusters, n_seeds=N_SEEDS):
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score, davies_bouldin_score, adjusted_rand_score
+
+    t0     = time.perf_counter()
+    Z      = _pca(n_components)
+    runs   = [KMeans(n_clusters=n_clusters, random_state=seed).fit_predict(Z) for seed in range(n_seeds)]
+    aris   = [adjusted_rand_score(a, b) for a, b in itertools.combinations(runs, 2)]
+    return {
+        'method':         'kmeans',
+        'n_components':   n_components,
+        'n_clusters':     n_clusters,
+        'silhouette':     silhouette_score(Z, runs[0]),
+        'davies_bouldin': davies_bouldin_score(Z, runs[0]),
+        'ari_stability':  np.mean(aris) if aris else np.nan,
+        'ari_min':        np.min(aris) if aris else np.nan,
+        'seconds':        time.perf_counter() - t0,
+        'worker':         os.getpid(),
+    }
+
+
+def score_hdbscan(n_components, min_cluster_size):
+    from sklearn.metrics import silhouette_score, davies_bouldin_score
+    import hdbscan
+
+    t0     = time.perf_counter()
+    Z      = _pca(n_components)
+    labels = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size).fit_predict(Z)
+    core   = labels >= 0
+    n      = len(set(labels[core]))
+    return {
+        'method':           'hdbscan',
+        'n_components':     n_components,
+        'min_cluster_size': min_cluster_size,
+        'n_clusters':       n,
+        'noise_pct':        (~core).mean() * 100,
+        'silhouette':       silhouette_score(Z[core], labels[core]) if n > 1 else np.nan,
+        'davies_bouldin':   davies_bouldin_score(Z[core], labels[core]) if n > 1 else np.nan,
+        'seconds':          time.perf_counter() - t0,
+        'worker':           os.getpid(),
+    }
+
+
+def score_umap(n_components, n_neighbors, min_dist):
+    import umap
+    from sklearn.manifold import trustworthiness
+
+    t0  = time.perf_counter()
+    Z   = _pca(n_components)
+    emb = umap.UMAP(n_neighbors=n_neighbors, min_dist=min_dist, random_state=42, n_jobs=1).fit_transform(Z)
+    return {
+        'n_components':    n_components,
+        'n_neighbors':     n_neighbors,
+        'min_dist':        min_dist,
+        'trustworthiness': trustworthiness(Z, emb, n_neighbors=10),
+        'seconds':         time.perf_counter() - t0,
+        'worker':          os.getpid(),
+    }
+
+
+def _grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*grid.values())]
+
+
+def rank(results):
+    # Mean rank across the criteria within each method; lower is better
+    def score(g):
+        r = g['silhouette'].rank(ascending=False) + g['davies_bouldin'].rank(ascending=True)
+        if g['method'].iat[0] == 'kmeans':
+            return (r + g['ari_stability'].rank(ascending=False)) / 3
+        return r / 2
+    results = results.copy()
+    results['rank_score'] = pd.concat([score(g) for _, g in results.groupby('method')])
+    return results.sort_values(['method', 'rank_score']).reset_index(drop=True)
+
+
+def sweep(X, workers=None, with_umap=True):
+    workers = workers or os.cpu_count()
+    jobs = ([(score_kmeans, cfg)  for cfg in _grid(KMEANS_GRID)]
+            + [(score_hdbscan, cfg) for cfg in _grid(HDBSCAN_GRID)]
+            + ([(score_umap, cfg) for cfg in _grid(UMAP_GRID)] if with_umap else []))
+    print(f"Sweeping {len(jobs)} configurations on {workers} workers  (X: {X.shape})")
+
+    t0 = time.perf_counter()
+    clustering, embedding = [], []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(X,)) as pool:
+        futures = {pool.submit(fn, **cfg): cfg for fn, cfg in jobs}
+        for fut in as_completed(futures):
+            r = fut.result()
+            (clustering if 'method' in r else embedding).append(r)
+            params = ' '.join(f"{k}={v}" for k, v in futures[fut].items())
+            print(f"  [pid {r['worker']}] {r.get('method', 'umap'):8s} {params:50s} {r['seconds']:6.2f}s")
+
+    print(f"Wall time: {time.perf_counter() - t0:.1f}s  "
+          f"(sum of config times: {sum(r['seconds'] for r in clustering + embedding):.1f}s)")
+
+    umap_results = pd.DataFrame(embedding)
+    if len(umap_results):
+        umap_results = umap_results.sort_values('trustworthiness', ascending=False).reset_index(drop=True)
+    return rank(pd.DataFrame(clustering)), umap_results
+
+
+if __name__ == '__main__':
+    from BattleStore import load_wars
+    from BattleCluster import standardize
+
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv else None
+    X, _, _ = standardize(load_wars())
+
+    results, umap_results = sweep(X, workers=workers, with_umap='--no-umap' not in sys.argv)
+
+    results.to_csv(SWEEP_PATH, index=False)
+    print(f"\nSaved: {SWEEP_PATH}")
+    for method, g in results.groupby('method'):
+        print(f"\n── Top {method} configurations ──")
+        print(g.dropna(axis=1, how='all').head(5).round(3).to_string(index=False))
+
+    if len(umap_results):
+        umap_results.to_csv(UMAP_PATH, index=False)
+        print(f"\nSaved: {UMAP_PATH}")
+        print(umap_results.head(5).round(3).to_string(index=False))
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+import numpy as np
+import pandas as pd
+from BattlePaths import CACHE_PATH, BELLIGERENTS_CSV, ALIAS_CSV
+
+# Commander name resolution.
+#
+# A belligerent's `co` string is split into commanders on '&', ',' and the
+# word AND ("WELLINGTON & BLUECHER", "MONTGOMERY AND LEESE").  Each part is
+# normalized to a token (accents folded, punctuation dropped, upper-cased,
+# whitespace collapsed) and looked up in the alias table, ALIAS_CSV, which
+# maps tokens to canonical names (BONAPARTE -> NAPOLEON I).  Tokens without an
+# alias are their own canonical name.
+#
+# The column is resolved once per distinct string, not per row: pd.factorize
+# gives every row a code into the unique strings, the uniques are resolved
+# (from the cache where possible), and the results are gathered back by code.
+# Resolutions are cached in MAP_PATH under a hash of the alias table, so a
+# later run only resolves strings it has not seen before, and editing the
+# alias table starts the cache over.
+#
+#   primary(co)        the first listed commander, one per row (co_clean)
+#   commands(bel)      long format: one row per (belligerent, commander), with
+#                      the number of joint commanders and each one's share, so
+#                      roster-wide counts can credit every commander without
+#                      counting a battle more than once
+#   credited(bel)      the belligerent rows joined onto commands(bel), which is
+#                      what per-commander statistics are built from
+
+SPLIT_RE = re.compile(r'\s*(?:&|,|\bAND\b)\s*')
+PUNCT_RE = re.compile(r"[^\w\s'-]")
+MAP_VERSION = 1
+
+MAP_PATH = f'{CACHE_PATH}/commander_map.json'
+
+_ALIASES = None
+_MAP     = None
+
+
+# ── Normalization ─────────────────────────────────────────────────────────────
+def token(name):
+    """Normalized lookup key for one commander name."""
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ' '.join(PUNCT_RE.sub(' ', name.upper()).split())
+
+
+def split(co):
+    """Tokens of every commander named in one co string, in order."""
+    return [t for t in (token(part) for part in SPLIT_RE.split(co.upper())) if t]
+
+
+# ── Alias table and cache ─────────────────────────────────────────────────────
+def _table_hash(path=ALIAS_CSV):
+    h = hashlib.sha256(f'v{MAP_VERSION}'.encode())
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def aliases(path=ALIAS_CSV):
+    """{token: canonical name} from the alias table."""
+    global _ALIASES
+    if _ALIASES is None:
+        table = pd.read_csv(path, dtype=str) if os.path.exists(path) else pd.DataFrame(columns=['alias', 'commander'])
+        _ALIASES = {token(a): token(c) for a, c in zip(table['alias'], table['commander'])}
+    return _ALIASES
+
+
+def canonical(name):
+    """Canonical name for a single commander."""
+    t = token(name)
+    return aliases().get(t, t)
+
+
+def _load_map():
+    global _MAP
+    if _MAP is None:
+        _MAP = {}
+        if os.path.exists(MAP_PATH):
+            with open(MAP_PATH) as f:
+                cached = json.load(f)
+            if cached.get('key') == _table_hash():
+                _MAP = cached['map']
+    return _MAP
+
+
+def _save_map():
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    tmp = MAP_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'key': _table_hash(), 'map': _MAP}, f)
+    os.replace(tmp, MAP_PATH)
+
+
+def resolve_unique(strings):
+    """Canonical commander lists for distinct co strings, resolving only the unseen ones."""
+    cache  = _load_map()
+    unseen = [s for s in strings if s not in cache]
+    if unseen:
+        table = aliases()
+        for s in unseen:
+            names = []
+            for t in split(s):
+                name = table.get(t, t)
+                if name not in names:               # "NAPOLEON & BONAPARTE" is one commander
+                    names.append(name)
+            cache[s] = names
+        _save_map()
+    return [cache[s] for s in strings], len(unseen)
+
+
+# ── Column-wide resolution ────────────────────────────────────────────────────
+def _factorized(co):
+    codes, uniques = pd.factorize(co, use_na_sentinel=True)
+    names, _ = resolve_unique([str(u) for u in uniques.tolist()])
+    return codes, names
+
+
+def primary(co):
+    """First listed canonical commander for every row (NaN where co is missing or empty)."""
+    codes, names = _factorized(co)
+    first = np.array([n[0] if n else np.nan for n in names] + [np.nan], dtype=object)
+    return pd.Series(first[codes], index=getattr(co, 'index', None), name='co_clean')
+
+
+def commands(bel):
+    """Long commander <-> belligerent table: isqno, attacker, co, commander, position, n_commanders, share."""
+    codes, names = _factorized(bel['co'])
+    count  = np.array([len(n) for n in names] + [0])
+    flat   = np.array([name for n in names for name in n], dtype=object)
+    start  = np.concatenate([[0], np.cumsum(count[:-1])])        # offset of each unique in flat
+
+    per_row = count[codes]
+    rows    = np.repeat(np.arange(len(bel)), per_row)
+    pos     = np.arange(len(rows)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    take    = start[codes[rows]] + pos
+
+    return pd.DataFrame({
+        'isqno':        bel['isqno'].to_numpy()[rows],
+        'attacker':     bel['attacker'].to_numpy()[rows],
+        'co':           bel['co'].to_numpy()[rows],
+        'commander':    flat[take],
+        'position':     pos.astype(np.int8),
+        'n_commanders': per_row[rows].astype(np.int8),
+        'share':        1.0 / per_row[rows],
+    })
+
+
+def credited(bel, long=None):
+    """bel repeated once per commander: its columns (less co_clean) plus commander and share."""
+    long = commands(bel) if long is None else long
+    return (long[['isqno', 'attacker', 'commander', 'share']]
+            .merge(bel.drop(columns='co_clean', errors='ignore'), on=['isqno', 'attacker']))
+
+
+if __name__ == '__main__':
+    bel = pd.read_csv(sys.argv[1] if len(sys.argv) > 1 else BELLIGERENTS_CSV)
+
+    t0 = time.perf_counter()
+    codes, uniques = pd.factorize(bel['co'])
+    _, n_new = resolve_unique([str(u) for u in uniques])
+    resolve_s = time.perf_counter() - t0
+
+    t0  = time.perf_counter()
+    co_clean = primary(bel['co'])
+    long = commands(bel)
+    gather_s = time.perf_counter() - t0
+
+    joint = long[(long['n_commanders'] > 1) & (long['position'] == 0)]
+    print(f"{len(bel):,} belligerent rows, {len(uniques):,} distinct co strings "
+          f"({n_new:,} resolved, the rest cached) in {resolve_s * 1000:.1f} ms; "
+          f"column gathers {gather_s * 1000:.1f} ms")
+    print(f"{co_clean.nunique():,} primary commanders, {long['commander'].nunique():,} commanders in any command; "
+          f"{joint['co'].nunique()} joint commands on {len(joint):,} rows")
+    changed = bel['co'].notna() & (bel['co'] != co_clean)
+    for raw, clean in sorted(set(zip(bel['co'][changed], co_clean[changed]))):
+        print(f"  {raw:28s} -> {clean:16s}  {' + '.join(resolve_unique([raw])[0][0])}")
@@ -0,0 +1,280 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from BattleStore import DATA_PATH, CACHE_PATH
+
+# Bootstrap consensus clustering: how stable are the clusters behind
+# cluster_names?
+#
+# The PCA + KMeans / HDBSCAN steps of BattleCluster.fit_pipeline are refitted
+# on RESAMPLES bootstrap resamples of the standardized battles, in a process
+# pool that gets the matrix once through its initializer (as in
+# ClusterSweep.py).  For every pair of battles the run counts
+#
+#   together[i, j]   resamples in which i and j got the same label
+#   sampled[i, j]    resamples that contained both
+#
+# and consensus = together / sampled (Monti et al., 2003).
+#
+# Stability only reads pairs inside the same reference cluster, so those are
+# the only pairs counted: `together` is one dense members x members uint16
+# block per method and reference cluster, about n^2 / clusters entries in all
+# instead of the whole n x n triangle.  Workers accumulate the blocks over a
+# batch of resamples and send back only those partial counts, never label
+# arrays; the parent adds them in as they arrive.
+# `sampled` is never shipped either: the parent regenerates each resample from
+# its SeedSequence and keeps one membership bit per battle and resample.
+#
+# A battle's stability is its mean consensus with the other members of its
+# reference cluster (the saved labels in battles_clustered.csv); a cluster's
+# stability is the mean over its members.  HDBSCAN noise has no stability.
+
+CONSENSUS_BATTLES  = f'{DATA_PATH}/consensus_battles.csv'
+CONSENSUS_CLUSTERS = f'{DATA_PATH}/consensus_clusters.csv'
+CONSENSUS_PATH     = f'{CACHE_PATH}/consensus.npz'
+
+METHODS          = ('kmeans', 'hdbscan')
+RESAMPLES        = 200
+BATCH            = 10             # resamples per worker job
+N_COMPONENTS     = 10             # same settings as BattleCluster.fit_pipeline
+N_CLUSTERS       = 8
+MIN_CLUSTER_SIZE = 5
+
+_X      = None
+_GROUPS = None
+
+
+def _init(X, groups):
+    global _X, _GROUPS
+    _X, _GROUPS = X, groups
+
+
+# ── Resamples ─────────────────────────────────────────────────────────────────
+def resample(seq, n):
+    """(unique battles drawn, times drawn) for one bootstrap resample."""
+    idx = np.random.default_rng(seq).integers(0, n, n)
+    return np.unique(idx, return_counts=True)
+
+
+def groups(ref):
+    """{method: [(reference cluster, member indices)]}, HDBSCAN noise left out."""
+    return {m: [(int(c), np.flatnonzero(ref[m] == c)) for c in np.unique(ref[m]) if c >= 0] for m in METHODS}
+
+
+def _accumulate(blocks, method, labels, members_by_cluster):
+    # labels: one per battle, -1 where not drawn (or HDBSCAN noise)
+    for c, members in members_by_cluster:
+        l = labels[members]
+        if (l < 0).all():
+            continue
+        same = (l[:, None] == l[None, :]) & (l[:, None] >= 0)
+        key  = (method, c)
+        if key not in blocks:
+            blocks[key] = np.zeros(same.shape, dtype=np.uint16)
+        blocks[key] += same
+
+
+def run_batch(seqs):
+    """Fit every resample in seqs; return the summed within-reference-cluster blocks."""
+    from sklearn.decomposition import PCA
+    from sklearn.cluster import KMeans
+    import hdbscan
+
+    t0    = time.perf_counter()
+    n      = len(_X)
+    blocks = {}
+    for seq in seqs:
+        uniq, counts = resample(seq, n)
+        pca = PCA(n_components=min(N_COMPONENTS, _X.shape[1]), random_state=42).fit(np.repeat(_X[uniq], counts, axis=0))
+        Z   = pca.transform(_X[uniq])
+        fits = {
+            'kmeans':  KMeans(n_clusters=N_CLUSTERS, random_state=int(seq.generate_state(1)[0]))
+                           .fit(Z, sample_weight=counts).labels_,
+            'hdbscan': hdbscan.HDBSCAN(min_cluster_size=MIN_CLUSTER_SIZE).fit_predict(Z),
+        }
+        for method, labels in fits.items():
+            full = np.full(n, -1)
+            full[uniq] = labels
+            _accumulate(blocks, method, full, _GROUPS[method])
+    return {'blocks': blocks, 'resamples': len(seqs), 'seconds': time.perf_counter() - t0, 'worker': os.getpid()}
+
+
+# ── Consensus run ─────────────────────────────────────────────────────────────
+def reference(df, X):
+    """Reference KMeans / HDBSCAN labels: the saved ones, or a fresh fit_pipeline-style fit."""
+    from BattleStore import load_clustered
+    saved = load_clustered().set_index('isqno')
+    if df['isqno'].isin(saved.index).all():
+        rows = saved.loc[df['isqno']]
+        return {m: rows[m].to_numpy(dtype=int) for m in METHODS}
+
+    from sklearn.decomposition import PCA
+    from sklearn.cluster import KMeans
+    import hdbscan
+    Z = PCA(n_components=min(N_COMPONENTS, X.shape[1]), random_state=42).fit_transform(X)
+    return {'kmeans':  KMeans(n_clusters=N_CLUSTERS, random_state=42).fit_predict(Z),
+            'hdbscan': hdbscan.HDBSCAN(min_cluster_size=MIN_CLUSTER_SIZE).fit_predict(Z)}
+
+
+def run(df, resamples=RESAMPLES, workers=None, seed=42, batch=BATCH):
+    from BattleCluster import standardize
+
+    if resamples > np.iinfo(np.uint16).max:
+        raise ValueError(f"At most {np.iinfo(np.uint16).max} resamples fit the uint16 blocks")
+    X, _, _ = standardize(df)
+    ref     = reference(df, X)
+    order   = np.argsort(ref['kmeans'], kind='stable')          # reference clusters contiguous
+    X       = X[order]
+    ref     = {m: ref[m][order] for m in METHODS}
+    n       = len(X)
+
+    seqs    = np.random.SeedSequence(seed).spawn(resamples)
+    sampled = np.zeros((n, resamples), dtype=bool)
+    for r, seq in enumerate(seqs):
+        sampled[resample(seq, n)[0], r] = True
+
+    workers = workers or os.cpu_count()
+    print(f"{resamples} bootstrap resamples of {n:,} battles on {workers} workers ({batch} per job)")
+    t0, done, blocks = time.perf_counter(), 0, {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(X, groups(ref))) as pool:
+        futures = [pool.submit(run_batch, seqs[i:i + batch]) for i in range(0, resamples, batch)]
+        for fut in as_completed(futures):
+            r = fut.result()
+            for key, block in r['blocks'].items():
+                if key in blocks:
+                    blocks[key] += block
+                else:
+                    blocks[key] = block
+            done += r['resamples']
+            print(f"  [pid {r['worker']}] {done:5d}/{resamples} resamples  {r['seconds']:6.2f}s")
+    print(f"Wall time: {time.perf_counter() - t0:.1f}s")
+
+    return {
+        'isqno':   df['isqno'].to_numpy()[order],
+        'ref':     ref,
+        'sampled': sampled,
+        'blocks':  blocks,
+    }
+
+
+# ── Stability ─────────────────────────────────────────────────────────────────
+def battle_stability(result, method):
+    """Mean consensus of each battle with the rest of its reference cluster (NaN for noise)."""
+    ref, sampled = result['ref'][method], result['sampled']
+    out = np.full(len(ref), np.nan)
+    for c, members in groups(result['ref'])[method]:
+        s    = sampled[members].astype(np.float32)
+        both = s @ s.T
+        same = both > 0
+        np.fill_diagonal(same, False)
+        cons = np.where(same, result['blocks'].get((method, c), 0) / np.maximum(both, 1), 0.0)
+        with np.errstate(invalid='ignore'):
+            out[members] = cons.sum(axis=1) / same.sum(axis=1)
+    return out
+
+
+def cluster_stability(result, method, battle=None):
+    battle = battle_stability(result, method) if battle is None else battle
+    df = pd.DataFrame({'cluster': result['ref'][method], 'stability': battle})
+    df = df[df['cluster'] >= 0]
+    return df.groupby('cluster')['stability'].agg(size='size', stability='mean',
+                                                  min_battle='min').reset_index()
+
+
+def consensus_row(result, method, isqno):
+    """Consensus of one battle with the members of its reference cluster, by isqno (NaN elsewhere)."""
+    i   = int(np.flatnonzero(result['isqno'] == isqno)[0])
+    ref, sampled = result['ref'][method], result['sampled']
+    row = np.full(len(ref), np.nan)
+    if ref[i] >= 0:
+        members = np.flatnonzero(ref == ref[i])
+        block   = result['blocks'].get((method, int(ref[i])), np.zeros((len(members),) * 2))
+        both    = sampled[i].astype(np.float32) @ sampled[members].T.astype(np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            row[members] = np.where(both > 0, block[np.searchsorted(members, i)] / both, np.nan)
+    return pd.Series(row, index=result['isqno'], name=method)
+
+
+# ── Persistence ───────────────────────────────────────────────────────────────
+def save(result, path=CONSENSUS_PATH):
+    from BattleStore import save_npz
+    arrays = {f'block_{m}_{c}': b for (m, c), b in result['blocks'].items()}
+    arrays.update({f'ref_{m}': result['ref'][m] for m in METHODS})
+    save_npz(path, '', compressed=True, isqno=result['isqno'], sampled=np.packbits(result['sampled'], axis=1),
+             n_resamples=result['sampled'].shape[1], **arrays)
+
+
+def load(path=CONSENSUS_PATH):
+    from BattleStore import load_npz
+    z = load_npz(path)
+    blocks = {}
+    for k in z:
+        if k.startswith('block_'):
+            _, m, c = k.split('_')
+            blocks[(m, int(c))] = z[k]
+    return {
+        'isqno':   z['isqno'],
+        'ref':     {m: z[f'ref_{m}'] for m in METHODS},
+        'sampled': np.unpackbits(z['sampled'], axis=1, count=int(z['n_resamples'])).astype(bool),
+        'blocks':  blocks,
+    }
+
+
+if __name__ == '__main__':
+    from BattlePaths import cluster_names
+
+    parser = argparse.ArgumentParser(description='Bootstrap consensus clustering')
+    parser.add_argument('--resamples', type=int, default=RESAMPLES)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--batch', type=int, default=BATCH, help='resamples per worker job')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--wars', help='a wars.csv-shaped file instead of data/wars.csv')
+    args = parser.parse_args()
+
+    if args.wars:
+        from BattleStore import apply_schema
+        df = apply_schema(pd.read_csv(args.wars))
+    else:
+        from BattleStore import load_wars
+        df = load_wars()
+
+    result = run(df, args.resamples, args.workers, args.seed, args.batch)
+    save(result)
+    n_blocks = len(result['blocks'])
+    print(f"Co-assignment: {n_blocks} within-cluster blocks, "
+          f"{sum(b.nbytes for b in result['blocks'].values()) / 2**20:.1f} MB "
+          f"(dense: {len(METHODS) * len(result['isqno']) ** 2 * 2 / 2**20:.1f} MB); saved {CONSENSUS_PATH}")
+
+    battles  = pd.DataFrame({'isqno': result['isqno']})
+    clusters = []
+    for method in METHODS:
+        stab = battle_stability(result, method)
+        battles[method] = result['ref'][method]
+        battles[f'{method}_stability'] = stab
+        table = cluster_stability(result, method, stab)
+        table.insert(0, 'method', method)
+        clusters.append(table)
+    battles['n_sampled'] = result['sampled'].sum(axis=1)
+    clusters = pd.concat(clusters, ignore_index=True)
+
+    if 'name' in df:
+        battles.insert(1, 'name', battles['isqno'].map(df.set_index('isqno')['name']))
+    battles.sort_values('isqno').round(4).to_csv(CONSENSUS_BATTLES, index=False)
+    clusters.round(4).to_csv(CONSENSUS_CLUSTERS, index=False)
+    print(f"Saved: {CONSENSUS_BATTLES}, {CONSENSUS_CLUSTERS}")
+
+    print("\n── KMeans cluster stability (mean consensus within the cluster) ──")
+    for r in clusters[clusters['method'] == 'kmeans'].itertuples():
+        print(f"  {r.cluster}  {cluster_names.get(r.cluster, ''):32s} n={r.size:4d}  "
+              f"stability {r.stability:.3f}  (least stable battle {r.min_battle:.3f})")
+    hdb = clusters[clusters['method'] == 'hdbscan']
+    print(f"\n── HDBSCAN: {len(hdb)} clusters, mean stability {hdb['stability'].mean():.3f}, "
+          f"{(result['ref']['hdbscan'] < 0).sum()} noise battles ──")
+
+    shaky = battles.dropna(subset=['kmeans_stability']).nsmallest(10, 'kmeans_stability')
+    print("\n── Least stable battles (KMeans) ──")
+    for r in shaky.itertuples():
+        print(f"  {r.isqno:>6}  {str(getattr(r, 'name', ''))[:36]:36s} cluster {r.kmeans}  {r.kmeans_stability:.3f}")
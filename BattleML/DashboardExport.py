@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import numpy as np
+from scipy import stats
+from BattleStore import DATA_PATH
+
+# Dashboard export.
+#
+# index.html reads all of its numbers from one binary bundle written here, so
+# the browser shows exactly what the Python scripts compute.  Layout (little
+# endian):
+#
+#   b'BTML' | uint32 version | uint32 index length | JSON index | arrays
+#
+# The JSON index holds names and scalars plus, for every array, its dtype,
+# shape and byte offset from the start of the array section.  Offsets are
+# 8-byte aligned so the page can wrap each one in a typed array without
+# copying.  The file name carries a hash of its contents for cache busting;
+# write_bundle points index.html at the new name.
+#
+# python BattleML/DashboardExport.py --check rebuilds the numbers, decodes the
+# bundle index.html points at and fails if they differ or the bundle is over
+# PAYLOAD_BUDGET.  It also fails on any figure typed straight into the page
+# text: prose numbers are filled in from the bundle, so only PAGE_CONSTANTS
+# (the source, its span and the method) may appear there literally.
+
+BUNDLE_VERSION = 1
+MAGIC          = b'BTML'
+BUNDLE_DIR     = f'{DATA_PATH}/dashboard'
+HTML_PATH      = './BattleML/index.html'
+PAYLOAD_BUDGET = 64 * 1024
+
+UNDERDOG_RATIO = 1.0
+CI_LEVEL       = 0.95
+UMAP_LEVELS    = 2**16 - 1
+
+DTYPES = {'float32': np.float32, 'uint16': np.uint16, 'uint8': np.uint8}
+URL_RE = re.compile(r"const BUNDLE_URL = '([^']*)';")
+
+PAGE_CONSTANTS = ('CDB90', '1600–1973', '0–10', '100,000')
+
+
+# ── Numbers ───────────────────────────────────────────────────────────────────
+def _quantize(v):
+    lo, hi = float(np.nanmin(v)), float(np.nanmax(v))
+    q = np.round((v - lo) / ((hi - lo) or 1.0) * UMAP_LEVELS)
+    return q.astype(np.uint16), [lo, hi]
+
+
+def dequantize(q, bounds):
+    lo, hi = bounds
+    return lo + q.astype(np.float64) / UMAP_LEVELS * (hi - lo)
+
+
+def build_payload(bel_commands, clustered, generals, cluster_names):
+    """(meta, arrays): everything the dashboard shows, keyed by array name.
+
+    Commander figures count each bel_commands row by its share, the same
+    population AchIndex and QueryServer report, so battle counts may be
+    fractional.
+    """
+    from AchIndex import ACH_LEVELS, WIN_ACH
+    from BayesRank import fitted_prior
+    from HeadtoHeadMatrix import ach_histograms, matchup_matrix
+
+    alpha, beta = fitted_prior(bel_commands)
+
+    rows = bel_commands[bel_commands['commander'].isin(generals)].dropna(subset=['ach']).copy()
+    rows['underdog']  = rows['force_ratio'] < UNDERDOG_RATIO
+    rows['win']       = (rows['ach'] >= WIN_ACH) * rows['share']
+    rows['dog']       = rows['underdog'] * rows['share']
+    rows['ach_sum']   = rows['ach'] * rows['share']
+    rows['int_sum']   = rows['casualty_intensity'] * rows['share']
+    rows['int_share'] = rows['casualty_intensity'].notna() * rows['share']
+
+    commanders, clusters, counts = ach_histograms(rows, commanders=generals)
+    per = (rows.groupby('commander')[['share', 'win', 'dog', 'ach_sum', 'int_sum', 'int_share']].sum()
+               .reindex(generals, fill_value=0))
+
+    n        = per['share'].to_numpy()
+    wins     = per['win'].to_numpy()
+    dog      = rows[rows['underdog']].groupby('commander')[['win', 'share']].sum()
+    fav      = rows[~rows['underdog']].groupby('commander')[['win', 'share']].sum()
+    a, b     = alpha + wins, beta + n - wins
+    lo, hi   = stats.beta.interval(CI_LEVEL, a, b)
+    by_cluster = rows.groupby(['commander', 'kmeans'])[['win', 'share']].sum()
+
+    def grid(col):
+        return (by_cluster[col].unstack(fill_value=0)
+                .reindex(index=generals, columns=clusters, fill_value=0).to_numpy())
+
+    c = clustered.dropna(subset=['kmeans'])
+    per_cluster = c.groupby('kmeans').agg(battles=('isqno', 'size'),
+                                          intensity=('casualty_intensity', 'median'),
+                                          force_ratio=('force_ratio', 'median'),
+                                          troops=('total_troops', 'median'),
+                                          attacker_wins=('ach_diff', lambda d: (d > 0).mean()))
+    per_cluster = per_cluster.reindex(clusters)
+
+    ux, x_bounds = _quantize(c['umap_x'].to_numpy(np.float64))
+    uy, y_bounds = _quantize(c['umap_y'].to_numpy(np.float64))
+
+    arrays = {
+        'battles':        n,
+        'wins':           wins,
+        'raw_wr':         wins / np.where(n > 0, n, 1),
+        'bayes_wr':       a / (a + b),
+        'ci_lo':          lo,
+        'ci_hi':          hi,
+        'avg_ach':        (per['ach_sum'] / per['share']).to_numpy(),
+        'intensity':      (per['int_sum'] / per['int_share']).to_numpy(),
+        'underdog_pct':   (per['dog'] / per['share']).to_numpy() * 100,
+        'fav_n':          fav['share'].reindex(generals, fill_value=0).to_numpy(),
+        'fav_wins':       fav['win'].reindex(generals, fill_value=0).to_numpy(),
+        'dog_n':          dog['share'].reindex(generals, fill_value=0).to_numpy(),
+        'dog_wins':       dog['win'].reindex(generals, fill_value=0).to_numpy(),
+        'ach_hist':       (rows.groupby(['commander', rows['ach'].astype(int)])['share'].sum().unstack(fill_value=0)
+                           .reindex(index=generals, columns=range(ACH_LEVELS), fill_value=0).to_numpy()),
+        'cluster_n':      grid('share'),
+        'cluster_wins':   grid('win'),
+        'h2h_wdl':        matchup_matrix(counts),
+        'cl_battles':     per_cluster['battles'].to_numpy(),
+        'cl_intensity':   per_cluster['intensity'].to_numpy(),
+        'cl_force_ratio': per_cluster['force_ratio'].to_numpy(),
+        'cl_troops':      per_cluster['troops'].to_numpy(),
+        'cl_att_wins':    per_cluster['attacker_wins'].to_numpy(),
+        'umap_x':         ux,
+        'umap_y':         uy,
+        'umap_kmeans':    c['kmeans'].to_numpy(),
+    }
+    # Commander counts stay float32: a joint command credits half a battle
+    counts_like = {'cl_battles', 'umap_x', 'umap_y'}
+    arrays = {k: np.ascontiguousarray(v, dtype=np.uint16 if k in counts_like
+                                      else np.uint8 if k == 'umap_kmeans' else np.float32)
+              for k, v in arrays.items()}
+
+    meta = {
+        'commanders':    [str(s) for s in commanders],
+        'clusters':      [int(k) for k in clusters],
+        'cluster_names': {str(k): cluster_names.get(int(k), f'Cluster {k}') for k in clusters},
+        'prior':         [alpha, beta],
+        'win_ach':       WIN_ACH,
+        'ci_level':      CI_LEVEL,
+        'underdog_ratio': UNDERDOG_RATIO,
+        'umap_bounds':   {'x': x_bounds, 'y': y_bounds},
+    }
+    return meta, arrays
+
+
+# ── Bundle ────────────────────────────────────────────────────────────────────
+def _align(n, to=8):
+    return -n % to
+
+
+def encode(meta, arrays):
+    layout, blobs, offset = {}, [], 0
+    for name, arr in arrays.items():
+        raw = arr.tobytes()
+        layout[name] = {'dtype': str(arr.dtype), 'shape': list(arr.shape),
+                        'offset': offset, 'bytes': len(raw)}
+        pad = _align(len(raw))
+        blobs.append(raw + b'\0' * pad)
+        offset += len(raw) + pad
+
+    # Sums let the page check it decoded the same numbers
+    checks = {name: float(np.nansum(arr, dtype=np.float64)) for name, arr in arrays.items()}
+    index  = json.dumps({'version': BUNDLE_VERSION, 'meta': meta, 'arrays': layout,
+                         'checks': checks}, separators=(',', ':')).encode()
+    index += b' ' * _align(len(MAGIC) + 8 + len(index))
+    return MAGIC + struct.pack('<II', BUNDLE_VERSION, len(index)) + index + b''.join(blobs)
+
+
+def decode(buf):
+    """Inverse of encode: (index, arrays).  Mirrors loadBundle in index.html."""
+    if buf[:4] != MAGIC:
+        raise ValueError('Not a dashboard bundle')
+    version, n = struct.unpack_from('<II', buf, 4)
+    if version != BUNDLE_VERSION:
+        raise ValueError(f'Bundle version {version}, expected {BUNDLE_VERSION}')
+    start  = len(MAGIC) + 8
+    index  = json.loads(buf[start:start + n])
+    base   = start + n
+    arrays = {name: np.frombuffer(buf, dtype=DTYPES[s['dtype']], offset=base + s['offset'],
+                                  count=int(np.prod(s['shape'], dtype=np.int64))).reshape(s['shape'])
+              for name, s in index['arrays'].items()}
+    return index, arrays
+
+
+def write_bundle(buf, out_dir=BUNDLE_DIR, html=HTML_PATH):
+    name = f"dashboard.{hashlib.sha256(buf).hexdigest()[:12]}.bin"
+    os.makedirs(out_dir, exist_ok=True)
+    for old in os.listdir(out_dir):
+        if old.startswith('dashboard.') and old.endswith('.bin') and old != name:
+            os.remove(os.path.join(out_dir, old))
+    with open(os.path.join(out_dir, name), 'wb') as f:
+        f.write(buf)
+
+    url = os.path.relpath(os.path.join(out_dir, name), os.path.dirname(html))
+    with open(html) as f:
+        page = f.read()
+    with open(html, 'w') as f:
+        f.write(URL_RE.sub(f"const BUNDLE_URL = '{url}';", page))
+    return name, url
+
+
+def bundle_path(html=HTML_PATH):
+    with open(html) as f:
+        m = URL_RE.search(f.read())
+    if m is None:
+        raise ValueError(f'No BUNDLE_URL in {html}')
+    return os.path.join(os.path.dirname(html), m.group(1))
+
+
+def page_figures(html=HTML_PATH):
+    """Numbers in the static text of the page that are not PAGE_CONSTANTS."""
+    with open(html) as f:
+        body = f.read().split('<body', 1)[-1]
+    body = re.sub(r'<script.*?</script>|<style.*?</style>|<!--.*?-->', ' ', body, flags=re.S)
+    text = re.sub(r'<[^>]+>', ' ', body)
+    for c in PAGE_CONSTANTS:
+        text = text.replace(c, ' ')
+    return re.findall(r'[^\s]*\d[^\s]*', text)
+
+
+def check(meta, arrays, path, budget=PAYLOAD_BUDGET):
+    """Problems with the bundle at path compared with freshly built numbers; [] if none."""
+    if not os.path.exists(path):
+        return [f'{path} does not exist']
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    problems = []
+    if len(buf) > budget:
+        problems.append(f'{len(buf):,} bytes is over the {budget:,} byte budget')
+    if not os.path.basename(path).startswith(f"dashboard.{hashlib.sha256(buf).hexdigest()[:12]}"):
+        problems.append('file name does not match its content hash')
+
+    index, got = decode(buf)
+    if index['meta']['commanders'] != meta['commanders'] or index['meta']['clusters'] != meta['clusters']:
+        problems.append('commanders or clusters differ')
+    for name, want in arrays.items():
+        have = got.get(name)
+        if have is None or have.shape != want.shape:
+            problems.append(f'{name}: missing or reshaped')
+        elif not np.allclose(have, want, rtol=1e-6, atol=1e-6, equal_nan=True):
+            problems.append(f'{name}: values differ (max {np.nanmax(np.abs(have - want.astype(have.dtype))):.3g})')
+    return problems
+
+
+if __name__ == '__main__':
+    from BattleStore import load_bel_commands, load_clustered
+    from BattlePaths import cluster_names
+    from NapoleonStats import generals
+
+    meta, arrays = build_payload(load_bel_commands(), load_clustered(), generals, cluster_names)
+
+    if '--check' in sys.argv:
+        path = bundle_path()
+        problems = check(meta, arrays, path)
+        problems += [f'index.html hard-codes {s!r}' for s in page_figures()]
+        for p in problems:
+            print(f"  FAIL  {p}")
+        print(f"{path}: {'ok' if not problems else f'{len(problems)} problem(s)'}")
+        sys.exit(1 if problems else 0)
+
+    buf = encode(meta, arrays)
+    name, url = write_bundle(buf)
+    print(f"Saved: {BUNDLE_DIR}/{name}  ({len(buf):,} bytes, budget {PAYLOAD_BUDGET:,})")
+    print(f"index.html -> {url}")
+    for k, arr in sorted(arrays.items(), key=lambda kv: -kv[1].nbytes)[:6]:
+        print(f"  {k:16s} {str(arr.dtype):8s} {str(arr.shape):16s} {arr.nbytes:7,} B")
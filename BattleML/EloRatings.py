@@ -0,0 +1,351 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from BattlePaths import CACHE_PATH, BELLIGERENTS_CSV, ALIAS_CSV
+
+try:
+    from numba import njit
+except ImportError:          # same loop, interpreted (about 100x slower)
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+# Chronological Elo ratings for commanders.
+#
+# Battles are rated in isqno order (CDB90 numbers battles chronologically;
+# battles.csv has no finer date) in one pass.  Every battle is a game between
+# the attacking and the defending side.  The score is fractional and comes
+# from the ach difference, so a crushing win moves ratings further than a
+# narrow one:
+#
+#   score_att = (ach_att - ach_def + 10) / 20          0 .. 1, 0.5 for equal ach
+#   expected  = 1 / (1 + 10 ** ((R_def - R_att) / SCALE))
+#
+# Joint commands are split as in Commanders.commands: a side's rating is the
+# share-weighted mean of its commanders, and each commander's update is scaled
+# by their share.  K is K_NEW for a commander's first PROVISIONAL battles and K
+# afterwards, so newcomers find their level quickly without later results
+# swinging established ratings.
+#
+# All state lives in flat arrays indexed by commander code (ratings, games)
+# and by rated (battle, commander) entry (history), and the pass is a single
+# numba loop over them.  update() continues from a state with battles after
+# its last isqno without replaying anything before it; load_ratings() does
+# that automatically when belligerents.csv has only grown, and replays from
+# scratch when earlier battles, the alias table or the parameters changed.
+#
+#   history(state, 'NAPOLEON I')     rating before/after every battle
+#   leaderboard(state, 20)           current ratings with games and peak
+
+INITIAL     = 1500.0
+SCALE       = 400.0
+K           = 24.0
+K_NEW       = 48.0
+PROVISIONAL = 10
+ACH_SPAN    = 10.0          # ach runs 0-10, so the difference runs -10..10
+
+ELO_PATH = f'{CACHE_PATH}/elo_ratings.npz'
+
+# Bump when battles() or the rating pass changes so saved states are replayed
+ELO_VERSION = 1
+
+# Per-entry and per-battle arrays, in the order they are appended
+ENTRY_KEYS  = ('members', 'side', 'share', 'before', 'after')
+BATTLE_KEYS = ('isqno', 'score', 'expected', 'n_att')
+
+_STATES = {}               # path -> state
+
+
+# ── Battles ───────────────────────────────────────────────────────────────────
+def battles(bel):
+    """Rateable battles from belligerent rows, in isqno order.
+
+    A battle needs an ach score, at least one named commander on both sides
+    and no commander on both.  Entries (one per battle and commander) are
+    grouped by battle, attackers first: entries[ptr[b]:ptr[b + 1]] belong to
+    battles.isqno[b].
+    """
+    from Commanders import commands
+
+    scored = bel.dropna(subset=['ach']).drop_duplicates(['isqno', 'attacker'])
+    ach    = scored.pivot(index='isqno', columns='attacker', values='ach').reindex(columns=[0, 1]).dropna()
+
+    long  = commands(bel)
+    long  = long[long['isqno'].isin(ach.index)]
+    sides = long.groupby('isqno')['attacker'].agg(['min', 'max'])
+    both  = long.loc[long.duplicated(['isqno', 'commander']), 'isqno']     # on both sides: no game
+    keep  = sides.index[(sides['min'] == 0) & (sides['max'] == 1) & ~sides.index.isin(both)]
+    long  = long[long['isqno'].isin(keep)].sort_values(['isqno', 'attacker', 'position'],
+                                                       ascending=[True, False, True], kind='stable')
+    ach   = ach.loc[keep]
+
+    isqno = ach.index.to_numpy(dtype=np.int64)
+    b     = np.searchsorted(isqno, long['isqno'].to_numpy())
+    side  = long['attacker'].to_numpy(dtype=np.int8)
+    score = (ach[1].to_numpy(dtype=np.float64) - ach[0].to_numpy(dtype=np.float64) + ACH_SPAN) / (2 * ACH_SPAN)
+    return {
+        'isqno': isqno,
+        'score': score.clip(0.0, 1.0),
+        'n_att': np.bincount(b, weights=side, minlength=len(isqno)).astype(np.int16),
+        'ptr':   np.concatenate([[0], np.cumsum(np.bincount(b, minlength=len(isqno)))]).astype(np.int64),
+        'names': long['commander'].to_numpy(dtype=str),
+        'side':  side,
+        'share': long['share'].to_numpy(dtype=np.float64),
+    }
+
+
+# ── Rating pass ───────────────────────────────────────────────────────────────
+@njit(cache=True)
+def _rate(ratings, games, ptr, members, side, share, score, k, k_new, provisional, scale,
+          expected, before, after):
+    for b in range(len(score)):
+        r_att = 0.0
+        r_def = 0.0
+        for j in range(ptr[b], ptr[b + 1]):
+            if side[j]:
+                r_att += share[j] * ratings[members[j]]
+            else:
+                r_def += share[j] * ratings[members[j]]
+        e = 1.0 / (1.0 + 10.0 ** ((r_def - r_att) / scale))
+        surprise = score[b] - e
+        expected[b] = e
+
+        for j in range(ptr[b], ptr[b + 1]):
+            c = members[j]
+            step = k_new if games[c] < provisional else k
+            before[j] = ratings[c]
+            ratings[c] += step * share[j] * (surprise if side[j] else -surprise)
+            after[j] = ratings[c]
+            games[c] += 1
+
+
+def new_state(k=K, k_new=K_NEW, provisional=PROVISIONAL, scale=SCALE, initial=INITIAL):
+    state = {
+        'params':     np.array([k, k_new, provisional, scale, initial], dtype=np.float64),
+        'commanders': np.array([], dtype=str),
+        'ratings':    np.array([], dtype=np.float64),
+        'games':      np.array([], dtype=np.int32),
+        'ptr':        np.zeros(1, dtype=np.int64),
+        'members':    np.array([], dtype=np.int32),
+        'side':       np.array([], dtype=np.int8),
+        'share':      np.array([], dtype=np.float64),
+        'before':     np.array([], dtype=np.float64),
+        'after':      np.array([], dtype=np.float64),
+        'isqno':      np.array([], dtype=np.int64),
+        'score':      np.array([], dtype=np.float64),
+        'expected':   np.array([], dtype=np.float64),
+        'n_att':      np.array([], dtype=np.int16),
+    }
+    return _with_lookups(state)
+
+
+def _with_lookups(state):
+    state['index'] = {c: i for i, c in enumerate(state['commanders'].tolist())}
+    return state
+
+
+def last_isqno(state):
+    return int(state['isqno'][-1]) if len(state['isqno']) else -1
+
+
+def _encode(state, names):
+    """Commander codes for names, adding unseen commanders at the initial rating."""
+    codes = pd.Index(state['commanders']).get_indexer(names) if len(state['commanders']) else np.full(len(names), -1)
+    new   = pd.unique(names[codes < 0])
+    if len(new):
+        start = len(state['commanders'])
+        state['commanders'] = np.concatenate([state['commanders'], new.astype(str)])
+        state['ratings']    = np.concatenate([state['ratings'], np.full(len(new), state['params'][4])])
+        state['games']      = np.concatenate([state['games'], np.zeros(len(new), dtype=np.int32)])
+        state['index'].update({c: start + i for i, c in enumerate(new.tolist())})
+        codes[codes < 0] = pd.Index(state['commanders']).get_indexer(names[codes < 0])
+    return codes.astype(np.int32)
+
+
+def update(state, new):
+    """Rate battles after the state's last isqno, in place; the earlier history is not touched.
+
+    `new` is the output of battles() or a belligerents frame.
+    """
+    if isinstance(new, pd.DataFrame):
+        new = battles(new)
+    if len(new['isqno']) and new['isqno'][0] <= last_isqno(state):
+        raise ValueError(f"Battle {new['isqno'][0]} is not after the last rated battle "
+                         f"{last_isqno(state)}; rate() the full history instead")
+
+    members  = _encode(state, new['names'])
+    expected = np.empty(len(new['isqno']))
+    before   = np.empty(len(members))
+    after    = np.empty(len(members))
+    k, k_new, provisional, scale, _ = state['params']
+    _rate(state['ratings'], state['games'], new['ptr'], members, new['side'], new['share'], new['score'],
+          k, k_new, int(provisional), scale, expected, before, after)
+
+    added = {'members': members, 'side': new['side'], 'share': new['share'], 'before': before, 'after': after,
+             'isqno': new['isqno'], 'score': new['score'], 'expected': expected, 'n_att': new['n_att']}
+    for key in ENTRY_KEYS + BATTLE_KEYS:
+        state[key] = np.concatenate([state[key], added[key]])
+    state['ptr'] = np.concatenate([state['ptr'], state['ptr'][-1] + new['ptr'][1:]])
+    return state
+
+
+def rate(bel, **params):
+    return update(new_state(**params), bel)
+
+
+def _split(rated, isqno):
+    """(battles up to and including isqno, battles after it)."""
+    cut = int(np.searchsorted(rated['isqno'], isqno, side='right'))
+    at  = int(rated['ptr'][cut])
+    head, tail = {}, {}
+    for key in ('isqno', 'score', 'n_att'):
+        head[key], tail[key] = rated[key][:cut], rated[key][cut:]
+    for key in ('names', 'side', 'share'):
+        head[key], tail[key] = rated[key][:at], rated[key][at:]
+    head['ptr'], tail['ptr'] = rated['ptr'][:cut + 1], rated['ptr'][cut:] - at
+    return head, tail
+
+
+def _same_history(state, head):
+    # The battles the state already rated, unchanged: same ids, scores and commanders
+    if len(head['isqno']) != len(state['isqno']) or len(head['names']) != len(state['members']):
+        return False
+    known = pd.Index(state['commanders']).get_indexer(head['names'])
+    return (np.array_equal(head['isqno'], state['isqno']) and np.array_equal(head['score'], state['score'])
+            and np.array_equal(head['ptr'], state['ptr']) and np.array_equal(known, state['members'])
+            and np.array_equal(head['side'], state['side']) and np.array_equal(head['share'], state['share']))
+
+
+# ── Persistence ───────────────────────────────────────────────────────────────
+def _key(bel_path):
+    from BattleStore import content_hash
+    return f'v{ELO_VERSION}-' + content_hash(bel_path, ALIAS_CSV)
+
+
+def save(state, path=ELO_PATH):
+    from BattleStore import save_npz
+    save_npz(path, state.get('key', ''), **{k: v for k, v in state.items() if k not in ('index', 'key')})
+
+
+def load(path=ELO_PATH):
+    """The saved state under whatever key it has (an append may still reuse it); None if missing."""
+    from BattleStore import load_npz
+    state = load_npz(path)
+    return None if state is None else _with_lookups(state)
+
+
+def load_ratings(rebuild=False, path=ELO_PATH, bel_path=BELLIGERENTS_CSV):
+    """Saved ratings, brought up to date with bel_path.
+
+    Battles appended after the last rated isqno are rated incrementally; any
+    other change to the input replays the whole history.
+    """
+    if path in _STATES and not rebuild:
+        return _STATES[path]
+
+    from Instrument import stage
+    key   = _key(bel_path)
+    state = None if rebuild else load(path)
+    if state is not None and state['key'] == key:
+        _STATES[path] = state
+        return state
+
+    with stage('elo ratings') as sp:
+        rated = battles(pd.read_csv(bel_path))
+        if state is not None and np.array_equal(state['params'], new_state()['params']):
+            head, tail = _split(rated, last_isqno(state))
+            if _same_history(state, head):
+                rated = tail                                # append only
+            else:
+                state = None
+        else:
+            state = None
+        state = update(state if state is not None else new_state(), rated)
+        state['key'] = key
+        save(state, path)
+        sp.count(len(rated['isqno']))
+    _STATES[path] = state
+    return state
+
+
+# ── Queries ───────────────────────────────────────────────────────────────────
+def rating(state, commander):
+    i = state['index'].get(commander)
+    return float(state['ratings'][i]) if i is not None else np.nan
+
+
+def history(state, commander):
+    """One row per rated battle of the commander, in order."""
+    cols = ['isqno', 'role', 'opponent', 'score', 'expected', 'before', 'after']
+    i = state['index'].get(commander)
+    if i is None:
+        return pd.DataFrame(columns=cols)
+
+    j    = np.flatnonzero(state['members'] == i)
+    b    = np.searchsorted(state['ptr'], j, side='right') - 1
+    att  = state['side'][j].astype(bool)
+    opp  = np.where(att, state['ptr'][b] + state['n_att'][b], state['ptr'][b])     # first listed on the other side
+    return pd.DataFrame({
+        'isqno':    state['isqno'][b],
+        'role':     np.where(att, 'attacker', 'defender'),
+        'opponent': state['commanders'][state['members'][opp]],
+        'score':    np.where(att, state['score'][b], 1 - state['score'][b]),
+        'expected': np.where(att, state['expected'][b], 1 - state['expected'][b]),
+        'before':   state['before'][j],
+        'after':    state['after'][j],
+    }, columns=cols)
+
+
+def leaderboard(state, n=20, min_games=PROVISIONAL):
+    peak = np.full(len(state['ratings']), -np.inf)
+    np.maximum.at(peak, state['members'], state['after'])
+    board = pd.DataFrame({'commander': state['commanders'], 'rating': state['ratings'],
+                          'games': state['games'], 'peak': peak})
+    board = board[board['games'] >= min_games].sort_values('rating', ascending=False)
+    return board.head(n).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Chronological Elo ratings for commanders')
+    parser.add_argument('commanders', nargs='*', help='print the rating history of these commanders')
+    parser.add_argument('--root', help='CDB90 tables directory, e.g. a Synthetic.py corpus')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--min-games', type=int, default=PROVISIONAL)
+    parser.add_argument('--rebuild', action='store_true', help='replay the full history')
+    parser.add_argument('--check', action='store_true', help='rate in two halves and compare with one pass')
+    args = parser.parse_args()
+
+    bel_path = f'{args.root}/belligerents.csv' if args.root else BELLIGERENTS_CSV
+    path     = f'{args.root}/elo_ratings.npz' if args.root else ELO_PATH
+
+    t0 = time.perf_counter()
+    state = load_ratings(rebuild=args.rebuild, path=path, bel_path=bel_path)
+    print(f"{len(state['isqno']):,} battles, {len(state['commanders']):,} commanders rated "
+          f"({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    print(f"State: {path}")
+
+    if args.check:
+        rated = battles(pd.read_csv(bel_path))
+        head, tail = _split(rated, int(np.median(rated['isqno'])))
+        half = rate(head)
+        t0 = time.perf_counter()
+        full = rate(rated)
+        full_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        update(half, tail)
+        tail_s = time.perf_counter() - t0
+        gap = np.abs(full['ratings'] - half['ratings'][pd.Index(half['commanders']).get_indexer(full['commanders'])]).max()
+        print(f"One pass {full_s * 1000:.0f} ms; appending the second half {tail_s * 1000:.0f} ms; "
+              f"max rating difference {gap:.2e}")
+
+    print(f"\n{'':4s}{'commander':28s} {'rating':>7s} {'games':>6s} {'peak':>7s}")
+    for i, r in leaderboard(state, args.top, args.min_games).iterrows():
+        print(f"{i + 1:3d} {r['commander'][:28]:28s} {r['rating']:7.0f} {r['games']:6d} {r['peak']:7.0f}")
+
+    for name in args.commanders:
+        from Commanders import canonical
+        h = history(state, canonical(name))
+        print(f"\n── {canonical(name)}: {len(h)} battles ──")
+        for r in h.itertuples():
+            print(f"  {r.isqno:>7}  {r.role:8s} vs {str(r.opponent)[:22]:22s} "
+                  f"score {r.score:4.2f} (exp {r.expected:4.2f})  {r.before:6.0f} -> {r.after:6.0f}")
@@ -0,0 +1,120 @@
+import math
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import Instrument
+from Instrument import stage
+
+# Fast rendering helpers for the chart scripts.
+#
+# batched_labels replaces one ax.annotate per battle: labels that would
+# overlap an already placed label (checked on a coarse pixel grid) are
+# skipped, and the survivors are drawn as glyph outlines in a single
+# PathCollection instead of hundreds of Text artists.
+#
+# render_all renders independent figures in a process pool on the Agg
+# backend and reports how long each one took.
+#
+# Fast mode is on with --fast or BATTLEML_FAST_RENDER=1.
+
+FAST    = '--fast' in sys.argv or os.environ.get('BATTLEML_FAST_RENDER') == '1'
+WORKERS = int(os.environ.get('BATTLEML_RENDER_WORKERS', 0)) or None
+
+CHAR_WIDTH = 0.6          # average glyph advance, in ems, for the overlap estimate
+
+
+# ── Labels ────────────────────────────────────────────────────────────────────
+def batched_labels(ax, x, y, labels, fontsize=4, offset=(2, 2), priority=None,
+                   color='black', alpha=0.5, fontweight='normal', zorder=3):
+    """Draw non-overlapping labels as one collection; returns how many were drawn."""
+    from matplotlib.collections import PathCollection
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.textpath import TextPath
+    from matplotlib.transforms import Affine2D
+
+    fig    = ax.figure
+    labels = [str(s) for s in labels]
+    data   = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+
+    ax.autoscale_view()
+    px   = fig.dpi / 72.0
+    cell = fontsize * px                                      # one text line, in pixels
+    box  = ax.bbox
+    pos  = ax.transData.transform(data) - [box.x0, box.y0]
+    pos += np.array(offset) * px
+
+    cols = int(math.ceil(box.width / cell)) + 1
+    rows = int(math.ceil(box.height / cell)) + 1
+    taken = np.zeros((rows, cols), dtype=bool)
+
+    order = range(len(labels)) if priority is None else np.argsort(-np.asarray(priority), kind='stable')
+    keep  = []
+    for i in order:
+        if not np.isfinite(pos[i]).all():
+            continue
+        c0, r0 = int(pos[i, 0] // cell), int(pos[i, 1] // cell)
+        c1 = int((pos[i, 0] + len(labels[i]) * CHAR_WIDTH * fontsize * px) // cell)
+        if c0 < 0 or r0 < 0 or c1 >= cols or r0 >= rows:
+            continue
+        if taken[r0, c0:c1 + 1].any():
+            continue
+        taken[r0, c0:c1 + 1] = True
+        keep.append(i)
+
+    if not keep:
+        return 0
+
+    prop  = FontProperties(size=fontsize, weight=fontweight)
+    paths = [TextPath((0, 0), labels[i], prop=prop) for i in keep]
+    # Glyph paths are in points: shift by the offset, then points -> inches -> pixels
+    glyph_to_px = Affine2D().translate(*offset).scale(1 / 72.0) + fig.dpi_scale_trans
+    coll = PathCollection(paths, offsets=data[keep], offset_transform=ax.transData,
+                          transform=glyph_to_px, facecolors=color, edgecolors='none',
+                          alpha=alpha, zorder=zorder)
+    ax.add_collection(coll, autolim=False)
+    return len(keep)
+
+
+# ── Parallel figures ──────────────────────────────────────────────────────────
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _init_worker():
+    _use_agg()
+    Instrument.reset()
+
+
+def _render(job):
+    name, fn, args = job
+    _use_agg()
+    t0 = time.perf_counter()
+    with stage(name):
+        fn(*args)
+    return name, time.perf_counter() - t0
+
+
+def _render_in_worker(job):
+    return _render(job), Instrument.collect()
+
+
+def render_all(jobs, workers=WORKERS, parallel=True):
+    """Run (name, fn, args) figure jobs, in a process pool unless parallel=False."""
+    t0 = time.perf_counter()
+    with stage('render_all', rows=len(jobs)):
+        if parallel and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                timings = []
+                for timing, spans in pool.map(_render_in_worker, jobs):
+                    timings.append(timing)
+                    Instrument.extend(spans)
+        else:
+            timings = [_render(job) for job in jobs]
+
+    for name, seconds in timings:
+        print(f"  {name:34s} {seconds:6.2f}s")
+    print(f"  {'wall':34s} {time.perf_counter() - t0:6.2f}s  ({len(jobs)} figures)")
+    return timings
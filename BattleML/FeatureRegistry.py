@@ -0,0 +1,207 @@
+import argparse
+import re
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr as ne
+except ImportError:          # numpy evaluates the same expressions, one temporary per operation
+    ne = None
+
+# Declarative registry of the engineered features in wars.csv.
+#
+# Every feature is declared once: its expression over the imputed columns
+# (and earlier features), whether it is capped at its CLIP_Q quantile, and
+# whether a log_<name> = log1p(value) column is added.  Inputs are read off
+# the expression.  Raw columns that are only log-transformed are declared
+# without an expression.
+#
+# evaluate() computes the whole set in one pass over numpy views of the
+# input columns.  With numexpr installed each expression runs as one fused
+# kernel, so `(att_cas + def_cas) / total_troops` allocates only its result.
+# Without it, numpy evaluates the same string.  Dependents see the unclipped
+# values (attacker_underdog reads the raw force_ratio), caps are applied in
+# place unless a later feature still reads the unclipped array, and the logs
+# are taken after clipping: the order of the old engineer / clip / transform
+# steps, with identical results.
+#
+# Any subset can be evaluated against an existing wars.csv, which already
+# holds every imputed input, so one feature can be recomputed (or a new one
+# added with register()) without redoing the joins:
+#
+#   python BattleML/FeatureRegistry.py --recompute casualty_intensity
+#   python BattleML/FeatureRegistry.py --add cav_ratio "att_cav / (def_cav + 1)" --log --write
+
+CLIP_Q = 0.99
+
+FUNCTIONS = {
+    'where': np.where, 'log': np.log, 'log1p': np.log1p, 'exp': np.exp,
+    'sqrt': np.sqrt, 'abs': np.abs, 'nan': np.nan, 'inf': np.inf,
+}
+NAME_RE = re.compile(r'[A-Za-z_]\w*')
+
+REGISTRY = {}
+
+
+def register(name, expr=None, clip=False, log=False, dtype=None, replace=False):
+    """Declare a feature; expr=None declares a raw input column that is only transformed."""
+    if name in REGISTRY and not replace:
+        raise ValueError(f"Feature already registered: {name}")
+    inputs = [] if expr is None else list(dict.fromkeys(n for n in NAME_RE.findall(expr) if n not in FUNCTIONS))
+    REGISTRY[name] = {'expr': expr, 'inputs': inputs, 'clip': clip, 'log': log, 'dtype': dtype}
+    return REGISTRY[name]
+
+
+# ── Registry ──────────────────────────────────────────────────────────────────
+for _raw in ['att_str', 'def_str', 'att_cas', 'def_cas', 'duration1']:
+    register(_raw, log=True)
+register('force_ratio',        'att_str / def_str',                                 clip=True, log=True)
+register('att_loss_pct',       'att_cas / att_str',                                 clip=True)
+register('def_loss_pct',       'def_cas / def_str',                                 clip=True)
+register('exchange_ratio',     'where(def_cas == 0, nan, att_cas / def_cas)',       clip=True, log=True)
+register('total_troops',       'att_str + def_str',                                 log=True)
+register('casualty_intensity', '(att_cas + def_cas) / total_troops',                clip=True)
+register('attacker_underdog',  'force_ratio < 0.80',                                dtype='int64')
+register('ach_diff',           'att_ach - def_ach')
+
+# Inputs to BattleCluster's standardize / PCA, in this order
+CLUSTER_FEATURES = [
+    'log_att_str', 'log_def_str', 'log_att_cas', 'log_def_cas',
+    'log_total_troops', 'log_force_ratio', 'log_exchange_ratio',
+    'att_loss_pct', 'def_loss_pct', 'casualty_intensity',
+    'ach_diff', 'attacker_underdog',
+    'log_duration1', 'wofa', 'wofd',
+    'surpa', 'morala', 'momnta', 'techa', 'inita', 'mobila',
+]
+
+
+def derived():
+    return [n for n, f in REGISTRY.items() if f['expr'] is not None]
+
+
+def clip_cols():
+    return [n for n, f in REGISTRY.items() if f['clip']]
+
+
+def log_cols():
+    return [n for n, f in REGISTRY.items() if f['log']]
+
+
+def spec():
+    """Hashable description of the registry, for stage cache keys."""
+    return tuple((n, f['expr'], f['clip'], f['log'], f['dtype']) for n, f in REGISTRY.items())
+
+
+# ── Evaluation ────────────────────────────────────────────────────────────────
+def _needed(names):
+    # names plus every registered feature they depend on, in registry order
+    need, todo = set(), list(names)
+    while todo:
+        n = todo.pop()
+        if n in REGISTRY and n not in need:
+            need.add(n)
+            todo.extend(REGISTRY[n]['inputs'])
+    return [n for n in REGISTRY if n in need]
+
+
+def _run(expr, env):
+    if ne is not None:
+        return ne.evaluate(expr, local_dict={**env, 'nan': np.nan, 'inf': np.inf})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return eval(expr, {'__builtins__': {}, **FUNCTIONS}, env)
+
+
+def evaluate(df, names=None, caps=None, clip=True, log=True):
+    """{column: array} for the named features (default: all) and their log_ columns.
+
+    caps: precomputed cap per clipped feature (ChunkedBuild's sketches);
+    by default each cap is the CLIP_Q quantile of the feature itself.
+    """
+    names  = list(REGISTRY) if names is None else list(names)
+    unknown = [n for n in names if n not in REGISTRY]
+    if unknown:
+        raise KeyError(f"Not registered: {', '.join(unknown)}")
+    order  = _needed(names)
+    read   = {i for n in order for i in REGISTRY[n]['inputs']}      # must stay unclipped
+    env    = {}
+    values = {}
+    logs   = {}
+    for name in order:
+        f = REGISTRY[name]
+        for col in f['inputs'] + ([name] if f['expr'] is None else []):
+            if col not in env:
+                if col not in df:
+                    raise KeyError(f"{name} needs column {col!r}, which is neither in the frame nor registered")
+                env[col] = df[col].to_numpy()
+        if f['expr'] is not None:
+            value = _run(f['expr'], env)
+            env[name] = value = value.astype(f['dtype']) if f['dtype'] else value
+        else:
+            value = env[name]
+        if name not in names:
+            continue
+
+        if clip and f['clip']:
+            cap = caps[name] if caps is not None else np.nanquantile(value, CLIP_Q)
+            if not np.isnan(cap):
+                value = np.minimum(value, cap, out=None if name in read else value)
+        if f['expr'] is not None:
+            values[name] = value
+        if log and f['log']:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                logs[f'log_{name}'] = np.log1p(value)
+    return {**values, **logs}
+
+
+def with_features(df, cols):
+    """df with cols added; existing columns are replaced where they stand."""
+    df = df.copy()
+    for name, value in cols.items():
+        df[name] = value
+    return df
+
+
+if __name__ == '__main__':
+    from BattleStore import WARS_CSV, apply_schema
+
+    parser = argparse.ArgumentParser(description='Feature registry: list, recompute or add features in wars.csv')
+    parser.add_argument('--recompute', nargs='+', default=[], metavar='FEATURE')
+    parser.add_argument('--add', nargs=2, action='append', default=[], metavar=('NAME', 'EXPR'))
+    parser.add_argument('--clip', action='store_true', help=f'cap added features at their {CLIP_Q:g} quantile')
+    parser.add_argument('--log', action='store_true', help='add log_<name> for added features')
+    parser.add_argument('--wars', default=WARS_CSV)
+    parser.add_argument('--write', action='store_true', help='write the columns back into --wars')
+    args = parser.parse_args()
+
+    for name, expr in args.add:
+        register(name, expr, clip=args.clip, log=args.log)
+    unknown = [name for name in args.recompute if name not in REGISTRY]
+    if unknown:
+        parser.error(f"Unknown feature(s): {', '.join(unknown)} (registered: {', '.join(REGISTRY)})")
+    names = args.recompute + [name for name, _ in args.add]
+
+    print(f"{'feature':20s} {'clip':>5s} {'log':>4s}  expression   (numexpr: {'yes' if ne else 'no'})")
+    for name, f in REGISTRY.items():
+        print(f"{name:20s} {'p99' if f['clip'] else '':>5s} {'yes' if f['log'] else '':>4s}  {f['expr'] or '(input)'}")
+    if not names:
+        raise SystemExit
+
+    wars = pd.read_csv(args.wars)
+    t0   = time.perf_counter()
+    cols = evaluate(wars, names)
+    print(f"\nEvaluated {', '.join(cols)} on {len(wars):,} rows in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    for name, value in cols.items():
+        if name not in wars:
+            print(f"  {name:24s} new column")
+            continue
+        old     = wars[name].to_numpy(dtype=float)
+        new     = np.asarray(value, dtype=np.float32).astype(float)      # wars.csv stores float32
+        changed = ~np.isclose(new, old, rtol=1e-6, equal_nan=True)
+        print(f"  {name:24s} {changed.sum():,} rows changed"
+              + (f", max abs change {np.nanmax(np.abs(new - old)[changed]):.3g}" if changed.any() else ''))
+
+    if args.write:
+        apply_schema(with_features(wars, cols)).to_csv(args.wars, index=False)
+        print(f"Saved: {args.wars}")
@@ -1,34 +1,27 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from scipy import stats
+from statistics import NormalDist
+from AchIndex import ACH_LEVELS
+from BattlePaths import cluster_names
+from Instrument import stage, traced
+
+# matplotlib and the data layer (pandas) are imported on first use, so
+# importing monte_carlo from the battleml CLI stays cheap.
 
 #Load
-bel = pd.read_csv('./BattleML/CDB90/data/belligerents.csv')
-df  = pd.read_csv('./BattleML/data/battles_clustered.csv')
-
-bel['co_clean'] = bel['co'].replace({
-    'BONAPARTE':             'NAPOLEON I',
-    'WELLINGTON & BLUECHER': 'WELLINGTON',
-})
-
-bel_merged = bel.merge(df[['isqno', 'kmeans', 'casualty_intensity',
-                             'force_ratio', 'attacker_underdog']], on='isqno', how='left')
-
-cluster_names = {
-    0: "Large-Scale Attritional",
-    1: "High-Intensity Defensive",
-    2: "Decisive Pursuit",
-    3: "Small-Scale Engagement",
-    4: "High-Intensity Offensive",
-    5: "Massive Set-Piece",
-    6: "Failed Assault",
-    7: "Operational-Scale Annihilation",
-}
+ach_index = None          # AchIndex counts; loaded (or built) on first use
 
 N_SIMS = 100_000
 
+# Adaptive mode (monte_carlo(adaptive=True), --adaptive): draw in chunks
+# until the CI on win_pct_a is narrow enough
+CI_LEVEL       = 0.95
+TARGET_HALF_CI = 0.5          # percentage points
+CHUNK_SIMS     = 10_000
+MAX_SIMS       = 2_000_000
+
+# An outer bootstrap over the battles themselves is monte_carlo(n_boot=...),
+# --boot N; off by default
+
 MATCHUPS = [
     ("NAPOLEON I", "WELLINGTON"),
     ("NAPOLEON I", "LEE"),
@@ -39,144 +32,273 @@ MATCHUPS = [
 #Monte Carlo
 
 def get_ach_by_cluster(general):
-    rows = bel_merged[bel_merged['co_clean'] == general][['ach', 'kmeans']].dropna()
-    return rows
-
-def monte_carlo(gen_a, gen_b, n_sims=N_SIMS, seed=42):
+    """(clusters, per-cluster ach histograms) for one general, from the AchIndex."""
+    global ach_index
+    if ach_index is None:
+        from AchIndex import load_index
+        ach_index = load_index()
+    from AchIndex import by_cluster
+    clusters = ach_index['clusters']
+    hists    = by_cluster(ach_index, general)
+    keep     = clusters >= 0                        # unclustered rows sit out, as before
+    return clusters[keep], hists[keep]
+
+def cluster_weights(n_a, n_b, weighting='battles'):
+    """Weight of each shared cluster in OVERALL: combined battles (default), 'equal', or a {cluster: w} dict."""
+    if isinstance(weighting, dict):
+        return weighting
+    if weighting == 'equal':
+        return {c: 1.0 for c in n_a}
+    if weighting == 'battles':
+        return {c: n_a[c] + n_b[c] for c in n_a}
+    raise ValueError(f"Unknown weighting: {weighting}")
+
+@traced
+def monte_carlo(gen_a, gen_b, n_sims=N_SIMS, seed=42, adaptive=False, n_boot=0, weighting='battles'):
+    from AchIndex import mean_ach
     rng = np.random.default_rng(seed)
 
-    data_a = get_ach_by_cluster(gen_a)
-    data_b = get_ach_by_cluster(gen_b)
+    def sims(h_a, h_b):
+        with stage('sims', rows=round(h_a.sum() + h_b.sum())) as sp:
+            if adaptive:
+                r = _run_sims_adaptive(h_a, h_b, rng)
+            else:
+                r = _run_sims(h_a, h_b, n_sims, rng)
+            sp.count(r['n_sims'])
+        if n_boot:
+            with stage('battle_bootstrap', rows=round(h_a.sum() + h_b.sum())):
+                r['boot'] = _battle_bootstrap(h_a, h_b, n_boot, rng)
+            r['boot_lo'], r['boot_hi'] = _percentile_ci(r['boot'])
+            r['boot_width'] = r['boot_hi'] - r['boot_lo']
+        return r
+
+    # Per-cluster ach histograms (share-weighted, so joint commands count in
+    # part); the samplers draw scores from them
+    clusters, hist_a = get_ach_by_cluster(gen_a)
+    _,        hist_b = get_ach_by_cluster(gen_b)
 
     # Find shared cluster types
-    clusters_a = set(data_a['kmeans'].unique())
-    clusters_b = set(data_b['kmeans'].unique())
-    shared = clusters_a & clusters_b
+    shared = clusters[(hist_a.sum(axis=1) > 0) & (hist_b.sum(axis=1) > 0)]
 
-    if not shared:
+    if not len(shared):
         # No shared clusters — use full ach distributions
-        ach_a = data_a['ach'].values
-        ach_b = data_b['ach'].values
         cluster_label = "All Clusters (no overlap)"
-        results = {'Overall': _run_sims(ach_a, ach_b, n_sims, rng)}
+        results = {'Overall': sims(hist_a.sum(axis=0), hist_b.sum(axis=0))}
         return results, cluster_label
 
-    # Run sims per shared cluster, weighted by combined battle count
+    # Run sims per shared cluster
     results = {}
-    weights = {}
-    for c in sorted(shared):
-        ach_a = data_a[data_a['kmeans'] == c]['ach'].values
-        ach_b = data_b[data_b['kmeans'] == c]['ach'].values
-        if len(ach_a) < 2 or len(ach_b) < 2:
+    n_a, n_b = {}, {}
+    for c in shared:
+        k = int(np.searchsorted(clusters, c))
+        if hist_a[k].sum() < 2 or hist_b[k].sum() < 2:
             continue
-        results[cluster_names[c]] = _run_sims(ach_a, ach_b, n_sims, rng)
-        weights[cluster_names[c]] = len(ach_a) + len(ach_b)
+        results[cluster_names[c]] = sims(hist_a[k], hist_b[k])
+        n_a[c], n_b[c] = hist_a[k].sum(), hist_b[k].sum()
 
-    # Overall weighted win probability
+    # Overall weighted win probability; the weights only enter here, so any
+    # scheme reuses the per-cluster draws
+    weights = {cluster_names[c]: w for c, w in cluster_weights(n_a, n_b, weighting).items()
+               if c in n_a and w > 0}
     if weights:
         total = sum(weights.values())
         overall_win_a = sum(
             results[k]['win_pct_a'] * weights[k] / total
             for k in weights
         )
+        # Cluster estimates are independent, so their CI half-widths add in quadrature
+        half_ci = np.sqrt(sum(
+            (weights[k] / total * results[k]['ci_width'] / 2) ** 2
+            for k in weights
+        ))
         results['OVERALL'] = {
             'win_pct_a': overall_win_a,
             'win_pct_b': 100 - overall_win_a,
             'draw_pct':  0.0,
-            'mean_a':    data_a['ach'].mean(),
-            'mean_b':    data_b['ach'].mean(),
-            'n_a':       len(data_a),
-            'n_b':       len(data_b),
+            'mean_a':    mean_ach(hist_a.sum(axis=0)),
+            'mean_b':    mean_ach(hist_b.sum(axis=0)),
+            'n_a':       float(hist_a.sum()),
+            'n_b':       float(hist_b.sum()),
+            'n_sims':    sum(results[k]['n_sims'] for k in weights),
+            'ci_lo':     overall_win_a - half_ci,
+            'ci_hi':     overall_win_a + half_ci,
+            'ci_width':  2 * half_ci,
         }
+        if n_boot:
+            boot = sum(results[k]['boot'] * weights[k] / total for k in weights)
+            results['OVERALL']['boot'] = boot
+            results['OVERALL']['boot_lo'], results['OVERALL']['boot_hi'] = _percentile_ci(boot)
+            results['OVERALL']['boot_width'] = results['OVERALL']['boot_hi'] - results['OVERALL']['boot_lo']
 
     return results
 
-def _run_sims(ach_a, ach_b, n_sims, rng):
-    sims_a = rng.choice(ach_a, size=n_sims, replace=True)
-    sims_b = rng.choice(ach_b, size=n_sims, replace=True)
+def _draw(h, size, rng):
+    # Scores drawn with probability proportional to their (weighted) count
+    return rng.choice(ACH_LEVELS, size=size, p=h / h.sum())
+
+def _run_sims(h_a, h_b, n_sims, rng):
+    sims_a = _draw(h_a, n_sims, rng)
+    sims_b = _draw(h_b, n_sims, rng)
     wins_a = np.sum(sims_a > sims_b)
     wins_b = np.sum(sims_b > sims_a)
+    return _sim_result(h_a, h_b, wins_a, wins_b, n_sims)
+
+def _run_sims_adaptive(h_a, h_b, rng, half_ci=TARGET_HALF_CI,
+                       chunk=CHUNK_SIMS, max_sims=MAX_SIMS):
+    wins_a = wins_b = n = 0
+    while n < max_sims:
+        sims_a = _draw(h_a, chunk, rng)
+        sims_b = _draw(h_b, chunk, rng)
+        wins_a += np.sum(sims_a > sims_b)
+        wins_b += np.sum(sims_b > sims_a)
+        n      += chunk
+        lo, hi = _wilson_ci(wins_a, n)
+        if (hi - lo) / 2 <= half_ci:
+            break
+    return _sim_result(h_a, h_b, wins_a, wins_b, n)
+
+def _sim_result(h_a, h_b, wins_a, wins_b, n_sims):
+    from AchIndex import mean_ach
     draws  = n_sims - wins_a - wins_b
+    lo, hi = _wilson_ci(wins_a, n_sims)
     return {
         'win_pct_a': wins_a / n_sims * 100,
         'win_pct_b': wins_b / n_sims * 100,
         'draw_pct':  draws  / n_sims * 100,
-        'mean_a':    ach_a.mean(),
-        'mean_b':    ach_b.mean(),
-        'n_a':       len(ach_a),
-        'n_b':       len(ach_b),
+        'mean_a':    mean_ach(h_a),
+        'mean_b':    mean_ach(h_b),
+        'n_a':       float(h_a.sum()),
+        'n_b':       float(h_b.sum()),
+        'n_sims':    int(n_sims),
+        'ci_lo':     lo,
+        'ci_hi':     hi,
+        'ci_width':  hi - lo,
     }
 
-
-
-# RUN ALL MATCHUPS
-
-all_results = {}
-for gen_a, gen_b in MATCHUPS:
+def _wilson_ci(wins, n, level=CI_LEVEL):
+    # Wilson score interval, in percent; stays sane when wins is 0 or n
+    z      = NormalDist().inv_cdf(0.5 + level / 2)
+    p      = wins / n
+    denom  = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denom
+    half   = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denom
+    return (center - half) * 100, (center + half) * 100
+
+def _battle_bootstrap(h_a, h_b, n_boot, rng):
+    # Resample each general's battles, then score each replicate exactly
+    # over the 0-10 ach histograms (the infinite-draw limit of _run_sims).
+    # Resampling n battles is a multinomial draw of n from the histogram;
+    # n is the (share-weighted) battle count rounded to a whole number.
+    def hists(h):
+        n = max(1, round(h.sum()))
+        return rng.multinomial(n, h / h.sum(), size=n_boot) / n
+    p_a, p_b = hists(h_a), hists(h_b)
+    cdf_lt_b = np.cumsum(p_b, axis=1) - p_b
+    return np.sum(p_a * cdf_lt_b, axis=1) * 100
+
+def _percentile_ci(samples, level=CI_LEVEL):
+    lo, hi = np.percentile(samples, [50 * (1 - level), 50 * (1 + level)])
+    return lo, hi
+
+
+
+def print_matchup(gen_a, gen_b, results, n_boot=0):
     print(f"\n{'='*55}")
     print(f"  {gen_a}  vs  {gen_b}")
     print(f"{'='*55}")
-    results = monte_carlo(gen_a, gen_b)
-    all_results[(gen_a, gen_b)] = results
-
     for context, r in results.items():
         print(f"  [{context}]")
-        print(f"    {gen_a:20s}  win: {r['win_pct_a']:5.1f}%  |  avg ach: {r['mean_a']:.2f}  (n={r['n_a']})")
-        print(f"    {gen_b:20s}  win: {r['win_pct_b']:5.1f}%  |  avg ach: {r['mean_b']:.2f}  (n={r['n_b']})")
+        print(f"    {gen_a:20s}  win: {r['win_pct_a']:5.1f}%  |  avg ach: {r['mean_a']:.2f}  (n={r['n_a']:g})")
+        print(f"    {gen_b:20s}  win: {r['win_pct_b']:5.1f}%  |  avg ach: {r['mean_b']:.2f}  (n={r['n_b']:g})")
         print(f"    Draw:                   {r['draw_pct']:5.1f}%")
-
+        if 'ci_lo' in r:
+            print(f"    {CI_LEVEL:.0%} CI (draws):        [{r['ci_lo']:5.1f}, {r['ci_hi']:5.1f}]"
+                  f"  width {r['ci_width']:.2f}  (sims={r['n_sims']:,})")
+        if 'boot' in r:
+            print(f"    {CI_LEVEL:.0%} CI (battles):      [{r['boot_lo']:5.1f}, {r['boot_hi']:5.1f}]"
+                  f"  width {r['boot_width']:.2f}  (boot={n_boot:,})")
 
 
 #Viz
 
-fig, axes = plt.subplots(len(MATCHUPS), 1, figsize=(14, 4 * len(MATCHUPS)))
-fig.suptitle(f'Head-to-Head Monte Carlo Simulations  (n={N_SIMS:,} each)',
-             fontsize=14, fontweight='bold', y=1.01)
-
 COLOR_A    = "#C0392B"   # red  — left general
 COLOR_B    = "#2980B9"   # blue — right general
 COLOR_DRAW = "#BDC3C7"   # grey — draw
 
-for ax, (gen_a, gen_b) in zip(axes, MATCHUPS):
-    results = all_results[(gen_a, gen_b)]
-    contexts = list(results.keys())
-    y_pos = np.arange(len(contexts))
-
-    wins_a  = [results[c]['win_pct_a'] for c in contexts]
-    draws   = [results[c]['draw_pct']  for c in contexts]
-    wins_b  = [results[c]['win_pct_b'] for c in contexts]
-
-    # Stacked horizontal bars
-    bars_a = ax.barh(y_pos, wins_a, color=COLOR_A, edgecolor='none', alpha=0.85)
-    bars_d = ax.barh(y_pos, draws,  left=wins_a, color=COLOR_DRAW, edgecolor='none', alpha=0.6)
-    bars_b = ax.barh(y_pos, wins_b, left=[a+d for a, d in zip(wins_a, draws)],
-                     color=COLOR_B, edgecolor='none', alpha=0.85)
-
-    # Labels inside bars
-    for i, (wa, dr, wb) in enumerate(zip(wins_a, draws, wins_b)):
-        if wa > 6:
-            ax.text(wa/2, i, f'{wa:.1f}%', ha='center', va='center',
-                    fontsize=8, color='white', fontweight='bold')
-        if wb > 6:
-            ax.text(100 - wb/2, i, f'{wb:.1f}%', ha='center', va='center',
-                    fontsize=8, color='white', fontweight='bold')
-
-    ax.set_yticks(y_pos)
-    ax.set_yticklabels(contexts, fontsize=8.5)
-    ax.set_xlim(0, 100)
-    ax.axvline(50, color='black', linewidth=0.8, linestyle='--', alpha=0.4)
-    ax.set_xlabel('Win Probability %', fontsize=9)
-    ax.set_facecolor('#F7F7F7')
-    ax.spines[['top', 'right']].set_visible(False)
-
-    patch_a    = mpatches.Patch(color=COLOR_A,    label=gen_a)
-    patch_b    = mpatches.Patch(color=COLOR_B,    label=gen_b)
-    patch_draw = mpatches.Patch(color=COLOR_DRAW, label='Draw')
-    ax.legend(handles=[patch_a, patch_draw, patch_b],
-              loc='lower right', fontsize=8, framealpha=0.9)
-    ax.set_title(f'{gen_a}  vs  {gen_b}', fontsize=11, fontweight='bold', pad=6)
-
-fig.tight_layout()
-fig.savefig('./BattleML/data/headtohead_montecarlo.png', dpi=200, bbox_inches='tight')
-plt.close()
-print("\nSaved: headtohead_montecarlo.png")
+def plot_matchups(all_results, matchups=MATCHUPS, path='./BattleML/data/headtohead_montecarlo.png', adaptive=False):
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
+
+    fig, axes = plt.subplots(len(matchups), 1, figsize=(14, 4 * len(matchups)))
+    axes = np.atleast_1d(axes)
+    sims_label = f'adaptive, ±{TARGET_HALF_CI}pp' if adaptive else f'n={N_SIMS:,} each'
+    fig.suptitle(f'Head-to-Head Monte Carlo Simulations  ({sims_label})',
+                 fontsize=14, fontweight='bold', y=1.01)
+
+    for ax, (gen_a, gen_b) in zip(axes, matchups):
+        results = all_results[(gen_a, gen_b)]
+        contexts = list(results.keys())
+        y_pos = np.arange(len(contexts))
+
+        wins_a  = [results[c]['win_pct_a'] for c in contexts]
+        draws   = [results[c]['draw_pct']  for c in contexts]
+        wins_b  = [results[c]['win_pct_b'] for c in contexts]
+
+        # Stacked horizontal bars
+        bars_a = ax.barh(y_pos, wins_a, color=COLOR_A, edgecolor='none', alpha=0.85)
+        bars_d = ax.barh(y_pos, draws,  left=wins_a, color=COLOR_DRAW, edgecolor='none', alpha=0.6)
+        bars_b = ax.barh(y_pos, wins_b, left=[a+d for a, d in zip(wins_a, draws)],
+                         color=COLOR_B, edgecolor='none', alpha=0.85)
+
+        # Labels inside bars
+        for i, (wa, dr, wb) in enumerate(zip(wins_a, draws, wins_b)):
+            if wa > 6:
+                ax.text(wa/2, i, f'{wa:.1f}%', ha='center', va='center',
+                        fontsize=8, color='white', fontweight='bold')
+            if wb > 6:
+                ax.text(100 - wb/2, i, f'{wb:.1f}%', ha='center', va='center',
+                        fontsize=8, color='white', fontweight='bold')
+
+        ax.set_yticks(y_pos)
+        ax.set_yticklabels(contexts, fontsize=8.5)
+        ax.set_xlim(0, 100)
+        ax.axvline(50, color='black', linewidth=0.8, linestyle='--', alpha=0.4)
+        ax.set_xlabel('Win Probability %', fontsize=9)
+        ax.set_facecolor('#F7F7F7')
+        ax.spines[['top', 'right']].set_visible(False)
+
+        patch_a    = mpatches.Patch(color=COLOR_A,    label=gen_a)
+        patch_b    = mpatches.Patch(color=COLOR_B,    label=gen_b)
+        patch_draw = mpatches.Patch(color=COLOR_DRAW, label='Draw')
+        ax.legend(handles=[patch_a, patch_draw, patch_b],
+                  loc='lower right', fontsize=8, framealpha=0.9)
+        ax.set_title(f'{gen_a}  vs  {gen_b}', fontsize=11, fontweight='bold', pad=6)
+
+    fig.tight_layout()
+    with stage('savefig'):
+        fig.savefig(path, dpi=200, bbox_inches='tight')
+    plt.close()
+    print(f"\nSaved: {path.rsplit('/', 1)[-1]}")
+
+
+# RUN ALL MATCHUPS
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Monte Carlo head-to-head for the featured matchups')
+    parser.add_argument('--adaptive', action='store_true', help=f'draw until the {CI_LEVEL:.0%} CI is ±{TARGET_HALF_CI}pp')
+    parser.add_argument('--boot', type=int, default=0, help='outer bootstrap resamples over battles')
+    args = parser.parse_args()
+
+    all_results = {}
+    for gen_a, gen_b in MATCHUPS:
+        results = monte_carlo(gen_a, gen_b, adaptive=args.adaptive, n_boot=args.boot)
+        all_results[(gen_a, gen_b)] = results
+        print_matchup(gen_a, gen_b, results, n_boot=args.boot)
+
+    total_sims = sum(r['n_sims'] for res in all_results.values() for k, r in res.items() if k != 'OVERALL')
+    print(f"\nTotal draws: {total_sims:,}" + ("  (adaptive)" if args.adaptive else ""))
+
+    with stage('plot_matchups'):
+        plot_matchups(all_results, adaptive=args.adaptive)
@@ -0,0 +1,200 @@
+import os
+import sys
+import numpy as np
+from AchIndex import ACH_LEVELS
+from BattlePaths import MERGED_SOURCES, content_hash
+
+# All-pairs head-to-head engine.
+#
+# Every commander's ach scores are binned once per cluster into an
+# (N commanders x C clusters x 11 scores) count tensor, from bel_commands
+# (one row per commander of a joint command, weighted by its share, as in
+# AchIndex).  Because ach only
+# takes the values 0-10, P(A > B) within a cluster is an exact sum over the
+# two histograms, so every pair is scored in a handful of batched einsums.
+# The sampling mode draws the win/draw/loss counts of n_sims paired draws
+# from a multinomial with those same probabilities, which is distributed
+# exactly like comparing rng.choice(ach_a) against rng.choice(ach_b).
+#
+# pandas is only needed to build the histograms, so it is imported there:
+# reading a saved matrix back needs nothing but numpy.  The matrix is saved
+# with the content hash of its sources (bel_commands' inputs) and is fresh
+# while that hash still matches.
+
+OUTCOMES   = ('win', 'draw', 'loss')
+OVERALL    = 'OVERALL'
+MIN_N      = 2          # same per-cluster floor as HeadtoHeadMC.monte_carlo
+
+MATRIX_PATH = './BattleML/data/h2h_matrix.npz'
+
+
+# ── Histograms ────────────────────────────────────────────────────────────────
+def ach_histograms(rows, commanders=None, min_battles=1):
+    """(commanders, clusters, counts) from rows with commander, ach and kmeans; share weights them if present."""
+    import pandas as pd
+
+    rows = rows.assign(share=rows['share'] if 'share' in rows else 1.0)
+    rows = rows[['commander', 'share', 'ach', 'kmeans']].dropna()
+
+    if commanders is None:
+        n_battles   = rows.groupby('commander')['share'].sum()
+        commanders  = sorted(n_battles[n_battles >= min_battles].index)
+    commanders = np.asarray(commanders, dtype=object)
+    rows = rows[rows['commander'].isin(commanders)]
+
+    clusters = np.sort(rows['kmeans'].unique()).astype(int)
+    ci = pd.Index(commanders).get_indexer(rows['commander'])
+    ki = np.searchsorted(clusters, rows['kmeans'].astype(int).values)
+    ai = rows['ach'].astype(int).clip(0, ACH_LEVELS - 1).values
+
+    flat   = (ci * len(clusters) + ki) * ACH_LEVELS + ai
+    counts = np.bincount(flat, weights=rows['share'].to_numpy(dtype=np.float64),
+                         minlength=len(commanders) * len(clusters) * ACH_LEVELS)
+    return commanders, clusters, counts.reshape(len(commanders), len(clusters), ACH_LEVELS)
+
+
+def _normalize(counts):
+    n = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = np.where(n > 0, counts / np.where(n > 0, n, 1), 0.0)
+    return p, n[..., 0]
+
+
+def pairwise_wdl(p_a, p_b):
+    """Exact P(a > b), P(a == b), P(a < b) for every row pair of two (..., 11) pmfs."""
+    cdf_lt = np.cumsum(p_b, axis=-1) - p_b
+    win    = np.einsum('a...k,b...k->ab...', p_a, cdf_lt)
+    draw   = np.einsum('a...k,b...k->ab...', p_a, p_b)
+    loss   = 1.0 - win - draw
+    return np.stack([win, draw, np.clip(loss, 0.0, 1.0)], axis=-1)
+
+
+# ── Matrix ────────────────────────────────────────────────────────────────────
+def matchup_matrix(counts, n_sims=None, seed=42, min_n=MIN_N):
+    """
+    Score every commander against every other.
+
+    Returns a (N, N, C + 1, 3) float32 tensor: axis 2 holds one context per
+    cluster followed by OVERALL, axis 3 holds win/draw/loss probabilities for
+    the row commander.  With n_sims=None the probabilities are exact; otherwise
+    they are the frequencies from n_sims sampled draws per cell.
+    """
+    p, n = _normalize(counts.astype(np.float64))            # (N, C, 11), (N, C)
+    N, C = n.shape
+
+    per_cluster = pairwise_wdl(p, p)                         # (N, N, C, 3)
+    career_p, _ = _normalize(counts.sum(axis=1).astype(np.float64))
+    career      = pairwise_wdl(career_p, career_p)           # (N, N, 3)
+
+    if n_sims is not None:
+        rng   = np.random.default_rng(seed)
+        pvals = np.nan_to_num(per_cluster).reshape(-1, 3)
+        pvals /= np.maximum(pvals.sum(axis=1, keepdims=True), 1e-12)
+        per_cluster = (rng.multinomial(n_sims, pvals) / n_sims).reshape(N, N, C, 3)
+        pvals = career.reshape(-1, 3)
+        career = (rng.multinomial(n_sims, pvals / pvals.sum(axis=1, keepdims=True))
+                  / n_sims).reshape(N, N, 3)
+
+    n_a, n_b = n[:, None, :], n[None, :, :]
+    shared   = (n_a > 0) & (n_b > 0)
+    valid    = (n_a >= min_n) & (n_b >= min_n)
+    weights  = np.where(valid, n_a + n_b, 0.0)               # (N, N, C)
+    total    = weights.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overall = np.einsum('abc,abck->abk', weights, per_cluster) / total[..., None]
+    overall = np.where(~shared.any(axis=-1)[..., None], career, overall)
+    overall[(total == 0) & shared.any(axis=-1)] = np.nan
+
+    per_cluster[~valid] = np.nan
+    wdl = np.concatenate([per_cluster, overall[:, :, None, :]], axis=2)
+    return wdl.astype(np.float32)
+
+
+# ── Persistence & lookup ──────────────────────────────────────────────────────
+def save_matrix(path, commanders, clusters, counts, wdl, sources=MERGED_SOURCES):
+    from BattleStore import save_npz
+    save_npz(path, content_hash(*sources), compressed=True, commanders=commanders.astype(str),
+             clusters=clusters, counts=counts, wdl=wdl)
+
+
+def is_fresh(path=MATRIX_PATH, sources=MERGED_SOURCES):
+    """True when the saved matrix exists and was built from the sources' current content."""
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as z:
+        return 'key' in z.files and str(z['key']) == content_hash(*sources)
+
+
+def load_matrix(path=MATRIX_PATH):
+    with np.load(path) as z:
+        m = {k: z[k] for k in z.files if k != 'key'}
+    m['index'] = {c: i for i, c in enumerate(m['commanders'])}
+    return m
+
+
+def lookup(m, gen_a, gen_b, context=OVERALL):
+    """One matchup in the same shape HeadtoHeadMC._run_sims reports."""
+    a, b = m['index'][gen_a], m['index'][gen_b]
+    if context == OVERALL:
+        k = len(m['clusters'])
+        n_a, n_b = m['counts'][a].sum(), m['counts'][b].sum()
+        hist_a, hist_b = m['counts'][a].sum(axis=0), m['counts'][b].sum(axis=0)
+    else:
+        k = int(np.searchsorted(m['clusters'], context))
+        hist_a, hist_b = m['counts'][a, k], m['counts'][b, k]
+        n_a, n_b = hist_a.sum(), hist_b.sum()
+    win, draw, loss = m['wdl'][a, b, k] * 100
+    scores = np.arange(ACH_LEVELS)
+    return {
+        'win_pct_a': float(win),
+        'win_pct_b': float(loss),
+        'draw_pct':  float(draw),
+        'mean_a':    float(hist_a @ scores / n_a) if n_a else np.nan,
+        'mean_b':    float(hist_b @ scores / n_b) if n_b else np.nan,
+        'n_a':       float(n_a),
+        'n_b':       float(n_b),
+    }
+
+
+def leaderboard(m, context=OVERALL):
+    """Mean win probability of each commander against the rest of the field."""
+    import pandas as pd
+
+    k = len(m['clusters']) if context == OVERALL else int(np.searchsorted(m['clusters'], context))
+    win = m['wdl'][:, :, k, 0].astype(np.float64)
+    np.fill_diagonal(win, np.nan)
+    return (pd.DataFrame({'general':      m['commanders'],
+                          'mean_win_pct': np.nanmean(win, axis=1) * 100,
+                          'opponents':    np.isfinite(win).sum(axis=1)})
+            .sort_values('mean_win_pct', ascending=False)
+            .reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    import time
+
+    n_sims      = int(sys.argv[sys.argv.index('--sample') + 1]) if '--sample' in sys.argv else None
+    min_battles = int(sys.argv[sys.argv.index('--min-battles') + 1]) if '--min-battles' in sys.argv else 1
+
+    from BattleStore import load_bel_commands
+
+    bel_commands = load_bel_commands()
+
+    t0 = time.perf_counter()
+    commanders, clusters, counts = ach_histograms(bel_commands, min_battles=min_battles)
+    wdl = matchup_matrix(counts, n_sims=n_sims)
+    elapsed = time.perf_counter() - t0
+
+    save_matrix(MATRIX_PATH, commanders, clusters, counts, wdl)
+    mode = 'exact' if n_sims is None else f'sampled, n={n_sims:,}'
+    print(f"{len(commanders)} commanders x {len(clusters)} clusters ({mode}): {elapsed:.2f}s")
+    print(f"Saved: {MATRIX_PATH}  {wdl.shape}")
+
+    m = load_matrix(MATRIX_PATH)
+    for gen_a, gen_b in [("NAPOLEON I", "WELLINGTON"), ("NAPOLEON I", "LEE"),
+                         ("NAPOLEON I", "JACKSON"),    ("GRANT", "LEE")]:
+        if gen_a in m['index'] and gen_b in m['index']:
+            r = lookup(m, gen_a, gen_b)
+            print(f"  {gen_a:12s} vs {gen_b:12s}  win {r['win_pct_a']:5.1f}%  "
+                  f"draw {r['draw_pct']:5.1f}%  loss {r['win_pct_b']:5.1f}%")
@@ -0,0 +1,229 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from BattlePaths import DATA_PATH
+
+try:
+    import resource
+except ImportError:                         # Windows
+    resource = None
+
+# Per-stage instrumentation, off unless BATTLEML_TRACE is set.
+#
+#   with stage('umap', rows=len(Z)) as sp:          # or @traced on a function
+#       ...
+#       sp.count(len(out))                           # rows out, if known late
+#
+# Each stage records wall time, CPU time (process-wide, so it exceeds wall
+# when BLAS or numba threads are busy), the process's peak RSS and the rows it
+# handled.  BATTLEML_TRACE_MEMORY=1 adds each stage's tracemalloc peak above
+# what was allocated when it started; it is separate because tracing
+# allocations slows pandas noticeably.
+#
+# At exit the stages are written to TRACE_DIR (or the directory BATTLEML_TRACE
+# names) as a Chrome trace (<script>-<time>.trace.json, for chrome://tracing
+# or Perfetto) and as folded stacks (<script>-<time>.folded, for flamegraph.pl
+# or speedscope), and summarized on stderr.
+#
+# Disabled, stage() hands back one shared no-op object and @traced returns
+# the function unchanged.
+
+TRACE     = os.environ.get('BATTLEML_TRACE', '')
+ENABLED   = TRACE not in ('', '0')
+MEMORY    = ENABLED and os.environ.get('BATTLEML_TRACE_MEMORY') == '1'
+TRACE_DIR = TRACE if ENABLED and TRACE != '1' else f'{DATA_PATH}/traces'
+
+_spans = []            # finished stages in this process
+_open  = []            # stages currently running, outermost first
+_PID   = os.getpid()   # the process that writes the trace
+
+
+# ── Stages ────────────────────────────────────────────────────────────────────
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, rows):
+        pass
+
+
+_NULL = _NullStage()
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10      # bytes on macOS, KiB on Linux
+
+
+class _Stage:
+    __slots__ = ('name', 'rows', 'rows_out', 'args', 'ts', 't0', 'c0', 'child_us', 'base', 'peak')
+
+    def __init__(self, name, rows, args):
+        self.name, self.rows, self.rows_out, self.args = name, rows, None, args
+        self.child_us, self.base, self.peak = 0.0, 0, 0
+
+    def count(self, rows):
+        self.rows_out = rows
+
+    def __enter__(self):
+        if MEMORY:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if _open:                   # hand the parent its peak so far before resetting
+                _open[-1].peak = max(_open[-1].peak, peak)
+            self.base = current
+            tracemalloc.reset_peak()
+        _open.append(self)
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.c0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        dur_us = (time.perf_counter() - self.t0) * 1e6
+        cpu_us = (time.process_time() - self.c0) * 1e6
+        _open.pop()
+        if MEMORY:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if _open:
+            _open[-1].child_us += dur_us
+            _open[-1].peak = max(_open[-1].peak, self.peak)
+            if MEMORY:
+                tracemalloc.reset_peak()
+
+        _spans.append({
+            'name':     self.name,
+            'stack':    [s.name for s in _open] + [self.name],
+            'ts':       self.ts * 1e6,
+            'dur':      dur_us,
+            'self':     max(dur_us - self.child_us, 0.0),
+            'cpu':      cpu_us,
+            'rows':     self.rows,
+            'rows_out': self.rows_out,
+            'peak_mb':  (self.peak - self.base) / 2**20 if MEMORY else None,
+            'rss_mb':   _rss_mb(),
+            'pid':      os.getpid(),
+            'args':     self.args,
+            'error':    exc[0].__name__ if exc[0] else None,
+        })
+        return False
+
+
+def stage(name, rows=None, **args):
+    """Context manager timing one stage; a shared no-op when tracing is off."""
+    return _Stage(name, rows, args) if ENABLED else _NULL
+
+
+def _nrows(obj):
+    if isinstance(obj, tuple):
+        obj = obj[0] if obj else None
+    shape = getattr(obj, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+def traced(fn=None, *, name=None):
+    """Decorator form of stage(); rows in and out are read off the first argument and the result."""
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with _Stage(name or fn.__name__, _nrows(args[0]) if args else None, {}) as sp:
+                out = fn(*args, **kwargs)
+                sp.count(_nrows(out))
+            return out
+        return inner
+    return wrap(fn) if fn is not None else wrap
+
+
+# ── Worker processes ──────────────────────────────────────────────────────────
+def reset():
+    """Pool initializer: drop the stages a forked worker inherited from its parent."""
+    del _spans[:], _open[:]
+
+
+def collect():
+    """Take this process's finished stages (for shipping back from a pool worker)."""
+    out = _spans[:]
+    del _spans[:]
+    return out
+
+
+def extend(spans):
+    """Add stages from a worker, nested under whatever stage is open here."""
+    prefix = [s.name for s in _open]
+    for sp in spans:
+        _spans.append({**sp, 'stack': prefix + sp['stack']})
+
+
+# ── Output ────────────────────────────────────────────────────────────────────
+def chrome_trace(spans, process='python'):
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f'{process} [{pid}]'}}
+              for pid in sorted({sp['pid'] for sp in spans})]
+    for sp in spans:
+        args = {k: sp[k] for k in ('rows', 'rows_out', 'cpu', 'peak_mb', 'rss_mb', 'error') if sp[k] is not None}
+        events.append({'name': sp['name'], 'ph': 'X', 'ts': sp['ts'], 'dur': sp['dur'],
+                       'pid': sp['pid'], 'tid': sp['pid'], 'args': {**args, **sp['args']}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def folded(spans, root):
+    """Brendan Gregg's folded-stack format, self wall time in microseconds."""
+    totals = {}
+    for sp in spans:
+        key = ';'.join([root] + sp['stack'])
+        totals[key] = totals.get(key, 0.0) + sp['self']
+    return ''.join(f'{k} {int(round(v))}\n' for k, v in totals.items() if v >= 1)
+
+
+def _fmt(v, spec):
+    return format(v, spec) if v is not None else '-'
+
+
+def summary(spans, out=sys.stderr):
+    print(f"\n{'stage':36s} {'wall s':>8} {'cpu s':>8} {'rows':>9} {'rows out':>9} "
+          f"{'peak MB':>8} {'rss MB':>8}", file=out)
+    for sp in sorted(spans, key=lambda s: s['ts']):
+        label = '  ' * (len(sp['stack']) - 1) + sp['name']
+        print(f"{label[:36]:36s} {sp['dur'] / 1e6:8.3f} {sp['cpu'] / 1e6:8.3f} "
+              f"{_fmt(sp['rows'], ','):>9} {_fmt(sp['rows_out'], ','):>9} "
+              f"{_fmt(sp['peak_mb'], '.1f'):>8} {_fmt(sp['rss_mb'], '.0f'):>8}", file=out)
+
+
+def write(spans=None, out_dir=None):
+    """Write the Chrome trace and folded stacks; returns the path prefix."""
+    spans   = _spans if spans is None else spans
+    out_dir = out_dir or TRACE_DIR
+    script  = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0] or 'python'
+    prefix  = os.path.join(out_dir, f"{script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    os.makedirs(out_dir, exist_ok=True)
+    with open(f'{prefix}.trace.json', 'w') as f:
+        json.dump(chrome_trace(spans, script), f)
+    with open(f'{prefix}.folded', 'w') as f:
+        f.write(folded(spans, script))
+    return prefix
+
+
+def _flush():
+    # Pool workers ship their stages back with collect(); only the parent writes
+    if not _spans or os.getpid() != _PID:
+        return
+    summary(_spans)
+    print(f"Trace: {write()}.trace.json / .folded", file=sys.stderr)
+
+
+if ENABLED:
+    atexit.register(_flush)
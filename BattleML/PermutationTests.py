@@ -0,0 +1,302 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from AchIndex import ACH_LEVELS, WIN_ACH, MIN_BATTLES
+from BattlePaths import DATA_PATH, CACHE_PATH
+
+# Permutation tests: is a commander's record in a cluster better than the
+# peers who fought battles of the same kind?
+#
+# Within each KMeans cluster the commander labels are shuffled over the
+# battles (the ach scores stay put), and three statistics are recomputed for
+# every commander x cluster cell, commander against everyone else in it:
+#
+#   win_diff    win rate (ach >= WIN_ACH) minus the peers' win rate
+#   mean_diff   mean ach minus the peers' mean ach
+#   cdf_l1      sum over ach levels of |F_commander - F_peers|, the
+#               Wasserstein-1 distance between the two ach distributions
+#
+# plus one stratified cell per commander pooling all of their clusters, so the
+# overall comparison is made against the same cluster mix.  win_diff and
+# mean_diff are two-sided; p = (1 + permutations at least as extreme) /
+# (1 + permutations), and each statistic is corrected for multiple
+# comparisons over all reported cells with Benjamini-Hochberg (q_ columns).
+#
+# The rows are bel_commands: one per commander of a battle, weighted by
+# their share of it, so a joint command splits its battle between its
+# commanders as in AchIndex and battle counts can be fractional.  Each label
+# moves with its share, which is the same as shuffling the ach scores over
+# the (label, share) rows.  A chunk of permutations is one (permutations,
+# rows) ach array per cluster, shuffled row-wise with Generator.permuted; a
+# single share-weighted bincount over permutation x label x ach gives every
+# cell's histogram, and the statistics follow from the histograms (peers'
+# included, since shares differ between rows).  Commanders with fewer than
+# MIN_BATTLES battles share one pooled label, so the histograms stay small.
+# Jobs of BATCH permutations run on a process pool, each with its own
+# SeedSequence child, and send back only exceedance counts; the job split
+# does not depend on the worker count, so a seed gives the same p-values on
+# any machine.  Results are cached on the source data and the run settings.
+
+PERMUTATION_CSV  = f'{DATA_PATH}/permutation_tests.csv'
+PERMUTATION_PATH = f'{CACHE_PATH}/permutation_tests.npz'
+
+STATISTICS   = ('win_diff', 'mean_diff', 'cdf_l1')
+TWO_SIDED    = (True, True, False)
+PERMUTATIONS = 100_000
+BATCH        = 10_000         # permutations per worker job
+MIN_CELL     = 2              # battles in a cluster for its cell to be reported
+MAX_BYTES    = 128 * 2**20    # per-chunk working-set budget
+TOL          = 1e-9
+
+_DATA = None
+
+_CUMSUM    = np.triu(np.ones((ACH_LEVELS, ACH_LEVELS)))        # h @ _CUMSUM = cumsum(h)
+_BELOW_TOP = np.r_[np.ones(ACH_LEVELS - 1), 0.0]
+_ONES      = np.ones(ACH_LEVELS)
+
+
+def _init(data):
+    global _DATA
+    _DATA = data
+
+
+# ── Data ──────────────────────────────────────────────────────────────────────
+def prepare(bel_commands, min_battles=MIN_BATTLES):
+    """Per-cluster label, share and ach arrays and the observed statistics."""
+    rows = bel_commands.dropna(subset=['commander', 'ach', 'kmeans'])   # unlabelled rows sit out
+    names, ci   = np.unique(rows['commander'].to_numpy(dtype=str), return_inverse=True)
+    clusters, k = np.unique(rows['kmeans'].to_numpy(dtype=np.float64).astype(int), return_inverse=True)
+    share = rows['share'].to_numpy(dtype=np.float64)
+    ach   = rows['ach'].to_numpy(dtype=np.float64).astype(np.int32).clip(0, ACH_LEVELS - 1)
+
+    tested = np.flatnonzero(np.bincount(ci, weights=share, minlength=len(names)) >= min_battles)
+    T      = len(tested)
+    label  = np.full(len(names), T, dtype=np.int32)               # T = pooled label
+    label[tested] = np.arange(T)
+    label  = label[ci]
+
+    cells = np.zeros((len(clusters), T + 1, ACH_LEVELS))
+    np.add.at(cells, (k, label, ach), share)
+    order = np.argsort(k, kind='stable')
+    split = np.cumsum(np.bincount(k, minlength=len(clusters)))[:-1]
+
+    hists = _with_overall(cells[None, :, :T])[0]                   # (clusters + 1, T, ach)
+    total = _with_overall(cells.sum(axis=1)[None, :, None])[0]
+    return {
+        'commanders': names[tested],
+        'clusters':   clusters,
+        'labels':     np.split(label[order], split),
+        'shares':     np.split(share[order], split),
+        'ach':        np.split(ach[order], split),
+        'hists':      hists,
+        'total':      total,
+        'observed':   statistics(hists, total),
+    }
+
+
+def _with_overall(h):
+    # (..., clusters, ...) -> (..., clusters + 1, ...) with the stratified sum last
+    return np.concatenate([h, h.sum(axis=1, keepdims=True)], axis=1)
+
+
+# ── Statistics ────────────────────────────────────────────────────────────────
+def statistics(h, total, win_ach=WIN_ACH):
+    """(..., 3) win_diff, mean_diff, cdf_l1 of histograms h against total - h.
+
+    All three are read off the CDF difference D = F_commander - F_peers:
+    win_diff = -D[win_ach - 1], mean_diff = -sum(D[:-1]), cdf_l1 = sum |D|.
+    The cumulative sums and row sums are small matmuls, which beat numpy's
+    reductions along an axis of 11.
+    """
+    n = h.sum(axis=-1, keepdims=True)
+    m = total.sum(axis=-1, keepdims=True) - n
+    D = h.astype(np.float64) @ _CUMSUM
+    with np.errstate(invalid='ignore', divide='ignore'):
+        D *= 1 / n + 1 / m
+        D -= (total @ _CUMSUM) / m
+    out = np.empty(D.shape[:-1] + (3,))
+    out[..., 0] = -D[..., win_ach - 1]
+    out[..., 1] = -(D @ _BELOW_TOP)
+    out[..., 2] = np.abs(D, out=D) @ _ONES
+    return out
+
+
+def _extreme(stats):
+    return np.where(TWO_SIDED, np.abs(stats), stats)
+
+
+def bh_fdr(p):
+    """Benjamini-Hochberg adjusted p-values (q-values); NaN stays NaN."""
+    p   = np.asarray(p, dtype=np.float64)
+    q   = np.full(p.shape, np.nan)
+    ok  = np.flatnonzero(~np.isnan(p))
+    if not len(ok):
+        return q
+    order = ok[np.argsort(p[ok], kind='stable')]
+    adj   = p[order] * len(ok) / np.arange(1, len(ok) + 1)
+    q[order] = np.minimum(np.minimum.accumulate(adj[::-1])[::-1], 1.0)
+    return q
+
+
+# ── Permutations ──────────────────────────────────────────────────────────────
+def _chunk_size(data, max_bytes=MAX_BYTES):
+    # ach copy, flat bincount index and share weight per row, histograms and float stats per cell
+    n_rows  = sum(len(l) for l in data['labels'])
+    n_cells = data['hists'].shape[0] * (data['hists'].shape[1] + 1) * ACH_LEVELS
+    return max(1, int(max_bytes // (n_rows * 20 + n_cells * 8 * 6)))
+
+
+def run_batch(seq, n_perm, max_bytes=MAX_BYTES):
+    """Exceedance counts (clusters + 1, commanders, 3) over n_perm permutations."""
+    t0     = time.perf_counter()
+    rng    = np.random.default_rng(seq)
+    data   = _DATA
+    K, T   = len(data['labels']), len(data['commanders'])
+    G      = T + 1
+    target = _extreme(data['observed']) - TOL
+    exceed = np.zeros(target.shape, dtype=np.int64)
+    chunk  = _chunk_size(data, max_bytes)
+
+    for lo in range(0, n_perm, chunk):
+        b     = min(chunk, n_perm - lo)
+        hists = np.empty((b, K, G, ACH_LEVELS))
+        for k, (labels, shares, ach) in enumerate(zip(data['labels'], data['shares'], data['ach'])):
+            perm = rng.permuted(np.broadcast_to(ach, (b, len(ach))), axis=1)
+            flat = (labels + (np.arange(b, dtype=np.int32) * G)[:, None]) * ACH_LEVELS + perm
+            hists[:, k] = np.bincount(flat.ravel(), weights=np.tile(shares, b),
+                                      minlength=b * G * ACH_LEVELS).reshape(b, G, ACH_LEVELS)
+        hists   = _with_overall(hists)
+        stats   = statistics(hists[:, :, :T], hists.sum(axis=2, keepdims=True))
+        exceed += (_extreme(stats) >= target).sum(axis=0)
+    return {'exceed': exceed, 'permutations': n_perm, 'seconds': time.perf_counter() - t0, 'worker': os.getpid()}
+
+
+def run(data, permutations=PERMUTATIONS, workers=None, seed=42, batch=BATCH):
+    """Summed exceedance counts over all permutations."""
+    seqs    = np.random.SeedSequence(seed).spawn(-(-permutations // batch))
+    sizes   = [min(batch, permutations - i * batch) for i in range(len(seqs))]
+    workers = workers or os.cpu_count()
+    n_rows  = sum(len(l) for l in data['labels'])
+    print(f"{permutations:,} permutations of {n_rows:,} commander rows in {len(data['labels'])} clusters, "
+          f"{len(data['commanders'])} commanders, on {workers} workers ({batch:,} per job)")
+
+    t0, done = time.perf_counter(), 0
+    exceed   = np.zeros(data['observed'].shape, dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(data,)) as pool:
+        futures = [pool.submit(run_batch, seq, n) for seq, n in zip(seqs, sizes)]
+        for fut in as_completed(futures):
+            r = fut.result()
+            exceed += r['exceed']
+            done   += r['permutations']
+            print(f"  [pid {r['worker']}] {done:9,d}/{permutations:,} permutations  {r['seconds']:6.2f}s")
+    print(f"Wall time: {time.perf_counter() - t0:.1f}s")
+    return exceed
+
+
+# ── Results ───────────────────────────────────────────────────────────────────
+def table(data, exceed, permutations, min_cell=MIN_CELL, win_ach=WIN_ACH):
+    """One row per reported commander x cluster cell (kmeans NA = all clusters, stratified)."""
+    from BattlePaths import cluster_names
+
+    hists, total = data['hists'], data['total']
+    n     = hists.sum(axis=-1)
+    peers = total.sum(axis=-1) - n
+    keep  = (n >= min_cell) & (peers > 0)
+    keep[-1] = n[-1] > 0
+    k, c  = np.nonzero(keep)
+
+    def rates(h):
+        s = h.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return h[..., win_ach:].sum(axis=-1) / s, h @ np.arange(ACH_LEVELS) / s
+
+    wr, mean     = rates(hists[k, c])
+    p_wr, p_mean = rates(total[k, 0] - hists[k, c])
+    kmeans       = pd.array([int(data['clusters'][i]) if i < len(data['clusters']) else None for i in k],
+                            dtype='Int64')
+
+    df = pd.DataFrame({
+        'commander':     data['commanders'][c],
+        'kmeans':        kmeans,
+        'cluster':       ['all (stratified)' if x is pd.NA else cluster_names.get(int(x), '') for x in kmeans],
+        'n':             n[k, c],
+        'peers':         peers[k, c],
+        'win_rate':      wr,
+        'peer_win_rate': p_wr,
+        'mean_ach':      mean,
+        'peer_mean_ach': p_mean,
+    })
+    p = (1 + exceed[k, c]) / (1 + permutations)
+    for j, name in enumerate(STATISTICS):
+        df[name] = data['observed'][k, c, j]
+    for j, name in enumerate(STATISTICS):
+        df[f'p_{name}'] = p[:, j]
+    for j, name in enumerate(STATISTICS):
+        df[f'q_{name}'] = bh_fdr(p[:, j])
+    return df
+
+
+def _key(permutations, seed, min_battles, batch):
+    from BattleStore import merged_key
+    return merged_key(permutations, seed, min_battles, batch)
+
+
+def load_tests(rebuild=False, permutations=PERMUTATIONS, seed=42, min_battles=MIN_BATTLES,
+               min_cell=MIN_CELL, workers=None, batch=BATCH):
+    """The test table, rerunning the permutations only when the data or settings changed."""
+    from BattleStore import save_npz, load_npz, load_bel_commands
+
+    data  = prepare(load_bel_commands(), min_battles)
+    key   = _key(permutations, seed, min_battles, batch)
+    saved = None if rebuild else load_npz(PERMUTATION_PATH, key)
+    if saved is not None:
+        return table(data, saved['exceed'], permutations, min_cell)
+
+    from Instrument import stage
+    with stage('permutation tests') as sp:
+        exceed = run(data, permutations, workers, seed, batch)
+        sp.count(permutations)
+    save_npz(PERMUTATION_PATH, key, exceed=exceed)
+    return table(data, exceed, permutations, min_cell)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Within-cluster permutation tests, commander vs peers')
+    parser.add_argument('commanders', nargs='*', default=['NAPOLEON I'], help='commanders to print')
+    parser.add_argument('--permutations', type=int, default=PERMUTATIONS)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--batch', type=int, default=BATCH, help='permutations per worker job')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--min-battles', type=int, default=MIN_BATTLES)
+    parser.add_argument('--alpha', type=float, default=0.05, help='FDR level for the summary')
+    parser.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    df = load_tests(args.rebuild, args.permutations, args.seed, args.min_battles,
+                    workers=args.workers, batch=args.batch)
+    print(f"{len(df)} cells in {time.perf_counter() - t0:.1f}s")
+    df.round(4).to_csv(PERMUTATION_CSV, index=False)
+    print(f"Saved: {PERMUTATION_CSV}")
+
+    for name in args.commanders:
+        rows = df[df['commander'] == name]
+        if rows.empty:
+            print(f"\n{name}: not tested (fewer than {args.min_battles} battles)")
+            continue
+        print(f"\n── {name} vs peers in the same cluster ──")
+        print(f"  {'cluster':32s} {'n':>5s} {'win':>5s} {'peers':>5s} {'q':>6s}   "
+              f"{'mean':>4s} {'peers':>5s} {'q':>6s}   {'W1':>5s} {'q':>6s}")
+        for r in rows.itertuples():
+            print(f"  {r.cluster:32s} {r.n:5.1f} {r.win_rate:5.0%} {r.peer_win_rate:5.0%} {r.q_win_diff:6.3f}   "
+                  f"{r.mean_ach:4.1f} {r.peer_mean_ach:5.1f} {r.q_mean_diff:6.3f}   {r.cdf_l1:5.2f} {r.q_cdf_l1:6.3f}")
+
+    sig = df[(df[[f'q_{s}' for s in STATISTICS]] < args.alpha).any(axis=1)]
+    print(f"\n── Cells significant at FDR {args.alpha:g} on any statistic: {len(sig)} of {len(df)} ──")
+    for r in sig.sort_values('q_mean_diff').itertuples():
+        print(f"  {r.commander:24s} {r.cluster:32s} n={r.n:5.1f}  win {r.win_diff:+.0%}  "
+              f"mean {r.mean_diff:+.2f}  W1 {r.cdf_l1:.2f}  "
+              f"(q {r.q_win_diff:.3f} / {r.q_mean_diff:.3f} / {r.q_cdf_l1:.3f})")
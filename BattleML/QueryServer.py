@@ -0,0 +1,458 @@
+import argparse
+import collections
+import http.client
+import json
+import math
+import threading
+import time
+import traceback
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+from AchIndex import MIN_BATTLES
+
+# Local query service for the dashboard backend.
+#
+# Loads everything once (the AchIndex counts, the exact head-to-head matrix
+# built from them, the fitted Beta prior and the SimilarBattles KD-tree) and
+# answers GET requests with JSON:
+#
+#   /h2h?a=NAPOLEON I&b=WELLINGTON[&cluster=2]
+#   /leaderboard[?cluster=2&by=h2h|bayes&min_battles=5&limit=20]
+#   /commander?name=LEE
+#   /cluster?id=2[&min_battles=3&limit=20]
+#   /similar?battle=AUSTERLITZ[&k=10&cluster=&era=&commander=]
+#   /metrics                      latency p50/p99 per endpoint, cache stats
+#
+# Responses are cached as encoded bytes in an LRU keyed on the normalized
+# parameters (commander names upper-cased and de-aliased, numbers parsed,
+# defaults filled in), evicted by total size rather than entry count.
+#
+#   python BattleML/QueryServer.py --port 8765
+#   python BattleML/QueryServer.py --bench 2000        # in-process latency check
+
+HOST        = '127.0.0.1'
+PORT        = 8765
+CACHE_MB    = 64
+LATENCY_KEEP = 10_000      # most recent requests kept per endpoint for percentiles
+CI_LEVEL    = 0.95
+
+
+# ── Response cache ────────────────────────────────────────────────────────────
+class LRUCache:
+    """Byte-bounded LRU of encoded responses; safe to share between handler threads."""
+
+    def __init__(self, max_bytes=CACHE_MB * 2**20):
+        self.max_bytes = max_bytes
+        self.bytes     = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._items    = collections.OrderedDict()
+        self._lock     = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        size = len(body) + len(repr(key))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.bytes -= len(self._items.pop(key)) + len(repr(key))
+            self._items[key] = body
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old = self._items.popitem(last=False)
+                self.bytes -= len(old) + len(repr(old_key))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._items), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / total if total else None}
+
+
+class Latency:
+    def __init__(self, keep=LATENCY_KEEP):
+        self._ms   = collections.defaultdict(lambda: collections.deque(maxlen=keep))
+        self._n    = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, ms):
+        with self._lock:
+            self._ms[endpoint].append(ms)
+            self._n[endpoint] += 1
+
+    def report(self):
+        with self._lock:
+            snap = {k: (np.array(v), self._n[k]) for k, v in self._ms.items()}
+        return {k: {'requests': n,
+                    'p50_ms':   float(np.percentile(ms, 50)),
+                    'p99_ms':   float(np.percentile(ms, 99)),
+                    'max_ms':   float(ms.max())} for k, (ms, n) in snap.items()}
+
+
+# ── Hot data ──────────────────────────────────────────────────────────────────
+class QueryError(Exception):
+    status = 400
+
+
+class NotFound(QueryError):
+    status = 404
+
+
+def _json_safe(obj):
+    if isinstance(obj, dict):
+        return {str(k): _json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [_json_safe(v) for v in obj]
+    if isinstance(obj, (np.integer,)):
+        return int(obj)
+    if isinstance(obj, (float, np.floating)):
+        return None if math.isnan(obj) else float(obj)
+    return obj
+
+
+class Data:
+    """Everything the endpoints read, loaded once at startup."""
+
+    def __init__(self, similar=True):
+        import AchIndex
+        import HeadtoHeadMatrix
+        from BayesRank import cached_prior
+        from Instrument import stage
+
+        with stage('load ach_index'):
+            self.ix = AchIndex.load_index()
+        with stage('matchup_matrix'):
+            # Same tensor HeadtoHeadMatrix.py saves, from the index instead of the rows
+            keep   = self.ix['clusters'] >= 0
+            counts = self.ix['counts'][:, keep].sum(axis=(3, 4))
+            self.m = {'commanders': self.ix['commanders'], 'clusters': self.ix['clusters'][keep],
+                      'counts': counts, 'wdl': HeadtoHeadMatrix.matchup_matrix(counts),
+                      'index': self.ix['index']}
+        with stage('fitted_prior'):
+            # Fitted to the index counts that bayes() and the leaderboard shrink
+            self.prior = cached_prior(*AchIndex.records(self.ix)[1:])
+        self.similar = None
+        if similar:
+            import SimilarBattles
+            with stage('load similar_index'):
+                self.similar = SimilarBattles.load_index()
+                if SimilarBattles.is_stale(self.similar):
+                    self.similar = SimilarBattles.load_index(rebuild=True)
+
+        from BattlePaths import cluster_names
+        self.cluster_names = cluster_names
+        self.n_battles     = counts.sum(axis=(1, 2))
+
+    # ── Normalization ──
+    def commander(self, name):
+        if not name:
+            raise QueryError("missing commander name")
+        from Commanders import canonical
+        return canonical(name)
+
+    def _known(self, name):
+        if name not in self.ix['index']:
+            raise NotFound(f"Unknown commander: {name}")
+        return name
+
+    def _cluster(self, c):
+        if c is not None and c not in self.ix['cluster_index']:
+            raise NotFound(f"Unknown cluster: {c}")
+        return c
+
+    def _cluster_name(self, c):
+        return self.cluster_names.get(int(c), f'Cluster {c}')
+
+    def bayes(self, wins, n):
+        from scipy import special
+        a, b = self.prior[0] + wins, self.prior[1] + n - wins
+        lo, hi = special.betaincinv(a, b, [(1 - CI_LEVEL) / 2, (1 + CI_LEVEL) / 2])
+        return {'mean': a / (a + b), 'ci_lo': lo, 'ci_hi': hi}
+
+    def _record(self, h):
+        from AchIndex import win_rate, mean_ach, WIN_ACH
+        wr, n = win_rate(h)
+        return {'n': n, 'wins': float(h[WIN_ACH:].sum()), 'win_rate': wr, 'mean_ach': mean_ach(h)}
+
+    # ── Endpoints ──
+    def h2h(self, a, b, cluster=None):
+        from HeadtoHeadMatrix import lookup, OVERALL
+        a, b = self._known(a), self._known(b)
+        context = OVERALL if cluster is None else self._cluster(cluster)
+        r = lookup(self.m, a, b, context=context)
+        return {'a': a, 'b': b, 'context': 'OVERALL' if cluster is None else self._cluster_name(cluster), **r}
+
+    def leaderboard(self, cluster=None, by='h2h', min_battles=MIN_BATTLES, limit=20):
+        from AchIndex import WIN_ACH
+        if by not in ('h2h', 'bayes'):
+            raise QueryError("by must be 'h2h' or 'bayes'")
+        keep = np.flatnonzero(self.n_battles >= min_battles)
+        k    = len(self.m['clusters']) if cluster is None else \
+               int(np.searchsorted(self.m['clusters'], self._cluster(cluster)))
+        if by == 'h2h':
+            # Mean win probability against the other qualifying commanders
+            win = self.m['wdl'][np.ix_(keep, keep)][:, :, k, 0].astype(np.float64)
+            np.fill_diagonal(win, np.nan)
+            with np.errstate(invalid='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                score = np.nanmean(win, axis=1) * 100
+            n = np.isfinite(win).sum(axis=1)
+        else:
+            # Posterior mean win rate under the fitted prior
+            h = self.m['counts'][keep].sum(axis=1) if cluster is None else self.m['counts'][keep, k]
+            n, wins = h.sum(axis=1), h[:, WIN_ACH:].sum(axis=1)
+            score = (self.prior[0] + wins) / (self.prior[0] + self.prior[1] + n) * 100
+        order = np.argsort(np.where(np.isnan(score), np.inf, -score), kind='stable')[:limit]
+        return {'context': 'OVERALL' if cluster is None else self._cluster_name(cluster), 'by': by,
+                'rows': [{'general':  self.m['commanders'][keep[i]],
+                          'score':    score[i],
+                          'battles':  float(self.n_battles[keep[i]]),
+                          'opponents' if by == 'h2h' else 'in_context': n[i]} for i in order]}
+
+    def commander_profile(self, name):
+        from AchIndex import hist, by_cluster
+        name = self._known(name)
+        h    = hist(self.ix, name)
+        rec  = self._record(h)
+        per_cluster = by_cluster(self.ix, name)
+        return {
+            'general':   name,
+            **rec,
+            'bayes':     self.bayes(rec['wins'], rec['n']),
+            'ach_hist':  h,
+            'attacking': self._record(hist(self.ix, name, role='attacker')),
+            'defending': self._record(hist(self.ix, name, role='defender')),
+            'underdog':  self._record(hist(self.ix, name, underdog=1)),
+            'favored':   self._record(hist(self.ix, name, underdog=0)),
+            'clusters':  [{'cluster': int(c), 'name': self._cluster_name(c), **self._record(hc)}
+                          for c, hc in zip(self.ix['clusters'], per_cluster) if hc.sum()],
+        }
+
+    def cluster(self, id, min_battles=3, limit=20):
+        from AchIndex import by_cluster
+        self._cluster(id)
+        k = self.ix['cluster_index'][id]
+        h = self.ix['counts'][:, k].sum(axis=(2, 3))             # (commanders, 11)
+        rows = [{'general': self.ix['commanders'][i], **self._record(h[i])}
+                for i in np.flatnonzero(h.sum(axis=1) >= min_battles)]
+        rows.sort(key=lambda r: (-r['win_rate'], -r['n']))
+        return {'cluster': id, 'name': self._cluster_name(id),
+                'rows': round(h.sum()), 'commanders': int((h.sum(axis=1) > 0).sum()),
+                'ach_hist': by_cluster(self.ix)[k], 'top': rows[:limit]}
+
+    def similar_battles(self, battle, k=10, cluster=None, era=None, commander=None):
+        from SimilarBattles import similar
+        if self.similar is None:
+            raise NotFound("similar-battle index not loaded (started with --no-similar)")
+        try:
+            return {'battle': battle, 'similar': similar(battle, k, cluster, era, commander, index=self.similar)}
+        except KeyError as e:
+            raise NotFound(str(e.args[0]) if e.args else f"Unknown battle: {battle}")
+
+
+# ── Request parsing ───────────────────────────────────────────────────────────
+def _int(v):
+    try:
+        return int(v)
+    except ValueError:
+        raise QueryError(f"not an integer: {v!r}")
+
+
+# smallest accepted value of the integer parameters that are counts
+MINIMUM = {'k': 1, 'limit': 0, 'min_battles': 0}
+
+# endpoint -> (Data method, {param: (parser, default)}); None marks a required parameter
+ENDPOINTS = {
+    '/h2h':         ('h2h',               {'a': ('name', None), 'b': ('name', None),
+                                           'cluster': (_int, '')}),
+    '/leaderboard': ('leaderboard',       {'cluster': (_int, ''), 'by': (str, 'h2h'),
+                                           'min_battles': (_int, MIN_BATTLES), 'limit': (_int, 20)}),
+    '/commander':   ('commander_profile', {'name': ('name', None)}),
+    '/cluster':     ('cluster',           {'id': (_int, None), 'min_battles': (_int, 3),
+                                           'limit': (_int, 20)}),
+    '/similar':     ('similar_battles',   {'battle': (str, None), 'k': (_int, 10), 'cluster': (_int, ''),
+                                           'era': (_int, ''), 'commander': ('name', '')}),
+}
+
+
+def normalize(data, path, query):
+    """(endpoint, method, kwargs) with every parameter parsed and defaulted, or QueryError."""
+    if path not in ENDPOINTS:
+        raise NotFound(f"Unknown endpoint: {path}")
+    method, spec = ENDPOINTS[path]
+    given = dict(parse_qsl(query, keep_blank_values=True))
+    extra = set(given) - set(spec)
+    if extra:
+        raise QueryError(f"Unknown parameter(s): {', '.join(sorted(extra))}")
+    kwargs = {}
+    for key, (parse, default) in spec.items():
+        raw = given.get(key, '').strip()
+        if not raw:
+            if default is None:
+                raise QueryError(f"Missing parameter: {key}")
+            kwargs[key] = None if default == '' else default
+            continue
+        kwargs[key] = data.commander(raw) if parse == 'name' else parse(raw)
+        if key in MINIMUM and kwargs[key] < MINIMUM[key]:
+            raise QueryError(f"{key} must be at least {MINIMUM[key]}, got {kwargs[key]}")
+    if path == '/h2h' and kwargs['a'] == kwargs['b']:
+        raise QueryError(f"a and b are the same commander: {kwargs['a']}")
+    if path == '/similar' and kwargs['battle'].isdigit():
+        kwargs['battle'] = int(kwargs['battle'])
+    elif path == '/similar':
+        kwargs['battle'] = kwargs['battle'].upper()
+    return path, method, kwargs
+
+
+# ── Server ────────────────────────────────────────────────────────────────────
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'          # keep-alive, so clients skip the TCP handshake
+    server_version   = 'BattleML'
+    # Headers and body go out as separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK and every response takes ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        t0  = time.perf_counter()
+        srv = self.server
+        url = urlsplit(self.path)
+        endpoint = url.path.rstrip('/') or '/'
+
+        if endpoint == '/metrics':
+            self._send(200, json.dumps({'latency': srv.latency.report(), 'cache': srv.cache.stats(),
+                                        'uptime_s': time.time() - srv.started}).encode())
+            return
+        try:
+            endpoint, method, kwargs = normalize(srv.data, endpoint, url.query)
+            key  = (endpoint, tuple(sorted(kwargs.items())))
+            body = srv.cache.get(key)
+            if body is None:
+                result = getattr(srv.data, method)(**kwargs)
+                body   = json.dumps(_json_safe(result)).encode()
+                srv.cache.put(key, body)
+            status = 200
+        except QueryError as e:
+            status, body = e.status, json.dumps({'error': str(e)}).encode()
+        except Exception as e:
+            # A bug, not a bad request: answer anyway so the client is not left hanging
+            traceback.print_exc()
+            status, body = 500, json.dumps({'error': f"internal error: {type(e).__name__}: {e}"}).encode()
+        self._send(status, body)
+        srv.latency.record(endpoint if status != 404 or endpoint in ENDPOINTS else 'unknown',
+                           (time.perf_counter() - t0) * 1000)
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+def make_server(data, host=HOST, port=PORT, cache_mb=CACHE_MB, verbose=False):
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    srv.data, srv.verbose, srv.started = data, verbose, time.time()
+    srv.cache   = LRUCache(int(cache_mb * 2**20))
+    srv.latency = Latency()
+    return srv
+
+
+# ── Latency check ─────────────────────────────────────────────────────────────
+def _bench_queries(data, n, seed=42):
+    """A mixed workload: mostly repeats of popular queries, some long-tail ones."""
+    rng  = np.random.default_rng(seed)
+    top  = data.m['commanders'][np.argsort(-data.n_battles)[:40]]
+    clus = [int(c) for c in data.m['clusters']]
+    battles = data.similar['name'][:200] if data.similar is not None else []
+    out = []
+    for _ in range(n):
+        kind = rng.choice(['h2h', 'leaderboard', 'commander', 'cluster', 'similar'],
+                          p=[0.4, 0.1, 0.25, 0.1, 0.15] if len(battles) else [0.45, 0.15, 0.28, 0.12, 0.0])
+        g = lambda: str(rng.choice(top[:10] if rng.random() < 0.8 else top))
+        if kind == 'h2h':
+            q = f"/h2h?a={g()}&b={g()}" + (f"&cluster={rng.choice(clus)}" if rng.random() < 0.5 else '')
+        elif kind == 'leaderboard':
+            q = f"/leaderboard?by={rng.choice(['h2h', 'bayes'])}&min_battles={rng.choice([1, 5, 10])}"
+        elif kind == 'commander':
+            q = f"/commander?name={g()}"
+        elif kind == 'cluster':
+            q = f"/cluster?id={rng.choice(clus)}"
+        else:
+            q = f"/similar?battle={rng.choice(battles)}&k=10"
+        out.append(q.replace(' ', '%20'))
+    return out
+
+
+def bench(data, n, cache_mb=CACHE_MB):
+    srv = make_server(data, port=0, cache_mb=cache_mb)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection(*srv.server_address)
+    client = []
+    for q in _bench_queries(data, n):
+        t0 = time.perf_counter()
+        conn.request('GET', q)
+        resp = conn.getresponse()
+        resp.read()
+        client.append((time.perf_counter() - t0) * 1000)
+    conn.request('GET', '/metrics')
+    metrics = json.loads(conn.getresponse().read())
+    srv.shutdown()
+    return np.array(client), metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local JSON query server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cache-mb', type=float, default=CACHE_MB, help='response cache size')
+    parser.add_argument('--no-similar', action='store_true', help='skip the similar-battle index (no sklearn)')
+    parser.add_argument('--bench', type=int, metavar='N', help='serve N mixed queries in-process and report latency')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    t0   = time.perf_counter()
+    data = Data(similar=not args.no_similar)
+    indexed = '' if data.similar is None else f", {len(data.similar['isqno'])} battles indexed"
+    print(f"Loaded {len(data.m['commanders'])} commanders, {len(data.m['clusters'])} clusters{indexed} "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+    if args.bench:
+        client, metrics = bench(data, args.bench, args.cache_mb)
+        print(f"\n{'endpoint':14s} {'requests':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}   (server side)")
+        for name, r in sorted(metrics['latency'].items()):
+            print(f"{name:14s} {r['requests']:>9,} {r['p50_ms']:8.3f} {r['p99_ms']:8.3f} {r['max_ms']:8.2f}")
+        c = metrics['cache']
+        print(f"\nClient round trip: p50 {np.percentile(client, 50):.3f} ms, p99 {np.percentile(client, 99):.3f} ms "
+              f"over {len(client):,} requests")
+        print(f"Cache: {c['entries']} entries, {c['bytes'] / 2**10:.0f} KB, hit rate {c['hit_rate']:.0%}, "
+              f"{c['evictions']} evictions")
+    else:
+        srv = make_server(data, args.host, args.port, args.cache_mb, args.verbose)
+        print(f"Serving on http://{args.host}:{srv.server_address[1]}  (GET /metrics for latency)")
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            srv.server_close()
@@ -0,0 +1,291 @@
+import argparse
+import itertools
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from AchIndex import ACH_LEVELS, WIN_ACH, MIN_BATTLES
+from BattlePaths import CACHE_PATH
+
+# Counterfactual scenarios: "what if Napoleon were outnumbered?"
+#
+# A commander's record split by underdog status rests on a handful of
+# battles, so the scenarios are answered by a model instead: a multinomial
+# logit of the commander's ach (0-10) on
+#
+#   log own force ratio   the commander's side over the enemy's, clipped to 1/8 .. 8
+#   posture               attacker or defender
+#   terrain               terra1 (rugged / gentle / flat)
+#   cluster               kmeans
+#   commander             one effect per commander with MIN_BATTLES or more, the
+#                         rest pooled; the L2 penalty shrinks small records
+#
+# fitted on every commander of every belligerent (bel_commands), each row
+# weighted by the commander's share, so the commanders of a joint command
+# split its battle as in AchIndex.  ach_diff is not an input: it is computed
+# from the very scores being predicted.  Clusters are partly defined by
+# outcomes too (ach_diff and casualties feed the clustering), so a cluster
+# move reads as "in a battle of that kind", not as a pre-battle intervention.
+#
+# A scenario overrides some of a commander's battle context and keeps the
+# rest: {'force_ratio': 0.7} replays every battle of theirs at 0.7:1,
+# {'ratio_scale': 0.5} halves their side in each, {'terrain': 'R'},
+# {'cluster': 6}, {'role': 'defender'}.  The outcome is the ach distribution
+# averaged over their battles, weighted by share.
+#
+# The logits are additive in those parts, so a batch is a broadcast sum of
+# (rows, scenarios, 11) gathers followed by one softmax, then a per-commander
+# mean (np.add.reduceat over rows sorted by commander).  Scenarios are cut
+# into chunks of about CHUNK_MB and run on a thread pool (numpy releases the
+# GIL), so the whole roster against a few thousand scenarios (millions of
+# battle replays) takes seconds.
+
+C           = 1.0            # inverse L2 strength for LogisticRegression
+RATIO_CLIP  = 8.0
+CHUNK_MB    = 64
+ROLES       = ('defender', 'attacker')
+
+SCENARIO_PATH = f'{CACHE_PATH}/scenario_model.npz'
+
+_MODEL = None
+
+
+# ── Model ─────────────────────────────────────────────────────────────────────
+def battle_rows():
+    """One row per commander of a belligerent with an ach score, in the commander's own frame."""
+    from BattleStore import load_bel_commands, load_clustered
+
+    bel  = load_bel_commands()[['isqno', 'attacker', 'commander', 'share', 'ach']].dropna()
+    ctx  = load_clustered()[['isqno', 'att_str', 'def_str', 'terra1', 'kmeans']]
+    rows = bel.merge(ctx, on='isqno').dropna(subset=['att_str', 'def_str', 'kmeans'])
+
+    att   = rows['attacker'].to_numpy(dtype=int)
+    a, d  = rows['att_str'].to_numpy(dtype=float), rows['def_str'].to_numpy(dtype=float)
+    ratio = np.where(att == 1, a / d, d / a)
+    return {
+        'commander':   rows['commander'].to_numpy(dtype=str),
+        'share':       rows['share'].to_numpy(dtype=float),
+        'log_ratio':   np.log(ratio.clip(1 / RATIO_CLIP, RATIO_CLIP)),
+        'attacker':    att,
+        'terrain':     rows['terra1'].astype(str).to_numpy(dtype=str),
+        'cluster':     rows['kmeans'].to_numpy(dtype=int),
+        'ach':         rows['ach'].to_numpy(dtype=int).clip(0, ACH_LEVELS - 1),
+    }
+
+
+def _codes(values, labels):
+    lookup = {v: i for i, v in enumerate(labels.tolist())}
+    return np.array([lookup[v] for v in values.tolist()], dtype=np.int32)
+
+
+def fit(rows, min_battles=MIN_BATTLES, c=C):
+    from sklearn.linear_model import LogisticRegression
+
+    names, inv = np.unique(rows['commander'], return_inverse=True)
+    battles    = np.bincount(inv, weights=rows['share'])
+    commanders = np.concatenate([['(other)'], names[battles >= min_battles]])
+    terrains   = np.unique(rows['terrain'])
+    clusters   = np.unique(rows['cluster'])
+    cmd = np.array([{n: i for i, n in enumerate(commanders)}.get(n, 0) for n in rows['commander'].tolist()])
+
+    parts = [rows['log_ratio'][:, None], rows['attacker'][:, None],
+             np.eye(len(terrains))[_codes(rows['terrain'], terrains)],
+             np.eye(len(clusters))[_codes(rows['cluster'], clusters)],
+             np.eye(len(commanders))[cmd]]
+    X  = np.hstack(parts)
+    lr = LogisticRegression(C=c, max_iter=5000).fit(X, rows['ach'], sample_weight=rows['share'])
+
+    # Coefficients per part, spread over all 11 ach levels (unseen levels never win the softmax)
+    W = np.zeros((X.shape[1], ACH_LEVELS))
+    b = np.full(ACH_LEVELS, -np.inf)
+    W[:, lr.classes_] = lr.coef_.T
+    b[lr.classes_]    = lr.intercept_
+    edges = np.cumsum([0] + [p.shape[1] for p in parts])
+    p     = lr.predict_proba(X)
+    return {
+        'b':          b,
+        'w_ratio':    W[edges[0]],
+        'w_att':      W[edges[1]],
+        'w_terrain':  W[edges[2]:edges[3]],
+        'w_cluster':  W[edges[3]:edges[4]],
+        'w_cmd':      W[edges[4]:edges[5]],
+        'commanders': commanders,
+        'terrains':   terrains,
+        'clusters':   clusters,
+        'log_loss':   float(np.average(-np.log(p[np.arange(len(p)), np.searchsorted(lr.classes_, rows['ach'])]),
+                                         weights=rows['share'])),
+    }
+
+
+def _key():
+    from BattleStore import merged_key
+    return merged_key(MIN_BATTLES, C)
+
+
+def load_model(rebuild=False):
+    """(model, rows), fitted once and cached until belligerents, aliases or clusters change."""
+    global _MODEL
+    if _MODEL is not None and not rebuild:
+        return _MODEL
+    from BattleStore import save_npz, load_npz
+    key   = _key()
+    saved = None if rebuild else load_npz(SCENARIO_PATH, key)
+    if saved is not None:
+        model = {k[2:]: v for k, v in saved.items() if k.startswith('m_')}
+        model['log_loss'] = float(model['log_loss'])
+        _MODEL = model, {k[2:]: v for k, v in saved.items() if k.startswith('r_')}
+        return _MODEL
+
+    from Instrument import stage
+    with stage('fit scenario model') as sp:
+        rows  = battle_rows()
+        model = fit(rows)
+        sp.count(len(rows['ach']))
+    save_npz(SCENARIO_PATH, key, **{f'm_{k}': v for k, v in model.items()}, **{f'r_{k}': v for k, v in rows.items()})
+    _MODEL = model, rows
+    return _MODEL
+
+
+# ── Scenarios ─────────────────────────────────────────────────────────────────
+def grid(force_ratio=(None,), ratio_scale=(None,), terrain=(None,), cluster=(None,), role=(None,)):
+    """Every combination of the given values; None keeps the battle's own value."""
+    keys = ('force_ratio', 'ratio_scale', 'terrain', 'cluster', 'role')
+    return [{k: v for k, v in zip(keys, combo) if v is not None}
+            for combo in itertools.product(force_ratio, ratio_scale, terrain, cluster, role)]
+
+
+def encode(model, scenarios):
+    """Scenario dicts -> per-part override arrays (NaN / -1 keep the battle's value)."""
+    codes = {'terrain': {t: i for i, t in enumerate(model['terrains'].tolist())},
+             'cluster': {int(c): i for i, c in enumerate(model['clusters'])},
+             'role':    {r: i for i, r in enumerate(ROLES)}}
+
+    def code(s, key):
+        if key not in s:
+            return -1
+        value = s[key]
+        if key == 'cluster' and isinstance(value, str) and value.lstrip('-').isdigit():
+            value = int(value)
+        try:
+            return codes[key][value]
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown {key}: {s[key]!r} (valid: {', '.join(map(str, codes[key]))})") from None
+
+    for s in scenarios:
+        unknown = set(s) - {'force_ratio', 'ratio_scale', 'terrain', 'cluster', 'role'}
+        if unknown:
+            raise ValueError(f"Unknown scenario keys: {', '.join(sorted(unknown))}")
+    return {
+        'set_ratio': np.array([np.log(np.clip(s['force_ratio'], 1 / RATIO_CLIP, RATIO_CLIP))
+                               if 'force_ratio' in s else np.nan for s in scenarios]),
+        'scale':     np.array([np.log(s.get('ratio_scale', 1.0)) for s in scenarios]),
+        'terrain':   np.array([code(s, 'terrain') for s in scenarios]),
+        'cluster':   np.array([code(s, 'cluster') for s in scenarios]),
+        'attacker':  np.array([code(s, 'role') for s in scenarios]),
+    }
+
+
+def _chunk(model, rows, base, starts, sc):
+    # (commanders, scenarios in chunk, 11) mean ach pmf
+    lr = np.where(np.isnan(sc['set_ratio']), rows['log_ratio'][:, None] + sc['scale'], sc['set_ratio'])
+    lr = np.clip(lr, -np.log(RATIO_CLIP), np.log(RATIO_CLIP))
+    t  = np.where(sc['terrain'] >= 0, sc['terrain'], rows['terrain_code'][:, None])
+    k  = np.where(sc['cluster'] >= 0, sc['cluster'], rows['cluster_code'][:, None])
+    a  = np.where(sc['attacker'] >= 0, sc['attacker'], rows['attacker'][:, None])
+
+    z  = base[:, None, :] + lr[..., None] * model['w_ratio'] + a[..., None] * model['w_att']
+    z += model['w_terrain'][t]
+    z += model['w_cluster'][k]
+    z -= z.max(axis=2, keepdims=True)
+    np.exp(z, out=z)
+    z /= z.sum(axis=2, keepdims=True)
+    z *= rows['share'][:, None, None]
+    return np.add.reduceat(z, starts, axis=0)
+
+
+def simulate(scenarios, commanders=None, workers=None, chunk_mb=CHUNK_MB, model=None):
+    """{'commanders', 'battles', 'pmf': (commanders, scenarios, 11)} for every commander x scenario."""
+    model, rows = model or load_model()
+    keep  = np.isin(rows['commander'], commanders) if commanders is not None else np.ones(len(rows['ach']), bool)
+    order = np.flatnonzero(keep)[np.argsort(rows['commander'][keep], kind='stable')]
+    sub   = {k: v[order] for k, v in rows.items()}
+    sub['terrain_code'] = _codes(sub['terrain'], model['terrains'])
+    sub['cluster_code'] = _codes(sub['cluster'], model['clusters'])
+    names, starts = np.unique(sub['commander'], return_index=True)
+    n = np.add.reduceat(sub['share'], starts) if len(starts) else np.zeros(0)
+
+    cmd  = {c: i for i, c in enumerate(model['commanders'].tolist())}
+    base = model['b'] + model['w_cmd'][[cmd.get(c, 0) for c in sub['commander'].tolist()]]
+
+    sc    = encode(model, scenarios)
+    step  = max(1, int(chunk_mb * 2**20 / (8 * ACH_LEVELS * max(len(order), 1))))
+    parts = [{k: v[i:i + step] for k, v in sc.items()} for i in range(0, len(scenarios), step)]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        sums = list(pool.map(lambda part: _chunk(model, sub, base, starts, part), parts))
+    pmf = np.concatenate(sums, axis=1) / n[:, None, None]
+    return {'commanders': names, 'battles': n, 'scenarios': scenarios, 'pmf': pmf}
+
+
+def expected_ach(pmf):
+    return pmf @ np.arange(ACH_LEVELS)
+
+
+def win_prob(pmf, win_ach=WIN_ACH):
+    return pmf[..., win_ach:].sum(axis=-1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Counterfactual scenario outcomes per commander')
+    parser.add_argument('commanders', nargs='*', default=['NAPOLEON I', 'WELLINGTON', 'LEE', 'GRANT'])
+    parser.add_argument('--grid', action='store_true', help='time the full roster x scenario grid')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    model, rows = load_model(rebuild=args.rebuild)
+    marginal = np.bincount(rows['ach'], weights=rows['share'], minlength=ACH_LEVELS) / rows['share'].sum()
+    print(f"Model on {len(rows['ach']):,} commander rows, {len(model['commanders']) - 1} commander effects "
+          f"({(time.perf_counter() - t0) * 1000:.0f} ms); log loss {model['log_loss']:.3f} "
+          f"vs {np.average(-np.log(marginal[rows['ach']]), weights=rows['share']):.3f} for the marginal")
+
+    from Commanders import canonical
+    from BattlePaths import cluster_names
+    named = [canonical(c) for c in args.commanders]
+    scenarios = ([{}]
+                 + [{'force_ratio': r} for r in (0.5, 0.7, 1.0, 1.5, 2.0)]
+                 + [{'role': r} for r in ROLES]
+                 + [{'terrain': t} for t in model['terrains'].tolist()]
+                 + [{'cluster': int(k)} for k in model['clusters']])
+    labels = (['as fought']
+              + [f'at {r:g}:1' for r in (0.5, 0.7, 1.0, 1.5, 2.0)]
+              + [f'always {r}' for r in ROLES]
+              + [f'terrain {t}' for t in model['terrains'].tolist()]
+              + [cluster_names.get(int(k), f'cluster {k}') for k in model['clusters']])
+    res = simulate(scenarios, named, args.workers, model=(model, rows))
+    print(f"\n{'scenario':32s}" + ''.join(f"{c[:14]:>16s}" for c in res['commanders']))
+    print(f"{'battles':32s}" + ''.join(f"{n:>16.1f}" for n in res['battles']))
+    for j, label in enumerate(labels):
+        cells = ''.join(f"{win_prob(res['pmf'][i, j]):>8.1%} {expected_ach(res['pmf'][i, j]):>5.2f}  "
+                        for i in range(len(res['commanders'])))
+        print(f"{label[:32]:32s}{cells}")
+    print(f"(P(ach >= {WIN_ACH})  mean ach)")
+
+    if args.grid:
+        sc = grid(force_ratio=(None,) + tuple(np.round(np.geomspace(0.25, 4, 17), 3)),
+                  terrain=(None,) + tuple(model['terrains'].tolist()),
+                  cluster=(None,) + tuple(int(k) for k in model['clusters']),
+                  role=(None,) + ROLES)
+        t0  = time.perf_counter()
+        res = simulate(sc, workers=args.workers, model=(model, rows))
+        dt  = time.perf_counter() - t0
+        print(f"\nGrid: {len(res['commanders']):,} commanders x {len(sc):,} scenarios over "
+              f"{round(res['battles'].sum()):,} battles = {len(rows['ach']) * len(sc) / 1e6:.1f}M "
+              f"battle replays in {dt:.2f}s")
+        dog = np.flatnonzero([s.get('force_ratio') == 0.5 and len(s) == 1 for s in sc])
+        if len(dog):
+            wp = win_prob(res['pmf'][:, dog[0]])
+            best = np.argsort(-np.where(res['battles'] >= MIN_BATTLES, wp, -1))[:5]
+            print(f"Best outnumbered 1:2 (P(ach >= {WIN_ACH}), commanders with "
+                  f"{MIN_BATTLES}+ battles): "
+                  + ', '.join(f"{res['commanders'][i]} {wp[i]:.1%}" for i in best))
@@ -0,0 +1,163 @@
+import argparse
+import os
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+from Commanders import canonical
+from BattleStore import content_hash, load_wars, load_commands, WARS_CSV, BELLIGERENTS_CSV, CLUSTER_MODEL, ALIAS_CSV
+
+# Nearest-neighbour "similar battles" index.
+#
+# Battles are embedded with the saved BattleCluster pipeline (median impute,
+# standardize, PCA) and indexed with a KD-tree, which stays logarithmic per
+# query on the scaled corpora.  Filters narrow the candidates: when the
+# filtered set is small it is searched directly, otherwise the tree is asked
+# for progressively more neighbours until k survive the filter.
+
+INDEX_PATH = './BattleML/data/models/similar_index.joblib'
+LEAF_SIZE  = 30
+BRUTE_MAX  = 2_000        # filtered sets up to this size skip the tree
+
+_INDEX = None
+
+
+# ── Build ────────────────────────────────────────────────────────────────────
+def _era(war4):
+    year = war4.astype(str).str.extract(r'(\d{4})', expand=False).astype(float)
+    return (year // 100 * 100).fillna(-1).astype(int)
+
+
+def build_index():
+    from BattleCluster import load_pipeline, fit_pipeline, save_pipeline, project
+
+    wars = load_wars()
+    if os.path.exists(CLUSTER_MODEL):
+        model = load_pipeline()
+    else:
+        model = fit_pipeline(wars)
+        save_pipeline(model)
+
+    Z     = project(model, wars).astype(np.float32)
+    isqno = wars['isqno'].to_numpy(dtype=np.int64)
+    names = wars['name'].astype(str).to_numpy()
+    row   = pd.Series(np.arange(len(isqno)), index=isqno)
+
+    # Every commander of a joint command, not just the first listed
+    cmd = load_commands()
+    cmd = cmd[cmd['isqno'].isin(isqno)]
+    by_commander = {co: np.unique(row[g['isqno']].values) for co, g in cmd.groupby('commander')}
+
+    # Plain arrays and dicts: queries stay clear of pandas overhead
+    return {
+        'key':          content_hash(WARS_CSV, BELLIGERENTS_CSV, ALIAS_CSV, CLUSTER_MODEL),
+        'tree':         KDTree(Z, leaf_size=LEAF_SIZE),
+        'Z':            Z,
+        'isqno':        isqno,
+        'name':         names,
+        'kmeans':       model['kmeans'].predict(Z.astype(np.float64)),
+        'era':          _era(wars['war4']).to_numpy(),
+        'row':          dict(zip(isqno.tolist(), range(len(isqno)))),
+        'by_name':      {n.upper(): i for i, n in reversed(list(enumerate(names)))},
+        'by_commander': by_commander,
+    }
+
+
+def load_index(rebuild=False):
+    global _INDEX
+    if _INDEX is not None and not rebuild:
+        return _INDEX
+    if not rebuild and os.path.exists(INDEX_PATH):
+        _INDEX = joblib.load(INDEX_PATH)
+        return _INDEX
+    _INDEX = build_index()
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    joblib.dump(_INDEX, INDEX_PATH)
+    return _INDEX
+
+
+def is_stale(index):
+    return index['key'] != content_hash(WARS_CSV, BELLIGERENTS_CSV, ALIAS_CSV, CLUSTER_MODEL)
+
+
+# ── Query ────────────────────────────────────────────────────────────────────
+def _resolve(index, battle):
+    if isinstance(battle, str) and not battle.isdigit():
+        if battle.upper() not in index['by_name']:
+            raise KeyError(f"Unknown battle: {battle}")
+        return index['by_name'][battle.upper()]
+    return index['row'][int(battle)]
+
+
+def _mask(index, cluster, era, commander):
+    mask = np.ones(len(index['isqno']), dtype=bool)
+    if cluster is not None:
+        mask &= index['kmeans'] == cluster
+    if era is not None:
+        mask &= index['era'] == era
+    if commander is not None:
+        rows = np.zeros(len(mask), dtype=bool)
+        rows[index['by_commander'].get(canonical(commander), [])] = True
+        mask &= rows
+    return mask
+
+
+def similar(isqno, k=10, cluster=None, era=None, commander=None, index=None):
+    """k nearest battles to isqno (or a battle name), optionally filtered; list of dicts."""
+    index = index or load_index()
+    i     = _resolve(index, isqno)
+    q     = index['Z'][i:i + 1]
+
+    if cluster is None and era is None and commander is None:
+        dist, rows = index['tree'].query(q, k=min(k + 1, len(index['Z'])))
+        dist, rows = dist[0], rows[0]
+    else:
+        mask = _mask(index, cluster, era, commander)
+        mask[i] = False
+        cand = np.flatnonzero(mask)
+        if len(cand) <= BRUTE_MAX:
+            d     = np.sqrt(((index['Z'][cand] - q) ** 2).sum(axis=1))
+            order = np.argsort(d)[:k]
+            dist, rows = d[order], cand[order]
+        else:
+            fetch = 4 * (k + 1)
+            while True:
+                dist, rows = index['tree'].query(q, k=min(fetch, len(index['Z'])))
+                keep = mask[rows[0]]
+                if keep.sum() >= k or fetch >= len(index['Z']):
+                    break
+                fetch *= 4
+            dist, rows = dist[0][keep], rows[0][keep]
+
+    keep = rows != i
+    rows, dist = rows[keep][:k], dist[keep][:k]
+    return [{'isqno':    int(index['isqno'][r]),
+             'name':     index['name'][r],
+             'kmeans':   int(index['kmeans'][r]),
+             'era':      int(index['era'][r]),
+             'distance': float(d)} for r, d in zip(rows, dist)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Battles most similar to a given battle')
+    parser.add_argument('battle', help='isqno or battle name, e.g. AUSTERLITZ')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--cluster', type=int)
+    parser.add_argument('--era', type=int, help='century, e.g. 1800')
+    parser.add_argument('--commander')
+    parser.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args()
+
+    index = load_index(rebuild=args.rebuild)
+    if not args.rebuild and is_stale(index):
+        index = load_index(rebuild=True)
+
+    res = similar(args.battle, args.k, args.cluster, args.era, args.commander, index=index)
+    print(pd.DataFrame(res).to_string(index=False))
+
+    n = 1000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        similar(args.battle, args.k, args.cluster, args.era, args.commander, index=index)
+    print(f"\nQuery latency: {(time.perf_counter() - t0) / n * 1e6:.0f} µs  ({len(index['Z'])} battles)")
@@ -0,0 +1,250 @@
+import argparse
+import os
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import IncrementalPCA
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler
+from BattleCluster import features, assign
+from BattleStore import DATA_PATH, WARS_CSV
+from Instrument import stage
+from Sketches import QuantileSketch
+
+# Streaming version of BattleCluster.fit_pipeline for corpora too large to
+# cluster in memory (the synthetic 1M-battle sets).  wars.csv is read in
+# chunks, several times:
+#
+#   1. per-feature median sketches          -> imputer
+#   2. StandardScaler.partial_fit           -> scaler
+#   3. IncrementalPCA.partial_fit           -> pca (exact, see below)
+#   4. a uniform random sample of the PCA rows (SAMPLE_ROWS)
+#   5. MiniBatchKMeans.partial_fit over EPOCHS passes, started from k-means++
+#      centres on the sample
+#   6. UMAP and HDBSCAN fitted on the sample only
+#   7. every battle assigned with BattleCluster.assign, written in chunks
+#
+# The result is the same model dict fit_pipeline returns ('train' holds the
+# sampled battles), so BattleCluster.assign/cluster use it unchanged.
+#
+# --max-mb caps the chunk and the sample by a rough per-row cost (on top of
+# the interpreter and libraries, ~450 MB with umap/numba loaded); --compare
+# fits both modes on the real data and reports how closely the labels agree.
+
+STREAM_CSV   = f'{DATA_PATH}/battles_clustered_stream.csv'
+STREAM_MODEL = f'{DATA_PATH}/models/cluster_pipeline_stream.joblib'
+
+CHUNK_ROWS  = 50_000
+SAMPLE_ROWS = 20_000          # UMAP and HDBSCAN fit size
+EPOCHS      = 3
+MAX_MB      = 1024
+
+# Rough working-set cost per row, in bytes: a chunk holds the parsed frame
+# plus imputed, scaled and projected copies; UMAP's neighbour graph and
+# HDBSCAN's prediction data dominate for the sample.
+CHUNK_ROW_BYTES  = 1_024
+SAMPLE_ROW_BYTES = 8_192
+
+
+def budget(max_mb, chunk_rows=CHUNK_ROWS, sample_rows=SAMPLE_ROWS):
+    """(chunk_rows, sample_rows) that keep each half of the work under max_mb / 2."""
+    half = max_mb * 2**20 / 2
+    return (max(100, min(chunk_rows, int(half / CHUNK_ROW_BYTES))),
+            max(100, min(sample_rows, int(half / SAMPLE_ROW_BYTES))))
+
+
+def _truncate(pca, k):
+    """Keep the top k components of a fitted (Incremental)PCA."""
+    for attr in ['components_', 'explained_variance_', 'explained_variance_ratio_', 'singular_values_']:
+        setattr(pca, attr, getattr(pca, attr)[:k])
+    pca.n_components = pca.n_components_ = k
+    return pca
+
+
+def _chunks(path, chunk_rows):
+    yield from pd.read_csv(path, usecols=['isqno'] + features, chunksize=chunk_rows)
+
+
+# ── Fit ──────────────────────────────────────────────────────────────────────
+def fit_streaming(path=WARS_CSV, chunk_rows=CHUNK_ROWS, sample_rows=SAMPLE_ROWS,
+                  epochs=EPOCHS, n_components=10, n_clusters=8, seed=42):
+    import umap
+    import hdbscan
+
+    with stage('medians'):
+        sketches = {f: QuantileSketch() for f in features}
+        for chunk in _chunks(path, chunk_rows):
+            for f in features:
+                sketches[f].update(chunk[f].to_numpy(float))
+        # A one-row fit sets statistics_ to exactly these medians; it is a
+        # frame, as in BattleCluster.standardize, since chunks are frames too
+        imputer = SimpleImputer(strategy='median').fit(
+            pd.DataFrame([[sketches[f].median() for f in features]], columns=features))
+
+    def imputed(chunk):
+        return imputer.transform(chunk[features].astype(float))
+
+    with stage('scaler'):
+        scaler = StandardScaler()
+        for chunk in _chunks(path, chunk_rows):
+            scaler.partial_fit(imputed(chunk))
+
+    with stage('incremental_pca'):
+        # Full rank (one component per feature) so nothing is truncated
+        # between batches and the result equals PCA up to sign; a short last
+        # chunk is folded into the one before it
+        pca, pending = IncrementalPCA(n_components=len(features)), None
+        for chunk in _chunks(path, chunk_rows):
+            X = scaler.transform(imputed(chunk))
+            if pending is not None and len(X) < len(features):
+                pending = np.vstack([pending, X])
+                continue
+            if pending is not None:
+                pca.partial_fit(pending)
+            pending = X
+        pca.partial_fit(pending)
+        pca = _truncate(pca, n_components)
+
+    def projected(chunk):
+        return pca.transform(scaler.transform(imputed(chunk)))
+
+    # Uniform sample: every row draws a random key and the smallest keys stay
+    rng = np.random.default_rng(seed)
+    sample_key, sample_z, sample_id = np.empty(0), np.empty((0, n_components)), np.empty(0, dtype=np.int64)
+    with stage('sample', rows=sample_rows):
+        for chunk in _chunks(path, chunk_rows):
+            sample_key = np.concatenate([sample_key, rng.random(len(chunk))])
+            sample_z   = np.vstack([sample_z, projected(chunk)])
+            sample_id  = np.concatenate([sample_id, chunk['isqno'].to_numpy()])
+            if len(sample_key) > sample_rows:
+                keep = np.argpartition(sample_key, sample_rows)[:sample_rows]
+                sample_key, sample_z, sample_id = sample_key[keep], sample_z[keep], sample_id[keep]
+        order = np.argsort(sample_id)
+        sample_z, sample_id = sample_z[order], sample_id[order]
+
+    # Seeded from k-means++ on the sample rather than from whichever chunk
+    # comes first, then refined over every row
+    with stage('minibatch_kmeans', epochs=epochs):
+        init = KMeans(n_clusters=n_clusters, random_state=seed).fit(sample_z).cluster_centers_
+        km   = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=seed)
+        for _ in range(epochs):
+            for chunk in _chunks(path, chunk_rows):
+                km.partial_fit(projected(chunk))
+
+    with stage('umap', rows=len(sample_z)):
+        reducer = umap.UMAP(n_neighbors=15, min_dist=0.1, random_state=42).fit(sample_z)
+    with stage('hdbscan', rows=len(sample_z)):
+        hdb = hdbscan.HDBSCAN(min_cluster_size=5, prediction_data=True).fit(sample_z)
+
+    return {
+        'features': features,
+        'imputer':  imputer,
+        'scaler':   scaler,
+        'pca':      pca,
+        'umap':     reducer,
+        'kmeans':   km,
+        'hdbscan':  hdb,
+        'train': pd.DataFrame({
+            'isqno':   sample_id,
+            'umap_x':  reducer.embedding_[:, 0],
+            'umap_y':  reducer.embedding_[:, 1],
+            'kmeans':  km.predict(sample_z),
+            'hdbscan': hdb.labels_,
+        }),
+    }
+
+
+def assign_streaming(model, path=WARS_CSV, out=STREAM_CSV, chunk_rows=CHUNK_ROWS, embed=True):
+    """Label every battle in path through the model, one chunk at a time."""
+    rows = 0
+    with stage('assign') as sp:
+        for i, chunk in enumerate(_chunks(path, chunk_rows)):
+            labels = assign(model, chunk, embed=embed)
+            labels.to_csv(out, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+            rows += len(labels)
+        sp.count(rows)
+    return rows
+
+
+# ── Agreement with the full-batch fit ────────────────────────────────────────
+def compare(path=WARS_CSV, chunk_rows=100, sample_rows=SAMPLE_ROWS, epochs=EPOCHS, n_seeds=5):
+    """Adjusted Rand index between full-batch and streaming labels on the same battles.
+
+    KMeans at k=8 is not stable from seed to seed on CDB90, so the report
+    includes the mean ARI between full-batch seeds as the ceiling to read the
+    streaming number against.
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.metrics import adjusted_rand_score
+    import hdbscan
+    from BattleCluster import standardize
+
+    ref_seed = 42
+    df = pd.read_csv(path)
+    Xs = standardize(df)[0]
+    Z  = PCA(n_components=10, random_state=42).fit_transform(Xs)
+    full = pd.DataFrame({'isqno':   df['isqno'],
+                         'kmeans':  KMeans(n_clusters=8, random_state=ref_seed).fit_predict(Z),
+                         'hdbscan': hdbscan.HDBSCAN(min_cluster_size=5).fit_predict(Z)})
+    # n_seeds other seeds against the reference fit
+    others = [s for s in range(n_seeds + 1) if s != ref_seed][:n_seeds]
+    seeds  = [adjusted_rand_score(full['kmeans'], KMeans(n_clusters=8, random_state=s).fit_predict(Z))
+              for s in others]
+
+    model  = fit_streaming(path, chunk_rows, sample_rows, epochs)
+    stream = assign(model, df, embed=False)
+    both   = full.merge(stream, on='isqno', suffixes=('_full', '_stream'))
+
+    def shape(labels):
+        return len(set(labels) - {-1}), float((labels == -1).mean())
+
+    return {
+        'battles':      len(both),
+        'chunks':       -(-len(df) // chunk_rows),
+        'sampled':      len(model['train']),
+        'kmeans_ari':   adjusted_rand_score(both['kmeans_full'], both['kmeans_stream']),
+        'kmeans_seeds': float(np.mean(seeds)),
+        'hdbscan_ari':  adjusted_rand_score(both['hdbscan_full'], both['hdbscan_stream']),
+        'hdbscan_full': shape(both['hdbscan_full'].to_numpy()),
+        'hdbscan_stream': shape(both['hdbscan_stream'].to_numpy()),
+        'pca_var':      (float(PCA(n_components=10).fit(Xs).explained_variance_ratio_.sum()),
+                         float(model['pca'].explained_variance_ratio_.sum())),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Streaming (mini-batch) clustering')
+    parser.add_argument('--wars', default=WARS_CSV, help='feature matrix built by BattleData/ChunkedBuild')
+    parser.add_argument('--out', default=STREAM_CSV)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--sample-rows', type=int, default=SAMPLE_ROWS)
+    parser.add_argument('--max-mb', type=float, default=MAX_MB, help='memory ceiling for a chunk plus the sample')
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--no-embed', action='store_true', help='skip UMAP coordinates for the assigned rows')
+    parser.add_argument('--compare', action='store_true', help='agreement with full-batch labels on --wars')
+    args = parser.parse_args()
+
+    chunk_rows, sample_rows = budget(args.max_mb, args.chunk_rows, args.sample_rows)
+
+    if args.compare:
+        # Small chunks so the real 660 battles really stream
+        r = compare(args.wars, min(chunk_rows, 100), sample_rows, args.epochs)
+        print(f"{r['battles']} battles in {r['chunks']} chunks, UMAP/HDBSCAN on {r['sampled']} sampled")
+        print(f"  KMeans  ARI full vs streaming: {r['kmeans_ari']:.3f}   "
+              f"(full-batch seed vs seed: {r['kmeans_seeds']:.3f})")
+        print(f"  HDBSCAN ARI full vs streaming: {r['hdbscan_ari']:.3f}   "
+              f"(clusters/noise {r['hdbscan_full'][0]}/{r['hdbscan_full'][1]:.0%} full, "
+              f"{r['hdbscan_stream'][0]}/{r['hdbscan_stream'][1]:.0%} streaming)")
+        print(f"  Explained variance, 10 components: PCA {r['pca_var'][0]:.3f}, "
+              f"IncrementalPCA {r['pca_var'][1]:.3f}")
+    else:
+        t0 = time.perf_counter()
+        model = fit_streaming(args.wars, chunk_rows, sample_rows, args.epochs)
+        os.makedirs(os.path.dirname(STREAM_MODEL), exist_ok=True)
+        joblib.dump(model, STREAM_MODEL)
+        rows = assign_streaming(model, args.wars, args.out, chunk_rows, embed=not args.no_embed)
+        print(f"Saved: {STREAM_MODEL}")
+        print(f"Saved: {args.out}  ({rows:,} battles, chunks of {chunk_rows:,}, "
+              f"sample {len(model['train']):,}, {time.perf_counter() - t0:.1f}s)")
@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from BattleStore import CDB90_PATH, CACHE_PATH
+
+# Synthetic CDB90-shaped corpora for scale testing.
+#
+# Every synthetic battle copies one real battle, drawn uniformly, across all
+# of the tables BattleData.py reads, so each column keeps its marginal
+# distribution (missing values included) and the attacker/defender rows stay
+# consistent with each other.  Strengths and casualties get a small lognormal
+# jitter so copies are not exact duplicates.  Commander names are redrawn from
+# a Zipf law fitted to the real rank-frequency curve, over a roster that grows
+# with the corpus: the famous names keep the top ranks and the long tail is
+# filled with generated names.
+
+SYNTH_PATH = f'{CACHE_PATH}/synthetic'
+TABLES     = ['battles', 'belligerents', 'battle_durations', 'front_widths', 'terrain', 'weather']
+SIZES      = [10_000, 100_000, 1_000_000]
+
+JITTER_COLS  = ['str', 'cas', 'cav']
+JITTER_SIGMA = 0.10
+
+
+def load_real(path=CDB90_PATH):
+    return {t: pd.read_csv(f'{path}/{t}.csv') for t in TABLES}
+
+
+def zipf_exponent(names):
+    """Slope of log frequency against log rank for the real commander counts."""
+    freq = names.value_counts().to_numpy(dtype=float)
+    rank = np.arange(1, len(freq) + 1)
+    slope, _ = np.polyfit(np.log(rank), np.log(freq), 1)
+    return -slope
+
+
+def _commanders(real_names, n_rows, rng):
+    s       = zipf_exponent(real_names)
+    ranked  = real_names.value_counts().index.to_list()
+    n_names = max(len(ranked), int(len(ranked) * n_rows / len(real_names)))
+    p       = np.arange(1, n_names + 1, dtype=float) ** -s
+    draws   = rng.choice(n_names, size=n_rows, p=p / p.sum())
+    roster  = np.array(ranked + [f'SYNTHETIC CO {i}' for i in range(len(ranked), n_names)], dtype=object)
+    return roster[draws]
+
+
+def synthesize(n_battles, seed=42, real=None):
+    """Dict of CDB90 tables with n_battles battles (isqno 1..n_battles)."""
+    rng  = np.random.default_rng(seed)
+    real = real or load_real()
+
+    src   = rng.choice(real['battles']['isqno'].to_numpy(), size=n_battles)
+    remap = pd.DataFrame({'src': src, 'isqno': np.arange(1, n_battles + 1)})
+
+    out = {}
+    for name, table in real.items():
+        t = remap.merge(table.rename(columns={'isqno': 'src'}), on='src').drop(columns='src')
+        out[name] = t.sort_values('isqno', kind='stable').reset_index(drop=True)
+
+    bel = out['belligerents']
+    for col in JITTER_COLS:
+        bel[col] = (bel[col] * rng.lognormal(0, JITTER_SIGMA, len(bel))).round()
+    bel['co'] = bel['co'].where(bel['co'].isna(), _commanders(real['belligerents']['co'].dropna(), len(bel), rng))
+    out['battles']['name'] = out['battles']['name'] + ' #' + out['battles']['isqno'].astype(str)
+    return out
+
+
+def write_synthetic(n_battles, seed=42, root=SYNTH_PATH):
+    """Write (or reuse) the CSVs for one size; returns the directory."""
+    path = f'{root}/n{n_battles}_s{seed}'
+    if all(os.path.exists(f'{path}/{t}.csv') for t in TABLES):
+        return path
+    os.makedirs(path, exist_ok=True)
+    for name, table in synthesize(n_battles, seed).items():
+        table.to_csv(f'{path}/{name}.csv', index=False)
+    return path
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:] if a.isdigit()] or SIZES
+    real  = load_real()
+    print(f"Real corpus: {len(real['battles'])} battles, "
+          f"{real['belligerents']['co'].nunique()} commanders, "
+          f"Zipf exponent {zipf_exponent(real['belligerents']['co'].dropna()):.2f}")
+    for n in sizes:
+        path = write_synthetic(n)
+        bel  = pd.read_csv(f'{path}/belligerents.csv', usecols=['co'])
+        print(f"  {n:>9,} battles -> {path}  ({bel['co'].nunique():,} commanders, "
+              f"Zipf {zipf_exponent(bel['co']):.2f})")
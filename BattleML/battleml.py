@@ -0,0 +1,236 @@
+import argparse
+import math
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+# One entry point for the pipeline:
+#
+#   python BattleML/battleml.py build | cluster | stats | h2h | viz | query | serve | elo ...
+#
+# Nothing heavy is imported at the top of this file.  Each subcommand imports
+# what it needs when it runs, so `h2h` answers from the saved exact matrix with
+# numpy alone and never pays for umap/numba, sklearn or matplotlib.
+# --profile-imports re-runs the command under `python -X importtime` and
+# reports import time per top-level module.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def _script(name, argv=()):
+    """Run one of the pipeline scripts as __main__ with the given arguments."""
+    from Instrument import stage
+
+    saved = sys.argv
+    sys.argv = [name, *argv]
+    try:
+        with stage(name):
+            runpy.run_path(os.path.join(HERE, name), run_name='__main__')
+    finally:
+        sys.argv = saved
+
+
+# ── Subcommands ───────────────────────────────────────────────────────────────
+def cmd_build(args):
+    if args.chunked:
+        _script('ChunkedBuild.py', ['--chunk-rows', str(args.chunk_rows)] + (['--root', args.root] if args.root else []))
+    else:
+        _script('BattleData.py')
+
+
+def cmd_cluster(args):
+    if args.consensus:
+        _script('ConsensusCluster.py', ['--resamples', str(args.consensus)])
+    elif args.stream:
+        _script('StreamCluster.py', ['--chunk-rows', str(args.chunk_rows), '--max-mb', str(args.max_mb)])
+    else:
+        _script('BattleCluster.py', ['--refit'] * args.refit + ['--fast'] * args.fast)
+
+
+def cmd_stats(args):
+    for name in ['NapoleonStats.py', 'NapoleonStatsv3.py'] if not args.bayes else ['NapoleonStatsv3.py']:
+        _script(name)
+
+
+def cmd_viz(args):
+    _script('BattleViz.py', ['--fast'] * args.fast)
+
+
+def cmd_h2h(args):
+    from BattlePaths import cluster_names
+    from HeadtoHeadMatrix import MATRIX_PATH, is_fresh, load_matrix, lookup
+
+    # The saved exact matrix answers without pandas; Monte Carlo on request
+    # or when the matrix is missing or was built from other inputs.
+    if not args.mc and is_fresh(MATRIX_PATH):
+        m = load_matrix(MATRIX_PATH)
+        missing = [g for g in (args.gen_a, args.gen_b) if g not in m['index']]
+        if missing:
+            sys.exit(f"Unknown commander: {', '.join(missing)}")
+        results = {}
+        for k in m['clusters']:
+            r = lookup(m, args.gen_a, args.gen_b, context=k)
+            if not math.isnan(r['win_pct_a']):             # NaN: below the per-cluster floor
+                results[cluster_names.get(int(k), f'Cluster {k}')] = r
+        results['OVERALL'] = lookup(m, args.gen_a, args.gen_b)
+        source = f'exact, {MATRIX_PATH}'
+    else:
+        import HeadtoHeadMC
+        results = HeadtoHeadMC.monte_carlo(args.gen_a, args.gen_b, n_sims=args.sims,
+                                           adaptive=args.adaptive, n_boot=args.boot)
+        if isinstance(results, tuple):                  # no shared clusters
+            results = results[0]
+        source = 'adaptive Monte Carlo' if args.adaptive else f'Monte Carlo, n={args.sims:,}'
+
+    from HeadtoHeadMC import print_matchup
+    print_matchup(args.gen_a, args.gen_b, results, n_boot=args.boot)
+    print(f"\n({source})")
+
+
+def cmd_query(args):
+    import SimilarBattles
+
+    index = SimilarBattles.load_index(rebuild=args.rebuild)
+    if not args.rebuild and SimilarBattles.is_stale(index):
+        index = SimilarBattles.load_index(rebuild=True)
+    rows = SimilarBattles.similar(args.battle, args.k, args.cluster, args.era, args.commander, index=index)
+    print(f"{'isqno':>6}  {'name':40s} {'kmeans':>6} {'era':>5} {'distance':>9}")
+    for r in rows:
+        print(f"{r['isqno']:>6}  {r['name'][:40]:40s} {r['kmeans']:>6} {r['era']:>5} {r['distance']:9.3f}")
+
+
+def cmd_serve(args):
+    _script('QueryServer.py', ['--host', args.host, '--port', str(args.port), '--cache-mb', str(args.cache_mb)]
+            + ['--no-similar'] * args.no_similar + (['--bench', str(args.bench)] if args.bench else []))
+
+
+def cmd_elo(args):
+    _script('EloRatings.py', [*args.commanders, '--top', str(args.top)] + ['--rebuild'] * args.rebuild)
+
+
+def cmd_scenarios(args):
+    _script('Scenarios.py', [*args.commanders] + ['--grid'] * args.grid + ['--rebuild'] * args.rebuild)
+
+
+def cmd_permtest(args):
+    _script('PermutationTests.py', [*args.commanders, '--permutations', str(args.permutations)]
+            + (['--workers', str(args.workers)] if args.workers else []) + ['--rebuild'] * args.rebuild)
+
+
+# ── Import profiling ──────────────────────────────────────────────────────────
+def profile_imports(argv, top=15):
+    """Re-run argv under -X importtime; print self time summed per top-level module."""
+    argv = [a for a in argv if a != '--profile-imports']
+    t0   = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), *argv],
+                          stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+
+    per_module, other = {}, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            other.append(line)
+            continue
+        if 'self [us]' in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        root = name.split('.')[0]
+        per_module[root] = per_module.get(root, 0) + int(self_us)
+
+    sys.stderr.write('\n'.join(other) + ('\n' if other else ''))
+    total = sum(per_module.values())
+    print(f"\n── Import time by top-level module ({len(per_module)} modules) ──")
+    for name, us in sorted(per_module.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {name:24s} {us / 1000:8.1f} ms  {us / max(total, 1):6.1%}")
+    print(f"  {'total imports':24s} {total / 1000:8.1f} ms")
+    print(f"  {'wall':24s} {wall * 1000:8.1f} ms")
+    return proc.returncode
+
+
+def parser():
+    p   = argparse.ArgumentParser(prog='battleml', description='Napoleon Battle Analytics pipeline')
+    p.add_argument('--profile-imports', action='store_true', help='report import time per module')
+    sub = p.add_subparsers(dest='command', required=True)
+
+    b = sub.add_parser('build', help='build the feature matrix (wars.csv)')
+    b.add_argument('--chunked', action='store_true', help='out-of-core build in isqno partitions')
+    b.add_argument('--chunk-rows', type=int, default=100_000, help='battles per partition (--chunked)')
+    b.add_argument('--root', help='CDB90 tables directory (--chunked)')
+    b.set_defaults(fn=cmd_build)
+
+    c = sub.add_parser('cluster', help='assign clusters with the saved pipeline')
+    c.add_argument('--refit', action='store_true', help='refit the pipeline (can renumber clusters)')
+    c.add_argument('--fast', action='store_true', help='batched plot labels')
+    c.add_argument('--stream', action='store_true', help='mini-batch fit over chunks (StreamCluster.py)')
+    c.add_argument('--chunk-rows', type=int, default=50_000, help='rows per chunk (--stream)')
+    c.add_argument('--max-mb', type=float, default=1024, help='memory ceiling (--stream)')
+    c.add_argument('--consensus', type=int, metavar='N', help='stability over N bootstrap refits (ConsensusCluster.py)')
+    c.set_defaults(fn=cmd_cluster)
+
+    s = sub.add_parser('stats', help='general comparison charts')
+    s.add_argument('--bayes', action='store_true', help='only the Bayesian (v3) charts')
+    s.set_defaults(fn=cmd_stats)
+
+    h = sub.add_parser('h2h', help='head-to-head between two commanders')
+    h.add_argument('gen_a')
+    h.add_argument('gen_b')
+    h.add_argument('--mc', action='store_true', help='Monte Carlo instead of the saved exact matrix')
+    h.add_argument('--sims', type=int, default=100_000)
+    h.add_argument('--adaptive', action='store_true')
+    h.add_argument('--boot', type=int, default=0, help='battle bootstrap replicates')
+    h.set_defaults(fn=cmd_h2h)
+
+    v = sub.add_parser('viz', help='UMAP cluster charts')
+    v.add_argument('--fast', action='store_true', help='batched plot labels')
+    v.set_defaults(fn=cmd_viz)
+
+    q = sub.add_parser('query', help='battles most similar to a battle')
+    q.add_argument('battle', help='isqno or battle name, e.g. AUSTERLITZ')
+    q.add_argument('-k', type=int, default=10)
+    q.add_argument('--cluster', type=int)
+    q.add_argument('--era', type=int, help='century, e.g. 1800')
+    q.add_argument('--commander')
+    q.add_argument('--rebuild', action='store_true')
+    q.set_defaults(fn=cmd_query)
+
+    sv = sub.add_parser('serve', help='local JSON query server (QueryServer.py)')
+    sv.add_argument('--host', default='127.0.0.1')
+    sv.add_argument('--port', type=int, default=8765)
+    sv.add_argument('--cache-mb', type=float, default=64, help='response cache size')
+    sv.add_argument('--no-similar', action='store_true', help='skip the similar-battle index')
+    sv.add_argument('--bench', type=int, metavar='N', help='report latency over N in-process queries')
+    sv.set_defaults(fn=cmd_serve)
+
+    e = sub.add_parser('elo', help='chronological Elo ratings (EloRatings.py)')
+    e.add_argument('commanders', nargs='*', help='print their rating histories')
+    e.add_argument('--top', type=int, default=20)
+    e.add_argument('--rebuild', action='store_true', help='replay the full history')
+    e.set_defaults(fn=cmd_elo)
+
+    sc = sub.add_parser('scenarios', help='counterfactual battle scenarios (Scenarios.py)')
+    sc.add_argument('commanders', nargs='*', help='default: Napoleon, Wellington, Lee, Grant')
+    sc.add_argument('--grid', action='store_true', help='time the full roster x scenario grid')
+    sc.add_argument('--rebuild', action='store_true', help='refit the model')
+    sc.set_defaults(fn=cmd_scenarios)
+
+    pt = sub.add_parser('permtest', help='within-cluster permutation tests vs peers (PermutationTests.py)')
+    pt.add_argument('commanders', nargs='*', help='default: Napoleon')
+    pt.add_argument('--permutations', type=int, default=100_000)
+    pt.add_argument('--workers', type=int)
+    pt.add_argument('--rebuild', action='store_true', help='rerun even if the data is unchanged')
+    pt.set_defaults(fn=cmd_permtest)
+    return p
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    if args.profile_imports:
+        sys.exit(profile_imports(sys.argv[1:]))
+
+    # Every script resolves './BattleML/...' from the repo root
+    os.chdir(ROOT)
+    sys.path.insert(0, HERE)
+    args.fn(args)